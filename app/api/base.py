@@ -1,9 +1,11 @@
 import logging
 
 from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app import metrics
 from app.config import settings
 from app.deps import get_db
 
@@ -39,6 +41,14 @@ async def readiness_probe(db: AsyncSession = Depends(get_db)) -> str:
     return "OK"
 
 
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint() -> PlainTextResponse:
+    """
+    Метрики сервиса в текстовом формате Prometheus.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 if settings.DEBUG:
 
     @router.get("/http_error")
@@ -0,0 +1,51 @@
+from datetime import datetime
+from typing import Any, AsyncIterator, Optional
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.apps.urls import schemas
+from app.apps.urls.export import export_query, export_rows
+from app.db import replicas
+from app.deps import get_db
+
+
+router = APIRouter()
+media_types = {schemas.ExportFormat.ndjson: "application/x-ndjson", schemas.ExportFormat.csv: "text/csv"}
+
+
+@router.get("/{table}")
+async def export_table(
+    table: schemas.ExportTable,
+    export_format: schemas.ExportFormat = Query(schemas.ExportFormat.ndjson, alias="format"),
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    after: Optional[str] = None,
+    session: AsyncSession = Depends(get_db),
+) -> Any:
+    """
+    Потоково выгружает ссылки (urls) или переходы по ним (clicks), созданные
+    в [created_from, created_to), в формате NDJSON или CSV. Строки идут в порядке
+    курсора: для ссылок это "<created_at>,<id>", для переходов - "<id>". Чтобы
+    продолжить прерванную выгрузку, курсор последней полученной строки передаётся в after.
+    Читает с реплики, если есть годная. Если она отвалится посреди выгрузки, переключаться
+    на основную БД уже поздно: выгрузка оборвётся, и её нужно продолжить с after.
+    """
+    query = export_query(table, created_from, created_to, after)
+
+    async def rows() -> AsyncIterator[str]:
+        replica_session = replicas.session()
+        if replica_session is None:
+            async for chunk in export_rows(session, query, export_format):
+                yield chunk
+            return
+        async with replica_session:
+            async for chunk in export_rows(replica_session, query, export_format):
+                yield chunk
+
+    return StreamingResponse(
+        rows(),
+        media_type=media_types[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{table.value}.{export_format.value}"'},
+    )
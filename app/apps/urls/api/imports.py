@@ -0,0 +1,34 @@
+from typing import Any, AsyncIterator
+
+from fastapi import APIRouter, Depends, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.apps.urls import schemas
+from app.apps.urls.imports import import_urls, read_lines
+from app.deps import get_db
+from app.responses import NDJSONResponse
+
+
+router = APIRouter()
+
+
+@router.post("/urls")
+async def import_urls_file(
+    request: Request,
+    import_format: schemas.ImportFormat = Query(schemas.ImportFormat.ndjson, alias="format"),
+    warm: bool = False,
+    session: AsyncSession = Depends(get_db),
+) -> Any:
+    """
+    Импортирует ссылки с заданными кодами из тела запроса: CSV с колонками code, url,
+    created_at или NDJSON с такими же полями (вместо code можно id, как в /export/urls).
+    Тело читается потоково. В ответе (NDJSON) по строке UrlImportError на каждую
+    невалидную строку и конфликт кодов, последней строкой - итог UrlImportResult.
+    С warm=true добавленные ссылки сразу записываются в Redis.
+    """
+
+    async def results() -> AsyncIterator[str]:
+        async for item in import_urls(session, read_lines(request), import_format, warm):
+            yield item.json() + "\n"
+
+    return NDJSONResponse(results())
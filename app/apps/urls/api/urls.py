@@ -1,126 +1,559 @@
 import asyncio
 import logging
-import random
-from datetime import timedelta
-from string import ascii_letters, digits
-from typing import Any
+import time
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Any, AsyncContextManager, AsyncIterator, Callable, List, Mapping, Optional, Sequence, Tuple, Union
 
+import sqlalchemy as sa
 from aioredis import RedisError
-from fastapi import APIRouter, Depends, Request, Response, status
-from fastapi.responses import RedirectResponse
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends, Header, Request, Response, status
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from starlette.types import ASGIApp, Receive, Scope, Send
 
-from app.apps.urls import models, schemas
+from app import metrics
+from app.apps.urls import models, reads, schemas, stats
+from app.apps.urls.cache import (
+    invalidate_url,
+    MISSING_URL,
+    missing_urls,
+    redis_writes,
+    stats_cache,
+    url_cache,
+    url_lookups,
+)
+from app.apps.urls.clicks import click_buffer
+from app.apps.urls.codes import code_allocator
+from app.apps.urls.dedup import (
+    claim_idempotency_key,
+    complete_idempotency_key,
+    find_existing_code,
+    forget_code,
+    release_idempotency_key,
+    remember_code,
+)
+from app.apps.urls.imports import read_lines
+from app.apps.urls.redirects import BODY_MESSAGE, CachedRedirectResponse, Redirect
+from app.apps.urls.visitors import count_visitors, visitor_id
 from app.config import settings
-from app.deps import get_db, redis
-from app.exceptions import ResourceNotFoundError
-from app.utils import utcnow
+from app.deps import get_db, get_db_connect, redis, redis_batch, redis_breaker, redis_raw_batch
+from app.exceptions import ResourceNotFoundError, ShortCodeAllocationError
+from app.redis_client import CircuitOpenError
+from app.responses import NDJSONResponse
+from app.utils import hash_url, ttl_until, utcnow
 
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
-letters = [i for i in ascii_letters + digits if i not in ("i", "I", "l")]  # Удалим те, что похожи друг на друга
 short_code_not_found = "Данная короткая ссылка не существует. Похоже, мы её потеряли =("
+stats_cache_control = f"public, max-age={settings.STATS_CACHE_TTL}"
 
+# Счётчики источников ссылки при редиректе, заранее с метками, чтобы не создавать их на каждый запрос.
+local_hits = metrics.redirect_lookups.labels("local", "hit")
+local_missing_hits = metrics.redirect_lookups.labels("local", "missing")
+redis_hits = metrics.redirect_lookups.labels("redis", "hit")
+redis_missing_hits = metrics.redirect_lookups.labels("redis", "missing")
+redis_misses = metrics.redirect_lookups.labels("redis", "miss")
+redis_errors = metrics.redirect_lookups.labels("redis", "error")
+redis_bypasses = metrics.redirect_lookups.labels("redis", "bypass")  # Цепь Redis разомкнута
+db_hits = metrics.redirect_lookups.labels("db", "hit")
+db_misses = metrics.redirect_lookups.labels("db", "miss")
 
-def create_short_code() -> str:
+
+async def redis_set(short_code: str, long_url: str, expires_at: datetime) -> None:
     """
-    Создаёт код, который будет использован для короткой ссылки.
+    Шорткат для записи длинного урла long_url в Redis по ключу,
+    состоящему из "кода" short_code короткого урла. Ключ живёт не дольше
+    срока ссылки expires_at, так что истёкшую ссылку Redis уже не отдаст.
     """
-    short_code = "".join(random.choice(letters) for _ in range(models.SHORT_CODE_LEN))
-    return short_code
+    ttl = ttl_until(expires_at, settings.REDIS_URL_TTL)
+    if ttl:
+        await redis_batch.set(settings.REDIS_URL_KEY.format(short_code), long_url, px=ttl)
 
 
-async def create_unique_short_code(session: AsyncSession) -> str:
-    """
-    Создаёт уникальный код, который будет использован для короткой ссылки.
-    Честно говоря мне не нравится такой метод, с проверкой в БД. Можно было бы
-    подумать про последовательную генерацию "кодов", но не хотелось бы чтобы
-    люди могли вручную подбирать чужие ссылки (когда код непоследователен, а
-    БД далека от заполнения, шанс такого "попадания" невелик). Так же можно было
-    бы придумать хеш-функцию для длинного УРЛа, но в ТЗ чётко сказано, что
-    короткой ссылке можно обновить длинную на любую. Но даже при таком способе
-    проверки в БД при 59 символах и длине кода = 6 будет существовать 42млрд.
-    комбинаций и потому статистически вероятность коллизий мала, а, значит, и
-    количество лишних запросов в БД будет небольшим.
-    Если же мы будем популярны, то стоит поменять длину на 7, что составит
-    2.5 трлн. комбинаций.
-    Вопрос хранилища встанет гораздо раньше и начать, наверное, стоит с партицирования
-    в Postgres, возможно, использования SSD и т.п. улучшений.
-    """
-    while True:
-        short_code = create_short_code()
-        url_obj = await models.Url.get_by_id(session, short_code)
-        if not url_obj:
-            return short_code
-
-
-async def redis_set(short_code: str, long_url: str) -> None:
+async def redis_set_and_invalidate(short_code: str, long_url: str, expires_at: datetime) -> None:
     """
-    Шорткат для записи длинного урла long_url в Redis по ключу,
-    состоящему из "кода" short_code короткого урла.
+    Записывает новый длинный урл в Redis и только после этого сбрасывает
+    кеши процессов, чтобы они не успели перечитать из Redis старое значение.
     """
-    await redis.set(settings.REDIS_URL_KEY.format(short_code), long_url, ex=settings.REDIS_URL_TTL)
+    await redis_set(short_code, long_url, expires_at)
+    await invalidate_url(short_code)
 
 
 @router.post("", response_model=schemas.Url)
-async def create_short_url(data: schemas.UrlCreate, request: Request, session: AsyncSession = Depends(get_db)) -> Any:
+async def create_short_url(
+    data: schemas.UrlCreate,
+    request: Request,
+    dedup: bool = settings.CREATE_DEDUP,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    session: AsyncSession = Depends(get_db),
+) -> Any:
     """
     Генерирует новый короткий URL, и возвращает его в
     формате <hostname>/urls/<short code>, где <short code>
     это короткий уникальный "код" ссылки.
+    С dedup=true для урла, который уже сокращали, возвращается существующий код
+    (если в data не указан свой срок expires_at).
+    С заголовком Idempotency-Key повтор запроса с тем же ключом возвращает тот же
+    код, а не создаёт ещё одну ссылку.
     """
-    short_code = await create_unique_short_code(session)
+    url_hash = hash_url(data.url)
+    claimed_key: Optional[str] = None
+    if idempotency_key is not None:
+        try:
+            short_code = await claim_idempotency_key(idempotency_key, url_hash)
+        except RedisError:
+            # Без Redis повтор запроса не узнать, так что хотя бы не создадим вторую ссылку на тот же урл.
+            logger.exception("Error while claiming idempotency key in Redis")
+            dedup = True
+        else:
+            if short_code is not None:
+                return schemas.Url(url_short=request.url_for("redirect_to_long_url", short_code=short_code))
+            claimed_key = idempotency_key
 
-    url_obj = models.Url(**data.dict(), id=short_code)
-    session.add(url_obj)
-    await session.flush()
+    try:
+        short_code = await create_url(session, data.url, url_hash, dedup, data.expires_at)
+    except BaseException:
+        if claimed_key is not None:
+            await release_idempotency_key(claimed_key)
+        raise
+    if claimed_key is not None:
+        await complete_idempotency_key(claimed_key, url_hash, short_code)
+    return schemas.Url(url_short=request.url_for("redirect_to_long_url", short_code=short_code))
+
+
+async def create_url(
+    session: AsyncSession, long_url: str, url_hash: str, dedup: bool, expires_at: Optional[datetime] = None
+) -> str:
+    """
+    Создаёт ссылку на long_url, истекающую в expires_at (по умолчанию - через SHORT_URL_TTL),
+    и возвращает её код. dedup работает только для ссылок со сроком по умолчанию: без своего
+    срока сначала ищется уже существующая такая ссылка на тот же урл (см. find_existing_code),
+    а ссылка со своим сроком не ищется и не запоминается для следующих запросов.
+    """
+    custom_expiry = expires_at is not None
+    dedup = dedup and not custom_expiry
+    if dedup:
+        short_code = await find_existing_code(session, long_url, url_hash)
+        if short_code is not None:
+            return short_code
+
+    created_at = utcnow()
+    expires_at = expires_at or models.default_expires_at(created_at)
+    for _ in range(settings.SHORT_CODE_ATTEMPTS):
+        short_code = await code_allocator.allocate(session)
+        if await models.Url.insert_if_absent(
+            session,
+            id=short_code,
+            url=long_url,
+            url_hash=url_hash,
+            created_at=created_at,
+            expires_at=expires_at,
+            custom_expiry=custom_expiry,
+        ):
+            break
+        metrics.code_allocation_retries.inc()
+    else:
+        raise ShortCodeAllocationError("Не удалось подобрать свободную короткую ссылку")
     await session.commit()
+    await reads.mark_written([short_code])
 
-    # Создадим отложенную таску (чтобы юзер не ждал) с записью соответствий URL в Redis.
-    asyncio.create_task(redis_set(short_code, data.url))
-    return schemas.Url(url_short=request.url_for("redirect_to_long_url", short_code=short_code))
+    # Ждём запись в Redis, чтобы сразу сбросить отметку о несуществующем коде, если она была.
+    try:
+        await redis_set_many({short_code: (long_url, expires_at)})
+    except RedisError:
+        missing_urls.invalidate(short_code)
+        logger.exception("Error while setting data to Redis")
+    if dedup:
+        await remember_code(url_hash, short_code, expires_at)
+    return short_code
 
 
-@router.get("/{short_code}")
-async def redirect_to_long_url(short_code: str, session: AsyncSession = Depends(get_db)) -> Any:
+async def redis_set_many(urls: Mapping[str, Tuple[str, datetime]]) -> None:
     """
-    Перенаправляет пользователя на оригинальную ссылку
-    по уникальному "коду" short_code из короткой ссылки.
+    Записывает в Redis сразу много соответствий "код -> (длинный урл, срок ссылки)" одной
+    транзакцией вместе с чтением старых значений. Если для какого-то кода было запомнено, что
+    ссылки нет, сбрасывает эту отметку во всех процессах, чтобы ссылка сразу стала доступна.
+    """
+
+    async def write() -> List[Any]:
+        async with redis.pipeline() as pipe:
+            pipe.mget([settings.REDIS_URL_KEY.format(short_code) for short_code in urls])
+            for short_code, (long_url, expires_at) in urls.items():
+                ttl = ttl_until(expires_at, settings.REDIS_URL_TTL)
+                if ttl:
+                    pipe.set(settings.REDIS_URL_KEY.format(short_code), long_url, px=ttl)
+            return await pipe.execute()
+
+    previous, *_ = await redis_breaker.call(write)
+
+    for short_code, value in zip(urls, previous):
+        if value == MISSING_URL:
+            await invalidate_url(short_code)
+
+
+async def create_short_urls(session: AsyncSession, items: Sequence[schemas.UrlCreate]) -> List[str]:
+    """
+    Создаёт короткие ссылки для items одним INSERT-ом (плюс повторы для
+    занятых кодов) и возвращает их коды в том же порядке.
+    """
+    long_urls = [item.url for item in items]
+    created_at = utcnow()
+    default_expires_at = models.default_expires_at(created_at)
+    expires = [item.expires_at or default_expires_at for item in items]
+    short_codes = await code_allocator.allocate_many(session, len(long_urls))
+    url_hashes = [hash_url(long_url) for long_url in long_urls]
+    pending = list(range(len(long_urls)))
+    for _ in range(settings.SHORT_CODE_ATTEMPTS):
+        inserted = await models.Url.insert_many_if_absent(
+            session,
+            [
+                {
+                    "id": short_codes[i],
+                    "url": long_urls[i],
+                    "url_hash": url_hashes[i],
+                    "created_at": created_at,
+                    "expires_at": expires[i],
+                    "custom_expiry": items[i].expires_at is not None,
+                }
+                for i in pending
+            ],
+        )
+        not_inserted = []
+        for i in pending:
+            if short_codes[i] in inserted:
+                inserted.remove(short_codes[i])  # Если код в пачке повторился, то вставлен только первый
+            else:
+                not_inserted.append(i)
+
+        pending = not_inserted
+        if not pending:
+            break
+        metrics.code_allocation_retries.inc(len(pending))
+        for i, short_code in zip(pending, await code_allocator.allocate_many(session, len(pending))):
+            short_codes[i] = short_code
+    else:
+        raise ShortCodeAllocationError("Не удалось подобрать свободную короткую ссылку")
+    await session.commit()
+    await reads.mark_written(short_codes)
+
+    await redis_writes.submit(partial(redis_set_many, dict(zip(short_codes, zip(long_urls, expires)))))
+    return short_codes
+
+
+async def create_bulk_items(
+    session: AsyncSession, request: Request, items: Sequence[Union[schemas.UrlCreate, ValidationError]]
+) -> List[schemas.UrlBulkItem]:
+    """
+    Создаёт короткие ссылки для items и возвращает результаты в том же порядке.
+    Для элементов, которые не прошли валидацию, в результат попадает текст ошибки.
+    """
+    valid_items = [item for item in items if isinstance(item, schemas.UrlCreate)]
+    short_codes = iter(await create_short_urls(session, valid_items) if valid_items else [])
+
+    results = []
+    for item in items:
+        if isinstance(item, ValidationError):
+            results.append(schemas.UrlBulkItem(error="; ".join(error["msg"] for error in item.errors())))
+        else:
+            url_short = request.url_for("redirect_to_long_url", short_code=next(short_codes))
+            results.append(schemas.UrlBulkItem(url_short=url_short))
+    return results
+
+
+@router.post("/bulk", response_model=schemas.UrlBulkResponse)
+async def create_short_urls_bulk(
+    data: schemas.UrlBulkCreate, request: Request, session: AsyncSession = Depends(get_db)
+) -> Any:
+    """
+    Генерирует короткие URL для всех ссылок из data
+    и возвращает их в том же порядке.
+    """
+    results = []
+    for i in range(0, len(data.urls), settings.BULK_CHUNK_SIZE):
+        chunk = data.urls[i : i + settings.BULK_CHUNK_SIZE]
+        results.extend(await create_bulk_items(session, request, chunk))
+    return schemas.UrlBulkResponse(urls=results)
+
+
+@router.post("/bulk/ndjson")
+async def create_short_urls_ndjson(request: Request, session: AsyncSession = Depends(get_db)) -> Any:
+    """
+    Потоковый вариант /bulk: в теле запроса по одному объекту UrlCreate
+    на строку (NDJSON), в ответе - по одному UrlBulkItem на строку в том
+    же порядке. Строки обрабатываются пачками по BULK_CHUNK_SIZE, поэтому
+    размер запроса не ограничен.
+    """
+
+    async def results() -> AsyncIterator[str]:
+        chunk: List[Union[schemas.UrlCreate, ValidationError]] = []
+        async for line in read_lines(request):
+            if not line.strip():
+                continue
+            try:
+                chunk.append(schemas.UrlCreate.parse_raw(line))
+            except ValidationError as e:
+                chunk.append(e)
+
+            if len(chunk) >= settings.BULK_CHUNK_SIZE:
+                yield "".join(item.json() + "\n" for item in await create_bulk_items(session, request, chunk))
+                chunk = []
+
+        if chunk:
+            yield "".join(item.json() + "\n" for item in await create_bulk_items(session, request, chunk))
+
+    return NDJSONResponse(results())
+
+
+async def wait_for_url_lookup(short_code: str) -> Optional[Tuple[str, int]]:
     """
+    Берёт в Redis короткую блокировку на поиск short_code в БД, чтобы при промахе
+    в БД шёл только один процесс. Если блокировку уже держит другой процесс, ждёт,
+    пока тот положит ссылку в Redis, и возвращает её вместе с оставшимся временем
+    жизни ключа в миллисекундах (PTTL). None - искать в БД нужно самим.
+    """
+    if not settings.REDIS_LOOKUP_LOCK_TTL:
+        return None
+
+    lock_key = settings.REDIS_LOOKUP_LOCK_KEY.format(short_code)
+    try:
+        if await redis_batch.set(lock_key, 1, px=settings.REDIS_LOOKUP_LOCK_TTL, nx=True):
+            return None
+
+        deadline = time.monotonic() + settings.REDIS_LOOKUP_LOCK_TTL / 1000
+        while time.monotonic() < deadline:
+            await asyncio.sleep(settings.REDIS_LOOKUP_POLL_INTERVAL)
+            key = settings.REDIS_URL_KEY.format(short_code)
+            redirect_url, ttl, locked = await asyncio.gather(
+                redis_batch.get(key),
+                redis_batch.execute_command("PTTL", key),
+                redis_batch.execute_command("EXISTS", lock_key),
+            )
+            if redirect_url is not None:
+                return redirect_url, ttl
+            if not locked:
+                return None
+    except CircuitOpenError:
+        pass  # Redis недоступен, ищем в БД сами
+    except RedisError:
+        logger.exception("Error while waiting for url lookup in Redis")
+    return None
+
+
+async def redis_set_and_unlock(short_code: str, long_url: str, expires_at: Optional[datetime]) -> None:
+    """
+    Записывает найденный в БД урл со сроком expires_at (или MISSING_URL, если ссылки нет) в Redis
+    и только потом снимает блокировку поиска, чтобы ждущие процессы увидели уже готовое значение.
+    """
+    try:
+        if long_url and expires_at is not None:
+            await redis_set(short_code, long_url, expires_at)
+        else:
+            # nx - чтобы не затереть ссылку, созданную, пока мы искали в БД
+            key = settings.REDIS_URL_KEY.format(short_code)
+            await redis_batch.set(key, MISSING_URL, ex=settings.REDIS_MISSING_URL_TTL, nx=True)
+        if settings.REDIS_LOOKUP_LOCK_TTL:
+            await redis_batch.delete(settings.REDIS_LOOKUP_LOCK_KEY.format(short_code))
+    except CircuitOpenError:
+        pass  # Значение осталось в кеше процесса, а блокировка истечёт сама
+    except RedisError:
+        logger.exception("Error while setting data to Redis")
+
+
+async def load_url(
+    short_code: str, db_connect: Callable[[], AsyncContextManager[AsyncConnection]]
+) -> Optional[Redirect]:
+    """
+    Ищет длинный урл при промахе url_cache: сначала в Redis, потом в БД.
+    Если ссылки нет или она истекла, возвращает None и запоминает это в кешах, чтобы
+    перебор несуществующих кодов не доходил до БД.
+    В url_cache ссылка кладётся не дольше, чем живёт её ключ в Redis (а он - не дольше
+    срока ссылки), так что истёкшая ссылка пропадает из памяти ровно в свой срок.
+    Вызывается через url_lookups, поэтому на каждый код в процессе одновременно
+    идёт не больше одного такого поиска.
+    """
+    cache_generation = url_cache.generation
+    missing_generation = missing_urls.generation
+    redirect_url: Optional[str] = None
+    ttl: Optional[float] = None  # Сколько секунд ссылку можно держать в url_cache, None - LOCAL_CACHE_TTL
+    key = settings.REDIS_URL_KEY.format(short_code)
     try:
-        redirect_url = await redis.get(settings.REDIS_URL_KEY.format(short_code))
+        # Без декодирования в клиенте: для строки, из которой собирается Redirect, хватит одного decode().
+        # PTTL уходит в Redis тем же пайплайном, отдельного похода за ним нет.
+        cached, key_ttl = await asyncio.gather(redis_raw_batch.get(key), redis_raw_batch.execute_command("PTTL", key))
+    except CircuitOpenError:
+        redis_bypasses.inc()
     except RedisError:
-        redirect_url = None
+        redis_errors.inc()
         logger.exception("Error while getting data from Redis")
+    else:
+        redirect_url = cached.decode() if cached is not None else None
+        ttl = key_ttl / 1000 if key_ttl > 0 else None
+        (redis_misses if redirect_url is None else redis_hits if redirect_url else redis_missing_hits).inc()
 
-    if redirect_url:
-        asyncio.create_task(models.UrlStats.create(short_code))
-        return RedirectResponse(redirect_url)
+    if redirect_url is None:
+        found = await wait_for_url_lookup(short_code)
+        if found is not None:
+            redirect_url, key_ttl = found
+            ttl = key_ttl / 1000 if key_ttl > 0 else None
 
-    url_obj = await models.Url.get_by_id(session, short_code)
-    if not url_obj:
+    if redirect_url is None:
+
+        async def get_redirect_from_primary() -> Optional[sa.engine.Row]:
+            async with db_connect() as connection:
+                return await models.Url.get_redirect(connection, short_code)
+
+        row = await reads.read(
+            partial(models.Url.get_redirect, url_id=short_code), get_redirect_from_primary, short_code
+        )
+        redirect_url, expires_at = (row.url, row.expires_at) if row is not None else (MISSING_URL, None)
+        if expires_at is not None:
+            ttl = ttl_until(expires_at, settings.LOCAL_CACHE_TTL) / 1000
+        (db_hits if redirect_url else db_misses).inc()
+        await redis_writes.submit(
+            partial(redis_set_and_unlock, short_code, redirect_url, expires_at), key=("set", short_code)
+        )
+
+    if not redirect_url:
+        missing_urls.set(short_code, True, missing_generation)
+        return None
+    redirect = Redirect(redirect_url)
+    url_cache.set(short_code, redirect, cache_generation, ttl)
+    return redirect
+
+
+class RedirectFastPath:
+    """
+    ASGI-middleware, которое отдаёт редиректы по ссылкам из url_cache сразу готовым
+    ответом (см. Redirect), минуя роутер, разбор зависимостей FastAPI и обработчики
+    исключений. Всё остальное, включая промахи url_cache, идёт дальше в приложение,
+    так что url_cache проверяется только здесь. В метриках такие ответы записываются
+    на redirect_to_long_url.
+    """
+
+    def __init__(self, app: ASGIApp, prefix: str) -> None:
+        self.app = app
+        self.prefix = prefix + "/"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["method"] == "GET" and scope["path"].startswith(self.prefix):
+            short_code = scope["path"][len(self.prefix) :]
+            # Статистика и прочие ручки под prefix - не редиректы, и для кеша это были бы лишние промахи
+            redirect = url_cache.get(short_code) if short_code and "/" not in short_code else None
+            if redirect is not None:
+                local_hits.inc()
+                scope["endpoint"] = redirect_to_long_url
+                click_buffer.add(short_code, visitor_id(scope))
+                await send(redirect.start_message)
+                await send(BODY_MESSAGE)
+                return
+        await self.app(scope, receive, send)
+
+
+@router.get("/{short_code}")
+async def redirect_to_long_url(
+    short_code: str,
+    request: Request,
+    db_connect: Callable[[], AsyncContextManager[AsyncConnection]] = Depends(get_db_connect),
+) -> Any:
+    """
+    Перенаправляет пользователя на оригинальную ссылку
+    по уникальному "коду" short_code из короткой ссылки.
+    Ссылки из url_cache отдаёт RedirectFastPath, сюда доходят только промахи.
+    Соединение с БД берётся из пула, только если ссылки нет ни в одном из кешей.
+    """
+    if missing_urls.get(short_code):
+        local_missing_hits.inc()
+        raise ResourceNotFoundError(short_code_not_found)
+    redirect = await url_lookups.do(short_code, partial(load_url, short_code, db_connect))
+    if redirect is None:
         raise ResourceNotFoundError(short_code_not_found)
 
-    asyncio.create_task(redis_set(short_code, url_obj.url))
-    asyncio.create_task(models.UrlStats.create(short_code))
-    return RedirectResponse(url_obj.url)
+    click_buffer.add(short_code, visitor_id(request.scope))
+    return CachedRedirectResponse(redirect)
 
 
 @router.get("/{short_code}/stats", response_model=schemas.StatsResponse)
-async def get_short_url_stats(short_code: str, session: AsyncSession = Depends(get_db)) -> Any:
+async def get_short_url_stats(short_code: str, response: Response, session: AsyncSession = Depends(get_db)) -> Any:
     """
-    Возвращает количество переходов
-    по ссылке за последние 24 часа.
+    Возвращает количество переходов по ссылке за последние
+    24 часа и оценку числа уникальных посетителей за это время.
     """
-    url_obj = await models.Url.get_by_id(session, short_code)
-    if not url_obj:
-        raise ResourceNotFoundError(short_code_not_found)
+    response.headers["Cache-Control"] = stats_cache_control
+    cache_key = f"24h:{short_code}"
+    result = stats_cache.get(cache_key)
+    if result is not None:
+        return result
 
     dt_to = utcnow()
     dt_from = dt_to - timedelta(hours=24)
-    number_of_redirects = await models.UrlStats.count_hours_stats(session, short_code, dt_from, dt_to)
-    return schemas.StatsResponse(redirects_in_24_hours=number_of_redirects)
+
+    async def count_redirects(db: AsyncSession) -> Optional[int]:
+        if not await models.Url.get_by_id(db, short_code):
+            return None
+        return await models.UrlStats.count_hours_stats(db, short_code, dt_from, dt_to)
+
+    number_of_redirects = await reads.read(count_redirects, partial(count_redirects, session), short_code)
+    if number_of_redirects is None:
+        raise ResourceNotFoundError(short_code_not_found)
+    try:
+        unique_visitors: Optional[int] = await count_visitors(short_code, dt_to)
+    except RedisError:
+        unique_visitors = None
+        logger.exception("Error while counting unique visitors in Redis")
+    result = schemas.StatsResponse(
+        redirects_in_24_hours=number_of_redirects, unique_visitors_in_24_hours=unique_visitors
+    )
+    stats_cache.set(cache_key, result)
+    return result
+
+
+@router.get("/{short_code}/stats/series", response_model=schemas.StatsSeries)
+async def get_short_url_stats_series(
+    short_code: str,
+    response: Response,
+    granularity: schemas.StatsGranularity = schemas.StatsGranularity.hour,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    session: AsyncSession = Depends(get_db),
+) -> Any:
+    """
+    Возвращает переходы по ссылке по минутам, часам или дням (UTC) в окне [start, end).
+    Границы окна выравниваются по интервалам, по умолчанию это последний час по минутам,
+    последние сутки по часам или последние 30 дней по дням. Считается по заранее
+    агрегированным счётчикам, поэтому цена запроса не зависит от числа переходов.
+    """
+    window_start, window_end = stats.stats_window(granularity, start, end)
+    response.headers["Cache-Control"] = stats_cache_control
+    cache_key = f"series:{short_code}:{granularity.value}:{window_start.isoformat()}:{window_end.isoformat()}"
+    series = stats_cache.get(cache_key)
+    if series is not None:
+        return series
+
+    async def get_series(db: AsyncSession) -> Optional[schemas.StatsSeries]:
+        if not await models.Url.get_by_id(db, short_code):
+            return None
+        return await stats.get_series(db, short_code, granularity, window_start, window_end)
+
+    series = await reads.read(get_series, partial(get_series, session), short_code)
+    if series is None:
+        raise ResourceNotFoundError(short_code_not_found)
+    stats_cache.set(cache_key, series)
+    return series
+
+
+@router.post("/stats", response_model=schemas.StatsBatchResponse)
+async def get_short_urls_stats(data: schemas.StatsBatchRequest, session: AsyncSession = Depends(get_db)) -> Any:
+    """
+    Возвращает количество переходов по каждой ссылке из data.codes в окне [start, end),
+    выровненном по интервалам granularity, как в /{short_code}/stats/series.
+    Для несуществующих ссылок возвращается 0.
+    """
+    granularity = schemas.StatsGranularity(data.granularity)
+    start, end = stats.stats_window(granularity, data.start, data.end)
+    counts = await stats.count_clicks(session, data.codes, granularity, start, end)
+    return schemas.StatsBatchResponse(granularity=granularity, start=start, end=end, counts=counts)
 
 
 @router.put("/{short_code}", response_model=schemas.Url)
@@ -135,12 +568,23 @@ async def update_short_url(
     if not url_obj:
         raise ResourceNotFoundError(short_code_not_found)
 
+    old_url_hash = url_obj.url_hash
     url_obj.url = data.url
+    url_obj.url_hash = hash_url(data.url)
+    if data.expires_at is not None:
+        url_obj.expires_at = data.expires_at
+        url_obj.custom_expiry = True
     session.add(url_obj)
     await session.flush()
     await session.commit()
+    await reads.mark_written([short_code])
+    await forget_code(old_url_hash)
 
-    asyncio.create_task(redis_set(short_code, data.url))
+    url_cache.invalidate(short_code)
+    # Без инвалидации остальные процессы будут отдавать старую ссылку, так что при переполнении очереди пишем сами.
+    job = partial(redis_set_and_invalidate, short_code, data.url, url_obj.expires_at)
+    if not await redis_writes.submit(job, key=("update", short_code)):
+        await job()
     return schemas.Url(url_short=request.url_for("redirect_to_long_url", short_code=short_code))
 
 
@@ -149,14 +593,21 @@ async def delete_short_url(short_code: str, session: AsyncSession = Depends(get_
     """
     Удаляет короткую ссылку с "кодом" short_code.
     """
+    url_obj = await models.Url.get_by_id(session, short_code)
     await models.UrlStats.delete_by_url_id(session, short_code)
+    await models.UrlStatsHourly.delete_by_url_id(session, short_code)
+    await models.UrlStatsMinutely.delete_by_url_id(session, short_code)
     await models.Url.delete_by_id(session, short_code)
     await session.commit()
+    await reads.mark_written([short_code])
 
     try:
-        await redis.delete(settings.REDIS_URL_KEY.format(short_code))
+        await redis_batch.delete(settings.REDIS_URL_KEY.format(short_code))
     except RedisError:
         # Удалится само, а юзеру знать о таких ошибках не обязательно
         logger.exception("Error while deleting data from Redis")
+    await invalidate_url(short_code)
+    if url_obj is not None:
+        await forget_code(url_obj.url_hash)
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from typing import Any, Collection, Optional
+
+from aioredis import RedisError
+
+from app import metrics
+from app.apps.urls.redirects import Redirect
+from app.cache import LocalCache, SingleFlight
+from app.config import settings
+from app.deps import redis, redis_breaker, redis_pubsub
+from app.tasks import JobQueue
+
+
+logger = logging.getLogger(__name__)
+
+MISSING_URL = ""  # Значение в кешах для кодов, ссылок по которым нет
+
+# Соответствие "код -> длинный урл с готовым ответом" в памяти процесса, чтобы популярные ссылки отдавались
+# без походов в Redis.
+url_cache: LocalCache[Redirect] = LocalCache(max_size=settings.LOCAL_CACHE_SIZE, ttl=settings.LOCAL_CACHE_TTL)
+# Коды, ссылок для которых нет. Отдельно от url_cache, чтобы перебор случайных кодов не вытеснял живые ссылки.
+missing_urls: LocalCache[bool] = LocalCache(
+    max_size=settings.LOCAL_MISSING_CACHE_SIZE, ttl=settings.LOCAL_MISSING_CACHE_TTL
+)
+# Ответы статистики: счётчики меняются каждую секунду, но отдавать их с задержкой в STATS_CACHE_TTL допустимо.
+stats_cache: LocalCache[Any] = LocalCache(max_size=settings.STATS_CACHE_SIZE, ttl=settings.STATS_CACHE_TTL)
+# Поиск ссылок при промахе url_cache: один на код, сколько бы запросов за ним ни пришло одновременно.
+url_lookups: SingleFlight[Optional[Redirect]] = SingleFlight()
+# Записи в Redis, которых запрос не ждёт. Ключ задачи - (действие, код), так что повторная
+# запись одного кода, пока первая ещё в очереди, при политике coalesce её заменяет.
+redis_writes = JobQueue(
+    "redis_writes",
+    max_size=settings.REDIS_WRITE_QUEUE_SIZE,
+    concurrency=settings.REDIS_WRITE_CONCURRENCY,
+    overflow=settings.REDIS_WRITE_OVERFLOW,
+)
+
+
+def export_cache_metrics(name: str, cache: LocalCache[Any]) -> None:
+    """
+    Отдаёт счётчики cache в /metrics с меткой cache=name. Значения читаются из cache в момент сбора метрик.
+    """
+    metrics.local_cache_requests.labels(name, "hit").set_function(lambda: cache.hits)
+    metrics.local_cache_requests.labels(name, "miss").set_function(lambda: cache.misses)
+    metrics.local_cache_evictions.labels(name).set_function(lambda: cache.evictions)
+    metrics.local_cache_size.labels(name).set_function(cache.__len__)
+
+
+export_cache_metrics("url", url_cache)
+export_cache_metrics("missing", missing_urls)
+export_cache_metrics("stats", stats_cache)
+
+
+async def invalidate_url(short_code: str) -> None:
+    """
+    Удаляет short_code из кеша этого процесса и через Redis pub/sub просит сделать то же самое остальные.
+    Вызывать стоит после того, как новое значение уже записано в Redis, иначе
+    другой процесс может успеть перечитать из Redis старое.
+    """
+    url_cache.invalidate(short_code)
+    missing_urls.invalidate(short_code)
+    try:
+        await redis_breaker.call(redis.publish, settings.REDIS_INVALIDATION_CHANNEL, short_code)
+    except RedisError:
+        # Остальные процессы забудут старое значение через LOCAL_CACHE_TTL
+        logger.exception("Error while publishing cache invalidation to Redis")
+
+
+async def invalidate_urls(short_codes: Collection[str]) -> None:
+    """
+    То же, что invalidate_url, для многих кодов сразу: инвалидации публикуются одним пайплайном.
+    """
+    for short_code in short_codes:
+        url_cache.invalidate(short_code)
+        missing_urls.invalidate(short_code)
+
+    async def publish() -> None:
+        async with redis.pipeline(transaction=False) as pipe:
+            for short_code in short_codes:
+                pipe.publish(settings.REDIS_INVALIDATION_CHANNEL, short_code)
+            await pipe.execute()
+
+    try:
+        await redis_breaker.call(publish)
+    except RedisError:
+        logger.exception("Error while publishing cache invalidations to Redis")
+
+
+async def listen_invalidations() -> None:
+    """
+    Слушает инвалидации из Redis pub/sub и удаляет коды из кеша этого процесса.
+    Пока соединение было разорвано, инвалидации могли потеряться, поэтому после
+    переподключения кеш очищается целиком. Тишина в канале - не разрыв: у клиента
+    redis_pubsub нет таймаута чтения, а соединение проверяется PING-ом при ожидании сообщений.
+    """
+    while True:
+        try:
+            async with redis_pubsub.pubsub(ignore_subscribe_messages=True) as pubsub:
+                await pubsub.subscribe(settings.REDIS_INVALIDATION_CHANNEL)
+                url_cache.clear()
+                missing_urls.clear()
+                while True:
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=settings.REDIS_PUBSUB_HEALTH_CHECK_INTERVAL
+                    )
+                    if message is not None:
+                        url_cache.invalidate(message["data"])
+                        missing_urls.invalidate(message["data"])
+        except RedisError:
+            logger.exception("Error while listening to cache invalidations in Redis")
+            await asyncio.sleep(1)
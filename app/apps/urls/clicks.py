@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, List, Optional, Tuple
+
+from aioredis import RedisError
+
+from app import metrics
+from app.apps.urls import models
+from app.apps.urls.visitors import add_visitors
+from app.config import settings
+from app.db import async_session
+from app.utils import utcnow
+
+
+logger = logging.getLogger(__name__)
+
+
+class ClickBuffer:
+    """
+    Копит переходы по коротким ссылкам в памяти и пачками пишет их в БД,
+    а их посетителей - в HyperLogLog в Redis (см. visitors).
+    Раньше на каждый редирект открывалась своя транзакция с INSERT одной строки,
+    и при всплеске трафика такие транзакции отъедали соединения у самих редиректов.
+
+    Буфер ограничен max_size переходами: всё, что не влезло, отбрасывается и
+    учитывается в счётчике dropped. Пачка уходит в БД, как только набралось
+    batch_size переходов или прошло flush_interval секунд.
+    """
+
+    def __init__(self, max_size: int, batch_size: int, flush_interval: float) -> None:
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.flushed = 0  # Сколько переходов записано в БД
+        self.dropped = 0  # Сколько переходов потеряно из-за переполнения буфера или ошибок БД
+
+        self._clicks: Deque[Tuple[str, datetime, Optional[str]]] = deque()
+        self._wakeup: Optional[asyncio.Event] = None  # Создаётся в start(), чтобы привязаться к рабочему event loop
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._deadline: Optional[float] = None  # После этого момента (time.monotonic) новые пачки не пишутся
+
+    def __len__(self) -> int:
+        return len(self._clicks)
+
+    def add(self, short_code: str, visitor: Optional[str] = None) -> None:
+        """
+        Добавляет в буфер переход по short_code посетителя visitor (см. visitor_id).
+        Не блокирует и не ходит в сеть.
+        """
+        if len(self._clicks) >= self.max_size:
+            self.dropped += 1
+            return
+
+        self._clicks.append((short_code, utcnow(), visitor))
+        if len(self._clicks) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _pop_batch(self) -> List[Tuple[str, datetime, Optional[str]]]:
+        size = min(self.batch_size, len(self._clicks))
+        return [self._clicks.popleft() for _ in range(size)]
+
+    async def flush(self) -> None:
+        """
+        Пишет в БД и Redis всё, что накопилось в буфере, пачками по batch_size.
+        При остановке новые пачки после срока не начинаются, но начатая дописывается.
+        """
+        while self._clicks and (self._deadline is None or time.monotonic() < self._deadline):
+            batch = self._pop_batch()
+            try:
+                await add_visitors(batch)
+            except RedisError:
+                logger.exception("Error while writing visitors of %s clicks to Redis", len(batch))
+
+            try:
+                async with async_session() as session:
+                    await models.UrlStats.bulk_create(session, [(short_code, dt) for short_code, dt, _ in batch])
+                    await session.commit()
+            except Exception:  # pylint: disable=broad-except
+                # Повторять не будем: при лежащей БД буфер быстро переполнится, а редиректы важнее статистики.
+                self.dropped += len(batch)
+                logger.exception("Error while writing %s clicks to DB", len(batch))
+            else:
+                self.flushed += len(batch)
+
+    async def _run(self, wakeup: asyncio.Event) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        """
+        Запускает фоновый сброс буфера в БД.
+        """
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(self._wakeup))
+
+    async def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Останавливает фоновый сброс и записывает в БД остатки, чтобы при деплое переходы не терялись.
+        Задачу не отменяем, а дожидаемся: отмена посреди INSERT-а потеряла бы уже вынутую из буфера пачку.
+        Если задан timeout, новые пачки после timeout секунд не пишутся, а то, что осталось в буфере,
+        отбрасывается и учитывается в dropped.
+        """
+        self._deadline = time.monotonic() + timeout if timeout is not None else None
+        if self._task is not None and self._wakeup is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._wakeup = None
+
+        await self.flush()
+        self._deadline = None
+        if self._clicks:
+            logger.error("Click buffer was not flushed in %ss, %s clicks dropped", timeout, len(self._clicks))
+            self.dropped += len(self._clicks)
+            self._clicks.clear()
+        logger.info("Click buffer stopped: %s clicks flushed, %s dropped", self.flushed, self.dropped)
+
+
+click_buffer = ClickBuffer(
+    max_size=settings.CLICK_BUFFER_SIZE,
+    batch_size=settings.CLICK_BATCH_SIZE,
+    flush_interval=settings.CLICK_FLUSH_INTERVAL,
+)
+metrics.click_buffer_clicks.labels("pending").set_function(click_buffer.__len__)
+metrics.click_buffer_clicks.labels("flushed").set_function(lambda: click_buffer.flushed)
+metrics.click_buffer_clicks.labels("dropped").set_function(lambda: click_buffer.dropped)
@@ -0,0 +1,143 @@
+import abc
+import hashlib
+import logging
+import random
+from string import ascii_letters, digits
+from typing import List, Sequence
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.apps.urls import models
+from app.config import settings
+from app.exceptions import ShortCodeAllocationError
+
+
+logger = logging.getLogger(__name__)
+
+letters = [i for i in ascii_letters + digits if i not in ("i", "I", "l")]  # Удалим те, что похожи друг на друга
+
+
+def create_short_code() -> str:
+    """
+    Создаёт код, который будет использован для короткой ссылки.
+    """
+    short_code = "".join(random.choice(letters) for _ in range(models.SHORT_CODE_LEN))
+    return short_code
+
+
+class CodeAllocator(abc.ABC):
+    """
+    Выдаёт коды для новых коротких ссылок без проверки их существования в БД.
+    Коллизия с уже существующей ссылкой всё ещё возможна (например, со старыми
+    случайными кодами), поэтому вставлять ссылку нужно через Url.insert_if_absent
+    и при неудаче просить следующий код.
+    """
+
+    @abc.abstractmethod
+    async def allocate(self, session: AsyncSession) -> str:
+        ...
+
+    async def allocate_many(self, session: AsyncSession, count: int) -> List[str]:
+        return [await self.allocate(session) for _ in range(count)]
+
+
+class RandomCodeAllocator(CodeAllocator):
+    """
+    Случайные коды. Коллизии статистически редки: при 59 символах и длине кода = 6
+    существует 42млрд. комбинаций.
+    """
+
+    async def allocate(self, session: AsyncSession) -> str:
+        return create_short_code()
+
+
+class FeistelPermutation:
+    """
+    Биекция чисел из [0, domain) на себя, зависящая от секретного ключа.
+    Сеть Фейстеля работает на ближайшей сверху степени двойки, а выпавшие за
+    domain значения шифруются повторно (cycle walking), пока не попадут в domain.
+    """
+
+    rounds = 4
+
+    def __init__(self, domain: int, secret: str) -> None:
+        self.domain = domain
+        bits = max((domain - 1).bit_length(), 2)
+        self._half_bits = (bits + 1) // 2
+        self._mask = (1 << self._half_bits) - 1
+        self._key = hashlib.blake2b(secret.encode()).digest()
+
+    def _round(self, round_number: int, value: int) -> int:
+        digest = hashlib.blake2b(
+            value.to_bytes(8, "big"), digest_size=8, key=self._key, salt=round_number.to_bytes(16, "big")
+        ).digest()
+        return int.from_bytes(digest, "big") & self._mask
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> self._half_bits, value & self._mask
+        for round_number in range(self.rounds):
+            left, right = right, left ^ self._round(round_number, right)
+        return (left << self._half_bits) | right
+
+    def __call__(self, value: int) -> int:
+        value = self._encrypt(value)
+        while value >= self.domain:
+            value = self._encrypt(value)
+        return value
+
+
+class SequenceCodeAllocator(CodeAllocator):
+    """
+    Коды из последовательности в БД, которая резервируется блоками по block_size
+    номеров, так что в БД ходим раз в block_size ссылок. Чтобы по одному коду
+    нельзя было подобрать соседние, номер пропускается через FeistelPermutation
+    с секретным ключом и только потом переводится в символы alphabet.
+    """
+
+    def __init__(self, alphabet: Sequence[str], length: int, secret: str, block_size: int) -> None:
+        self.alphabet = alphabet
+        self.length = length
+        self.block_size = block_size
+        self._permutation = FeistelPermutation(len(alphabet) ** length, secret)
+        self._next = 0
+        self._end = 0
+
+    def encode(self, number: int) -> str:
+        base = len(self.alphabet)
+        chars = []
+        for _ in range(self.length):
+            number, index = divmod(number, base)
+            chars.append(self.alphabet[index])
+        return "".join(reversed(chars))
+
+    async def allocate(self, session: AsyncSession) -> str:
+        if self._next >= self._end:
+            # Пока ждём БД, другая корутина может тоже взять блок. Тогда остаток
+            # её блока пропадёт, но номера всё равно не повторятся.
+            block = await session.scalar(sa.select(models.short_code_sequence.next_value()))
+            self._next, self._end = (block - 1) * self.block_size, block * self.block_size
+
+        number = self._next
+        if number >= self._permutation.domain:
+            raise ShortCodeAllocationError("Закончились свободные короткие ссылки")
+
+        self._next += 1
+        return self.encode(self._permutation(number))
+
+
+def make_code_allocator() -> CodeAllocator:
+    if settings.SHORT_CODE_ALLOCATOR == "random":
+        return RandomCodeAllocator()
+    if settings.SHORT_CODE_ALLOCATOR == "sequence" and not settings.SHORT_CODE_SECRET:
+        # Без ключа настройки не пропускают, кроме DEBUG: там просто выдаём случайные коды
+        logger.warning("SHORT_CODE_SECRET is not set, falling back to random short codes")
+        return RandomCodeAllocator()
+    if settings.SHORT_CODE_ALLOCATOR == "sequence":
+        return SequenceCodeAllocator(
+            letters, models.SHORT_CODE_LEN, settings.SHORT_CODE_SECRET, settings.SHORT_CODE_BLOCK_SIZE
+        )
+    raise ValueError(f"Unknown SHORT_CODE_ALLOCATOR: {settings.SHORT_CODE_ALLOCATOR}")
+
+
+code_allocator = make_code_allocator()
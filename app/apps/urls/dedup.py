@@ -0,0 +1,118 @@
+"""
+Создание ссылок без дублей: режим dedup, в котором для уже сокращённого урла
+возвращается существующий код, и заголовок Idempotency-Key, при котором повтор
+запроса возвращает результат первого, а не создаёт ещё одну ссылку.
+"""
+import logging
+from datetime import datetime
+from typing import Optional
+
+from aioredis import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.apps.urls import models
+from app.config import settings
+from app.deps import redis_batch
+from app.exceptions import IdempotencyKeyInProgressError, IdempotencyKeyReusedError
+from app.utils import normalize_url, ttl_until
+
+
+logger = logging.getLogger(__name__)
+
+
+async def remember_code(url_hash: str, short_code: str, expires_at: datetime) -> None:
+    """
+    Запоминает в Redis, что урлу с хешем url_hash соответствует short_code, но не дольше,
+    чем до expires_at ссылки: после этого ссылка уже не работает.
+    """
+    ttl = ttl_until(expires_at, settings.REDIS_URL_TTL)
+    if not ttl:
+        return
+    try:
+        await redis_batch.set(settings.REDIS_URL_HASH_KEY.format(url_hash), short_code, px=ttl)
+    except RedisError:
+        logger.exception("Error while setting url hash to Redis")
+
+
+async def forget_code(url_hash: Optional[str]) -> None:
+    """
+    Удаляет обратное соответствие для url_hash, когда ссылку изменили или удалили.
+    """
+    if url_hash is None:
+        return
+    try:
+        await redis_batch.delete(settings.REDIS_URL_HASH_KEY.format(url_hash))
+    except RedisError:
+        # Проживёт до REDIS_URL_TTL, и всё это время для урла будет возвращаться старый код.
+        logger.exception("Error while deleting url hash from Redis")
+
+
+async def find_existing_code(session: AsyncSession, long_url: str, url_hash: str) -> Optional[str]:
+    """
+    Ищет код уже существующей ссылки на long_url: сначала одним GET в Redis, потом
+    по индексу url_hash в БД. Перед поиском в БД берёт блокировку хеша до конца
+    транзакции, так что если ничего не нашлось, одновременный запрос с тем же
+    урлом подождёт, пока вызывающий создаст ссылку и закоммитит транзакцию.
+    """
+    try:
+        short_code = await redis_batch.get(settings.REDIS_URL_HASH_KEY.format(url_hash))
+    except RedisError:
+        short_code = None
+        logger.exception("Error while getting url hash from Redis")
+    if short_code:
+        return short_code
+
+    await models.Url.lock_url_hash(session, url_hash)
+    normalized_url = normalize_url(long_url)
+    for row in await models.Url.find_by_url_hash(session, url_hash):
+        if normalize_url(row.url) == normalized_url:
+            await session.commit()  # Отпустим блокировку: создавать ничего не нужно
+            await remember_code(url_hash, row.id, row.expires_at)
+            return row.id
+    return None
+
+
+async def claim_idempotency_key(key: str, url_hash: str) -> Optional[str]:
+    """
+    Занимает Idempotency-Key key для создания ссылки на урл с хешем url_hash и возвращает None.
+    Если запрос с этим ключом уже выполнился, возвращает созданный им код. Пока он
+    выполняется (но не дольше IDEMPOTENCY_LOCK_TTL), бросает IdempotencyKeyInProgressError,
+    а если ключ уже использовался для другого урла - IdempotencyKeyReusedError.
+    """
+    redis_key = settings.REDIS_IDEMPOTENCY_KEY.format(key)
+    if await redis_batch.set(redis_key, f"{url_hash}:", ex=settings.IDEMPOTENCY_LOCK_TTL, nx=True):
+        return None
+
+    value = await redis_batch.get(redis_key)
+    if value is None:
+        # Первый запрос отпустил ключ, не создав ссылку, - ровно в этот момент что-то ещё его займёт
+        raise IdempotencyKeyInProgressError("Запрос с этим Idempotency-Key ещё выполняется")
+    stored_hash, _, short_code = value.partition(":")
+    if stored_hash != url_hash:
+        raise IdempotencyKeyReusedError("Этот Idempotency-Key уже использован для другой ссылки")
+    if not short_code:
+        raise IdempotencyKeyInProgressError("Запрос с этим Idempotency-Key ещё выполняется")
+    return short_code
+
+
+async def complete_idempotency_key(key: str, url_hash: str, short_code: str) -> None:
+    """
+    Запоминает результат запроса с Idempotency-Key key на IDEMPOTENCY_TTL.
+    """
+    try:
+        await redis_batch.set(
+            settings.REDIS_IDEMPOTENCY_KEY.format(key), f"{url_hash}:{short_code}", ex=settings.IDEMPOTENCY_TTL
+        )
+    except RedisError:
+        # Через IDEMPOTENCY_LOCK_TTL ключ освободится, и повтор запроса создаст новую ссылку.
+        logger.exception("Error while saving idempotency key to Redis")
+
+
+async def release_idempotency_key(key: str) -> None:
+    """
+    Освобождает Idempotency-Key, если запрос с ним не удался, чтобы его можно было сразу повторить.
+    """
+    try:
+        await redis_batch.delete(settings.REDIS_IDEMPOTENCY_KEY.format(key))
+    except RedisError:
+        logger.exception("Error while releasing idempotency key in Redis")
@@ -0,0 +1,54 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Optional, Sequence, Union
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.apps.urls import models, schemas
+from app.config import settings
+
+
+def export_query(
+    table: schemas.ExportTable, created_from: Optional[datetime], created_to: Optional[datetime], after: Optional[str]
+) -> sa.sql.Select:
+    if table == schemas.ExportTable.urls:
+        return models.Url.export_query(created_from, created_to, after)
+    return models.UrlStats.export_query(created_from, created_to, after)
+
+
+def json_default(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def format_rows(rows: Sequence[sa.engine.Row], export_format: schemas.ExportFormat) -> str:
+    if export_format == schemas.ExportFormat.ndjson:
+        return "".join(json.dumps(row._asdict(), default=json_default) + "\n" for row in rows)
+
+    output = io.StringIO()
+    csv.writer(output).writerows(
+        (value.isoformat() if isinstance(value, datetime) else value for value in row) for row in rows
+    )
+    return output.getvalue()
+
+
+async def export_rows(
+    db: Union[AsyncSession, AsyncConnection], query: sa.sql.Select, export_format: schemas.ExportFormat
+) -> AsyncIterator[str]:
+    """
+    Читает строки query серверным курсором пачками по EXPORT_BATCH_SIZE и отдаёт их
+    в формате export_format, так что в памяти всегда не больше одной пачки.
+    CSV начинается со строки с названиями колонок.
+    """
+    result = await db.stream(query)
+    if export_format == schemas.ExportFormat.csv:
+        output = io.StringIO()
+        csv.writer(output).writerow(result.keys())
+        yield output.getvalue()
+
+    async for rows in result.partitions(settings.EXPORT_BATCH_SIZE):
+        yield format_rows(rows, export_format)
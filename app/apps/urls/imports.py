@@ -0,0 +1,211 @@
+import csv
+import json
+import logging
+import re
+import time
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Counter, List, Mapping, Optional, Sequence, Tuple, Union
+
+from aioredis import RedisError
+from fastapi import Request
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.apps.urls import models, reads, schemas
+from app.apps.urls.cache import invalidate_urls, MISSING_URL, missing_urls
+from app.apps.urls.warmup import write_batch
+from app.config import settings
+from app.deps import redis, redis_breaker
+from app.utils import hash_url, utcnow
+
+
+logger = logging.getLogger(__name__)
+
+short_code_pattern = re.compile(rf"[A-Za-z0-9_-]{{1,{models.SHORT_CODE_LEN}}}")
+ImportRow = Tuple[int, str, str, datetime, datetime, bool, str]
+
+
+async def read_lines(request: Request) -> AsyncIterator[bytes]:
+    """
+    Построчно читает тело запроса, не загружая его в память целиком.
+    """
+    tail = b""
+    async for chunk in request.stream():
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line
+    if tail:
+        yield tail
+
+
+def parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    dt = datetime.fromisoformat(value)
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def parse_record(line_number: int, record: Mapping[str, Any]) -> ImportRow:
+    """
+    Проверяет одну ссылку из импортируемого файла. Код берётся из поля code, а если
+    его нет - из id, как в нашей выгрузке. Урл проверяется так же, как при создании
+    ссылки (UrlCreate), а created_at и expires_at без часового пояса считаются временем
+    в UTC. Без expires_at ссылка истекает через SHORT_URL_TTL после created_at.
+    """
+    code = record.get("code") or record.get("id")
+    if not isinstance(code, str) or not short_code_pattern.fullmatch(code):
+        raise ValueError(
+            f"Код должен состоять из латинских букв, цифр, _ и - и быть не длиннее {models.SHORT_CODE_LEN}"
+        )
+
+    url = schemas.UrlCreate.parse_obj({"url": record.get("url")}).url
+
+    created_at = parse_datetime(record.get("created_at")) or utcnow()
+    expires_at = parse_datetime(record.get("expires_at"))
+    custom_expiry = expires_at is not None
+    expires_at = expires_at or models.default_expires_at(created_at)
+    return line_number, code, url, created_at, expires_at, custom_expiry, hash_url(url)
+
+
+def error_message(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(item["msg"] for item in error.errors())
+    return str(error)
+
+
+async def parse_lines(
+    lines: AsyncIterator[bytes], import_format: schemas.ImportFormat
+) -> AsyncIterator[Union[ImportRow, schemas.UrlImportError]]:
+    """
+    Разбирает строки файла и отдаёт по каждой ссылке либо ImportRow, либо ошибку.
+    Пустые строки пропускаются. В CSV первая строка - названия колонок.
+    """
+    columns: Optional[List[str]] = None
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        text = line.decode("utf-8", errors="replace").strip()
+        if not text:
+            continue
+
+        code = None
+        try:
+            if import_format == schemas.ImportFormat.csv:
+                values = next(csv.reader([text]))
+                if columns is None:
+                    columns = [column.lstrip("\ufeff").strip() for column in values]
+                    continue
+                record = dict(zip(columns, values))
+            else:
+                record = json.loads(text)
+                if not isinstance(record, dict):
+                    raise ValueError("Ожидается JSON-объект")
+            code = record.get("code") or record.get("id")
+            yield parse_record(line_number, record)
+        except (ValueError, ValidationError) as e:
+            yield schemas.UrlImportError(line=line_number, code=code, error=error_message(e))
+
+
+async def clear_missing(short_codes: Sequence[str]) -> None:
+    """
+    Сбрасывает отметки об отсутствии ссылок с только что добавленными кодами short_codes,
+    чтобы они сразу стали доступны: в памяти этого процесса, в Redis и, если отметка
+    в Redis была, в памяти остальных процессов. Ссылок с этими кодами не было,
+    так что всё, что лежит по ним в Redis, устарело и просто удаляется.
+    """
+    for short_code in short_codes:
+        missing_urls.invalidate(short_code)
+    keys = [settings.REDIS_URL_KEY.format(short_code) for short_code in short_codes]
+
+    async def delete() -> List[Any]:
+        async with redis.pipeline() as pipe:
+            pipe.mget(keys)
+            pipe.delete(*keys)
+            return await pipe.execute()
+
+    previous, _ = await redis_breaker.call(delete)
+    await invalidate_urls([short_code for short_code, value in zip(short_codes, previous) if value == MISSING_URL])
+
+
+async def import_batch(
+    session: AsyncSession, rows: Sequence[ImportRow], warm: bool
+) -> Tuple[int, List[schemas.UrlImportError]]:
+    """
+    Загружает пачку в БД одной транзакцией (см. Url.import_batch), сбрасывает отметки
+    об отсутствии добавленных ссылок и, если warm, записывает их в Redis.
+    Возвращает количество добавленных и конфликты.
+    """
+    inserted, conflicts = await models.Url.import_batch(session, rows)
+    await session.commit()
+    await reads.mark_written([row.id for row in inserted])
+
+    if inserted:
+        try:
+            await clear_missing([row.id for row in inserted])
+            if warm:
+                await redis_breaker.call(write_batch, inserted)
+        except RedisError:
+            # Отметки об отсутствии в Redis проживут до REDIS_MISSING_URL_TTL
+            logger.exception("Error while updating imported urls in Redis")
+
+    errors = [
+        schemas.UrlImportError(
+            line=row.line, code=row.id, error="Код уже занят другой ссылкой", existing_url=row.existing_url
+        )
+        for row in conflicts
+    ]
+    return len(inserted), errors
+
+
+async def import_urls(
+    session: AsyncSession, lines: AsyncIterator[bytes], import_format: schemas.ImportFormat, warm: bool = False
+) -> AsyncIterator[Union[schemas.UrlImportError, schemas.UrlImportResult]]:
+    """
+    Импортирует ссылки (code, url, created_at) с заданными кодами из потока строк
+    в формате CSV или NDJSON. Строки читаются и загружаются пачками по IMPORT_BATCH_SIZE,
+    каждая в своей транзакции, так что память не зависит от размера файла, а после
+    обрыва импорт можно просто запустить заново: уже загруженные строки пропустятся.
+    Отдаёт ошибки по мере обработки (невалидные строки и конфликты кодов),
+    а последним - итог UrlImportResult.
+
+    Коды, выданные генератором кодов, с импортированными не согласованы: при
+    совпадении создание ссылки просто возьмёт следующий код.
+    """
+    started = time.monotonic()
+    counts: Counter[str] = Counter()
+    batch: List[ImportRow] = []
+
+    async def flush() -> AsyncIterator[schemas.UrlImportError]:
+        inserted, conflicts = await import_batch(session, batch, warm)
+        counts["inserted"] += inserted
+        counts["conflicts"] += len(conflicts)
+        counts["unchanged"] += len(batch) - inserted - len(conflicts)
+        batch.clear()
+        logger.info(
+            "Import: %s rows read, %s inserted in %.2fs",
+            counts["total"],
+            counts["inserted"],
+            time.monotonic() - started,
+        )
+        for error in conflicts:
+            yield error
+
+    async for item in parse_lines(lines, import_format):
+        counts["total"] += 1
+        if isinstance(item, schemas.UrlImportError):
+            counts["invalid"] += 1
+            yield item
+            continue
+
+        batch.append(item)
+        if len(batch) >= settings.IMPORT_BATCH_SIZE:
+            async for error in flush():
+                yield error
+
+    if batch:
+        async for error in flush():
+            yield error
+    result = schemas.UrlImportResult(**{field: counts[field] for field in schemas.UrlImportResult.__fields__})
+    logger.info("Import finished: %s in %.2fs", result, time.monotonic() - started)
+    yield result
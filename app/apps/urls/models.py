@@ -1,15 +1,57 @@
-from datetime import datetime, timedelta
+import abc
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Mapping, Optional, Sequence, Set, Tuple, Union
 
 import sqlalchemy as sa
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
 from sqlalchemy.sql import operators
 
 from app.config import settings
-from app.db import async_session, EmptyBaseModel
-from app.utils import utcnow
+from app.db import AbstractModelMeta, advisory_lock, delete_in_batches, EmptyBaseModel, metadata
+from app.exceptions import InvalidCursorError
+from app.utils import hash_url, truncate_hour, truncate_minute, utcnow
 
 
+logger = logging.getLogger(__name__)
+
 SHORT_CODE_LEN = 6  # Длина "кода" короткой ссылки
+URL_HASH_LEN = 32  # Длина хеша урла в hex
+short_code_sequence = sa.Sequence("short_code_seq", metadata=metadata)  # Номера блоков для SequenceCodeAllocator
+# Временная таблица соединения для импорта ссылок, см. Url.import_batch. Не входит в metadata, миграции её не видят.
+url_imports = sa.table(
+    "url_imports",
+    sa.column("line"),
+    sa.column("id"),
+    sa.column("url"),
+    sa.column("created_at"),
+    sa.column("expires_at"),
+    sa.column("custom_expiry"),
+    sa.column("url_hash"),
+)
+
+
+def default_expires_at(created_at: Optional[datetime] = None) -> datetime:
+    """
+    Когда истекает ссылка, созданная в created_at (по умолчанию - сейчас), если срок не указали: через SHORT_URL_TTL.
+    """
+    return (created_at or utcnow()) + timedelta(seconds=settings.SHORT_URL_TTL)
+
+
+def filter_created_at(
+    query: sa.sql.Select, column: sa.Column, created_from: Optional[datetime], created_to: Optional[datetime]
+) -> sa.sql.Select:
+    """
+    Оставляет в query строки с column в [created_from, created_to).
+    """
+    if created_from is not None:
+        query = query.where(operators.ge(column, created_from))
+    if created_to is not None:
+        query = query.where(operators.lt(column, created_to))
+    return query
 
 
 class Url(EmptyBaseModel):
@@ -18,39 +60,305 @@ class Url(EmptyBaseModel):
     id = sa.Column(sa.String(SHORT_CODE_LEN), primary_key=True)
     url = sa.Column(sa.Text, nullable=False, unique=False)
     created_at = sa.Column(sa.DateTime(timezone=True), default=utcnow, index=True)
+    # С этого момента ссылка не работает, а потом её удаляет clean_old
+    expires_at = sa.Column(sa.DateTime(timezone=True), nullable=False, default=default_expires_at, index=True)
+    # Срок задали явно, а не взяли по умолчанию (см. default_expires_at): такие ссылки не отдаются в режиме dedup
+    custom_expiry = sa.Column(sa.Boolean, nullable=False, default=False, server_default=sa.false())
+    # Хеш нормализованного урла (см. hash_url), чтобы находить ссылки на тот же урл. Не уникален:
+    # без режима dedup одинаковые урлы получают разные коды. У ссылок, созданных до его появления, пуст.
+    url_hash = sa.Column(sa.String(URL_HASH_LEN), nullable=True, index=True)
 
     @classmethod
-    async def clean_old(cls) -> None:
+    async def get_redirect(
+        cls, connection: Union[AsyncConnection, AsyncSession], url_id: str
+    ) -> Optional[sa.engine.Row]:
         """
-        Удаляет ссылки, старше, чем SHORT_URL_TTL секунд.
+        Возвращает только (url, expires_at) ссылки url_id, если она не истекла, без создания ORM-объекта и сессии.
+        Запрос компилируется один раз, а asyncpg держит его подготовленным на каждом соединении пула.
         """
-        dt = utcnow() - timedelta(seconds=settings.SHORT_URL_TTL)
+        query = sa.select(cls.url, cls.expires_at).where(
+            operators.eq(cls.id, url_id), operators.gt(cls.expires_at, utcnow())
+        )
+        return (await connection.execute(query)).first()
 
-        # Redis можно не чистить, т.к. в течении суток данные сами удалятся. Либо, если необходимо, можно удалить.
-        # Когда данных в БД станет много, то запрос может начать работать медленно, тогда поможет удаление батчами.
-        async with async_session() as session:
-            query = sa.delete(cls).where(operators.lt(cls.created_at, dt))
-            await session.execute(query)
+    @classmethod
+    async def insert_if_absent(cls, session: AsyncSession, **values: Any) -> bool:
+        """
+        Добавляет ссылку одним INSERT-ом. Возвращает False, если ссылка с таким id уже есть.
+        """
+        query = pg_insert(cls).values(**values).on_conflict_do_nothing(index_elements=[cls.id]).returning(cls.id)
+        return await session.scalar(query) is not None
+
+    @classmethod
+    async def insert_many_if_absent(cls, session: AsyncSession, rows: Sequence[Dict[str, Any]]) -> Set[str]:
+        """
+        Добавляет ссылки rows одним INSERT-ом. Возвращает id тех, что удалось
+        добавить: ссылки с уже занятыми id пропускаются.
+        """
+        query = pg_insert(cls).values(list(rows)).on_conflict_do_nothing(index_elements=[cls.id]).returning(cls.id)
+        result = await session.execute(query)
+        return set(result.scalars())
+
+    @classmethod
+    async def find_by_url_hash(cls, session: AsyncSession, url_hash: str) -> Sequence[sa.engine.Row]:
+        """
+        Возвращает (id, url, expires_at) неистёкших ссылок со сроком по умолчанию (без custom_expiry)
+        и хешем урла url_hash, самые старые первыми. Ссылки со своим сроком не подходят: тот, кто
+        их не создавал, ждёт от ссылки обычного срока. Урлы стоит сравнить: при коллизии хешей
+        среди них может оказаться чужой.
+        """
+        query = (
+            sa.select(cls.id, cls.url, cls.expires_at)
+            .where(
+                operators.eq(cls.url_hash, url_hash),
+                operators.gt(cls.expires_at, utcnow()),
+                sa.not_(cls.custom_expiry),
+            )
+            .order_by(cls.created_at)
+            .limit(10)
+        )
+        return (await session.execute(query)).all()
+
+    @classmethod
+    async def lock_url_hash(cls, session: AsyncSession, url_hash: str) -> None:
+        """
+        Берёт advisory-блокировку хеша урла до конца транзакции, чтобы одновременные
+        создания ссылки на один урл не вставили её дважды.
+        """
+        lock_key = sa.literal(int(url_hash[:16], 16) - 2**63, sa.BigInteger)
+        await session.execute(sa.select(sa.func.pg_advisory_xact_lock(lock_key)))
+
+    @classmethod
+    async def backfill_url_hashes(cls, session: AsyncSession, batch_size: int) -> int:
+        """
+        Заполняет url_hash у ссылок, где он пуст, пачками по batch_size, каждую в своей транзакции.
+        Возвращает количество обновлённых ссылок.
+        """
+        updated = 0
+        while True:
+            query = sa.select(cls.id, cls.url).where(cls.url_hash.is_(None)).limit(batch_size)
+            rows = (await session.execute(query)).all()
+            if not rows:
+                return updated
+
+            values = sa.values(
+                sa.column("id", sa.String(SHORT_CODE_LEN)),
+                sa.column("url_hash", sa.String(URL_HASH_LEN)),
+                name="hashes",
+            ).data([(row.id, hash_url(row.url)) for row in rows])
+            await session.execute(
+                sa.update(cls)
+                .where(operators.eq(cls.id, values.c.id))
+                .values(url_hash=values.c.url_hash)
+                .execution_options(synchronize_session=False)
+            )
             await session.commit()
+            updated += len(rows)
+
+    @classmethod
+    async def import_batch(
+        cls, session: AsyncSession, rows: Sequence[Tuple[int, str, str, datetime, datetime, bool, str]]
+    ) -> Tuple[Sequence[sa.engine.Row], Sequence[sa.engine.Row]]:
+        """
+        Загружает rows (номер строки в файле, id, url, created_at, expires_at, custom_expiry, url_hash) через COPY во временную
+        таблицу url_imports и оттуда одним INSERT-ом переносит в urls. Из нескольких строк
+        с одинаковым id берётся первая, а занятые id пропускаются.
+        Возвращает добавленные ссылки (id, url, expires_at) и конфликты (line, id, url, existing_url) -
+        строки, чей id уже занят другим урлом в БД или выше в том же файле. Строки, которые
+        совпали с уже существующей ссылкой, не попадают никуда, так что повторный импорт
+        того же файла ничего не меняет.
+        """
+        connection = await session.connection()
+        await connection.execute(
+            sa.text(
+                f"CREATE TEMPORARY TABLE IF NOT EXISTS {url_imports.name} "
+                f"(line integer, id varchar({SHORT_CODE_LEN}), url text, created_at timestamptz, "
+                f"expires_at timestamptz, custom_expiry boolean, url_hash varchar({URL_HASH_LEN}))"
+            )
+        )
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            url_imports.name, records=rows, columns=[column.name for column in url_imports.columns]
+        )
+
+        first_rows = (
+            sa.select(
+                url_imports.c.id,
+                url_imports.c.url,
+                url_imports.c.created_at,
+                url_imports.c.expires_at,
+                url_imports.c.custom_expiry,
+                url_imports.c.url_hash,
+            )
+            .distinct(url_imports.c.id)
+            .order_by(url_imports.c.id, url_imports.c.line)
+        )
+        query = (
+            pg_insert(cls)
+            .from_select(["id", "url", "created_at", "expires_at", "custom_expiry", "url_hash"], first_rows)
+            .on_conflict_do_nothing(index_elements=[cls.id])
+            .returning(cls.id, cls.url, cls.expires_at)
+        )
+        inserted = (await session.execute(query)).all()
+
+        query = (
+            sa.select(url_imports.c.line, url_imports.c.id, url_imports.c.url, cls.url.label("existing_url"))
+            .join(cls, operators.eq(cls.id, url_imports.c.id))
+            .where(operators.ne(cls.url, url_imports.c.url))
+            .order_by(url_imports.c.line)
+        )
+        conflicts = (await session.execute(query)).all()
+
+        await session.execute(sa.text(f"TRUNCATE {url_imports.name}"))
+        return inserted, conflicts
+
+    @classmethod
+    async def stream_for_warmup(
+        cls, connection: AsyncConnection, source: str, limit: int, batch_size: int
+    ) -> AsyncIterator[Sequence[sa.engine.Row]]:
+        """
+        Отдаёт пачками по batch_size строки (id, url, expires_at) не больше чем limit неистёкших
+        ссылок для прогрева кеша. Строки читаются серверным курсором, поэтому в памяти всегда только одна пачка.
+        source=clicks - самые популярные за последние сутки по почасовым счётчикам,
+        source=recent - последние созданные.
+        """
+        alive = operators.gt(cls.expires_at, utcnow())
+        if source == "clicks":
+            clicks = sa.func.sum(UrlStatsHourly.clicks).label("clicks")
+            popular = (
+                sa.select(UrlStatsHourly.url_id, clicks)
+                .where(UrlStatsHourly.hour >= truncate_hour(utcnow()) - timedelta(hours=24))
+                .group_by(UrlStatsHourly.url_id)
+                .order_by(clicks.desc())
+                .limit(limit)
+                .subquery()
+            )
+            query = (
+                sa.select(cls.id, cls.url, cls.expires_at)
+                .join(popular, popular.c.url_id == cls.id)
+                .where(alive)
+                .order_by(popular.c.clicks.desc())
+            )
+        elif source == "recent":
+            query = sa.select(cls.id, cls.url, cls.expires_at).where(alive).order_by(cls.created_at.desc()).limit(limit)
+        else:
+            raise ValueError(f"Unknown warm-up source: {source}")
+
+        result = await connection.stream(query)
+        async for rows in result.partitions(batch_size):
+            yield rows
+
+    @classmethod
+    def export_query(
+        cls, created_from: Optional[datetime], created_to: Optional[datetime], after: Optional[str]
+    ) -> sa.sql.Select:
+        """
+        Запрос для выгрузки ссылок в порядке (created_at, id), который идёт по индексу created_at.
+        after - курсор "<created_at>,<id>" последней полученной строки, чтобы продолжить прерванную выгрузку.
+        """
+        query = sa.select(cls.id, cls.url, cls.created_at, cls.expires_at).order_by(cls.created_at, cls.id)
+        if after is not None:
+            try:
+                after_created_at, after_id = after.rsplit(",", 1)
+                after_key = (datetime.fromisoformat(after_created_at), after_id)
+            except ValueError as e:
+                raise InvalidCursorError("Курсор ссылок должен иметь вид <created_at>,<id>") from e
+            query = query.where(sa.tuple_(cls.created_at, cls.id) > after_key)
+        return filter_created_at(query, cls.created_at, created_from, created_to)
+
+    @classmethod
+    async def clean_old(cls) -> int:
+        """
+        Удаляет истёкшие ссылки вместе с их статистикой, пачками по индексу expires_at.
+        Работать они перестают и без этого: истёкшие ссылки не отдаются ни из БД, ни из
+        кешей, где их время жизни не дольше срока ссылки, так что чистка нужна только для места.
+        """
+        dt = utcnow()
+        last_expires_at: Optional[datetime] = None
+
+        async def delete_batch(session: AsyncSession, limit: int) -> int:
+            nonlocal last_expires_at
+            conditions = [operators.lt(cls.expires_at, dt)]
+            if last_expires_at is not None:
+                conditions.append(operators.ge(cls.expires_at, last_expires_at))
+            query = sa.select(cls.id, cls.expires_at).where(*conditions).order_by(cls.expires_at).limit(limit)
+            rows = (await session.execute(query)).all()
+            if not rows:
+                return 0
+
+            url_ids = [row.id for row in rows]
+            last_expires_at = rows[-1].expires_at
+            await session.execute(sa.delete(UrlStats).where(UrlStats.url_id.in_(url_ids)))
+            await session.execute(sa.delete(UrlStatsHourly).where(UrlStatsHourly.url_id.in_(url_ids)))
+            await session.execute(sa.delete(UrlStatsMinutely).where(UrlStatsMinutely.url_id.in_(url_ids)))
+            await session.execute(sa.delete(cls).where(cls.id.in_(url_ids)))
+            return len(url_ids)
+
+        # Redis можно не чистить, т.к. в течении суток данные сами удалятся. Либо, если необходимо, можно удалить.
+        return await delete_in_batches(cls.__tablename__, delete_batch)
 
 
 class UrlStats(EmptyBaseModel):
+    """
+    Сырые переходы по ссылкам. Таблица разбита на часовые партиции по created_at:
+    будущие партиции заранее создаёт create_partitions, а старые целиком удаляет
+    clean_old, вместо построчного DELETE. Переходы вне созданных партиций (например,
+    если create_partitions давно не запускался) попадают в партицию по умолчанию
+    default_partition, а не роняют INSERT всей пачки.
+    """
+
     __tablename__ = "url_stats"
+    __table_args__ = (
+        sa.Index("ix_url_stats_url_id_created_at", "url_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+    partition_name_format = "url_stats_p%Y%m%d%H"
+    default_partition = "url_stats_default"
 
-    id = sa.Column(sa.Integer, primary_key=True)
+    id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
     url_id = sa.Column(sa.String(SHORT_CODE_LEN), sa.ForeignKey("urls.id"), nullable=False, unique=False)
-    created_at = sa.Column(sa.DateTime(timezone=True), default=utcnow)
+    created_at = sa.Column(sa.DateTime(timezone=True), primary_key=True, default=utcnow)
 
     @classmethod
-    async def create(cls, short_code: str) -> None:
+    def export_query(
+        cls, created_from: Optional[datetime], created_to: Optional[datetime], after: Optional[str]
+    ) -> sa.sql.Select:
         """
-        Добавляет в БД статистику о переходе по short_code.
+        Запрос для выгрузки переходов в порядке id: по created_at отсекаются лишние партиции,
+        а в оставшихся строки идут по первичному ключу без сортировки.
+        after - курсор "<id>" последней полученной строки.
         """
-        async with async_session() as session:
-            stats_obj = cls(url_id=short_code)
-            session.add(stats_obj)
-            await session.flush()
-            await session.commit()
+        query = sa.select(cls.id, cls.url_id, cls.created_at).order_by(cls.id)
+        if after is not None:
+            try:
+                after_id = int(after)
+            except ValueError as e:
+                raise InvalidCursorError("Курсор переходов должен быть числом") from e
+            query = query.where(operators.gt(cls.id, after_id))
+        return filter_created_at(query, cls.created_at, created_from, created_to)
+
+    @classmethod
+    async def bulk_create(cls, session: AsyncSession, clicks: Sequence[Tuple[str, datetime]]) -> None:
+        """
+        Одним INSERT-ом добавляет в БД статистику о переходах clicks, где каждый
+        переход это пара (short_code, время перехода), и в той же транзакции
+        увеличивает счётчики UrlStatsHourly и UrlStatsMinutely.
+        Переходы по ссылкам, которые успели удалить, отбрасываются, иначе из-за
+        одной такой ссылки не запишется вся пачка.
+        """
+        values = sa.values(
+            sa.column("url_id", sa.String(SHORT_CODE_LEN)),
+            sa.column("created_at", sa.DateTime(timezone=True)),
+            name="clicks",
+        ).data(list(clicks))
+        query = sa.insert(cls).from_select(
+            ["url_id", "created_at"],
+            sa.select(values.c.url_id, values.c.created_at).join(Url, operators.eq(Url.id, values.c.url_id)),
+        )
+        await session.execute(query)
+
+        await UrlStatsHourly.increment(session, Counter((url_id, truncate_hour(dt)) for url_id, dt in clicks))
+        await UrlStatsMinutely.increment(session, Counter((url_id, truncate_minute(dt)) for url_id, dt in clicks))
 
     @classmethod
     async def delete_by_url_id(cls, session: AsyncSession, url_id: str) -> None:
@@ -63,27 +371,325 @@ class UrlStats(EmptyBaseModel):
     @classmethod
     async def count_hours_stats(cls, session: AsyncSession, url_id: str, dt_from: datetime, dt_to: datetime) -> int:
         """
-        Возвращает количество переходов по ссылке за последние 24 часа.
+        Возвращает количество переходов по ссылке в интервале (dt_from, dt_to].
+        Полные часы внутри интервала берутся из почасовых счётчиков UrlStatsHourly,
+        а неполные первый и последний час досчитываются по сырым переходам, так что
+        за 24 часа суммируется не больше 25 значений вместо всех переходов.
         """
-        query = sa.select(cls).where(
+        first_hour = truncate_hour(dt_from) + timedelta(hours=1)  # Первый час, целиком лежащий в интервале
+        last_hour = truncate_hour(dt_to)  # Час, в который попадает dt_to, он неполный
+        if first_hour >= last_hour:
+            raw_condition = sa.and_(operators.gt(cls.created_at, dt_from), operators.le(cls.created_at, dt_to))
+        else:
+            raw_condition = sa.or_(
+                sa.and_(operators.gt(cls.created_at, dt_from), operators.lt(cls.created_at, first_hour)),
+                sa.and_(operators.ge(cls.created_at, last_hour), operators.le(cls.created_at, dt_to)),
+            )
+
+        raw_query = sa.select(sa.func.count()).where(sa.and_(operators.eq(cls.url_id, url_id), raw_condition))
+        hourly_query = sa.select(sa.func.coalesce(sa.func.sum(UrlStatsHourly.clicks), 0)).where(
             sa.and_(
-                operators.eq(cls.url_id, url_id),
-                operators.gt(cls.created_at, dt_from),
-                operators.le(cls.created_at, dt_to),
+                operators.eq(UrlStatsHourly.url_id, url_id),
+                operators.ge(UrlStatsHourly.hour, first_hour),
+                operators.lt(UrlStatsHourly.hour, last_hour),
             )
         )
-        total = await session.scalar(sa.select([sa.func.count()]).select_from(query))
+        total = await session.scalar(sa.select(raw_query.scalar_subquery() + hourly_query.scalar_subquery()))
         return total
 
     @classmethod
-    async def clean_old(cls) -> None:
+    async def get_partitions(cls, connection: AsyncConnection) -> Dict[datetime, str]:
+        """
+        Возвращает существующие часовые партиции в виде словаря "начало часа -> имя партиции".
+        """
+        query = sa.text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = CAST(:table AS regclass) AND c.relname <> :default"
+        )
+        result = await connection.execute(query, {"table": cls.__tablename__, "default": cls.default_partition})
+        return {
+            datetime.strptime(name, cls.partition_name_format).replace(tzinfo=timezone.utc): name
+            for name in result.scalars()
+        }
+
+    @classmethod
+    async def maintain_partitions(cls, create: bool = True, drop_old: bool = True) -> Tuple[int, int]:
+        """
+        Обслуживает партиции под одной блокировкой: если create, создаёт будущие, потом, если drop_old,
+        удаляет старые. Создание и удаление - одно задание, чтобы они не мешали друг другу и
+        ни одно не пропускалось из-за занятой другим блокировки. Возвращает (создано, удалено).
+        """
+        async with advisory_lock(f"{cls.__tablename__}_partitions") as connection:
+            if connection is None:
+                logger.info("Partition maintenance of %s is already running elsewhere, skipping", cls.__tablename__)
+                return 0, 0
+            created = await cls._create_missing_partitions(connection) if create else 0
+            dropped = await cls._drop_old_partitions(connection) if drop_old else 0
+        return created, dropped
+
+    @classmethod
+    async def create_partitions(cls) -> int:
         """
-        Удаляет статистику, старше 24 часов.
+        Создаёт партиции на STATS_PARTITIONS_AHEAD часов вперёд (см. maintain_partitions).
+        """
+        created, _ = await cls.maintain_partitions(drop_old=False)
+        return created
+
+    @classmethod
+    async def clean_old(cls) -> int:
+        """
+        Удаляет статистику старше 24 часов (см. maintain_partitions).
+        """
+        _, dropped = await cls.maintain_partitions(create=False)
+        return dropped
+
+    @classmethod
+    async def _create_missing_partitions(cls, connection: AsyncConnection) -> int:
+        """
+        Создаёт партиции на STATS_PARTITIONS_AHEAD часов вперёд, чтобы переходам всегда было куда записаться.
+        Переходы за этот час, успевшие попасть в партицию по умолчанию, переносятся в новую:
+        иначе PostgreSQL не даст её создать.
+        """
+        hour = truncate_hour(utcnow())
+        created = 0
+        partitions = await cls.get_partitions(connection)
+        for _ in range(settings.STATS_PARTITIONS_AHEAD + 1):
+            if hour not in partitions:
+                await cls._create_partition(connection, hour)
+                await connection.commit()
+                created += 1
+            hour += timedelta(hours=1)
+
+        if created:
+            logger.info("Created %s partitions of %s", created, cls.__tablename__)
+        return created
+
+    @classmethod
+    async def _create_partition(cls, connection: AsyncConnection, hour: datetime) -> None:
+        """
+        Создаёт партицию часа hour и переносит в неё переходы из партиции по умолчанию. Партицию
+        по умолчанию CREATE TABLE всё равно блокирует, так что блокируем её сразу, чтобы пока
+        переходы переносятся, туда не записались новые за тот же час.
+        """
+        table, default = cls.__tablename__, cls.default_partition
+        bounds = {"start": hour, "end": hour + timedelta(hours=1)}
+        await connection.execute(sa.text(f"LOCK TABLE {default} IN ACCESS EXCLUSIVE MODE"))
+        await connection.execute(sa.text(f"CREATE TEMPORARY TABLE {table}_moved (LIKE {table}) ON COMMIT DROP"))
+        await connection.execute(
+            sa.text(
+                f"WITH moved AS (DELETE FROM {default} WHERE created_at >= :start AND created_at < :end RETURNING *) "
+                f"INSERT INTO {table}_moved SELECT * FROM moved"
+            ),
+            bounds,
+        )
+        await connection.execute(
+            sa.text(
+                f'CREATE TABLE IF NOT EXISTS "{hour.strftime(cls.partition_name_format)}" PARTITION OF {table} '
+                f"FOR VALUES FROM ('{bounds['start'].isoformat()}') TO ('{bounds['end'].isoformat()}')"
+            )
+        )
+        await connection.execute(sa.text(f"INSERT INTO {table} SELECT * FROM {table}_moved"))
+
+    @classmethod
+    async def _drop_old_partitions(cls, connection: AsyncConnection) -> int:
+        """
+        Удаляет статистику, старше 24 часов: партиции, которые целиком старше, удаляются через DROP TABLE,
+        а из партиции по умолчанию старые переходы удаляются DELETE-ом.
         """
         dt = utcnow() - timedelta(hours=24)
+        started = time.monotonic()
+        dropped = 0
 
-        # Когда данных в БД станет много, то запрос может начать работать медленно, тогда поможет удаление батчами.
-        async with async_session() as session:
-            query = sa.delete(cls).where(operators.lt(cls.created_at, dt))
-            await session.execute(query)
-            await session.commit()
+        for hour, name in sorted((await cls.get_partitions(connection)).items()):
+            if hour + timedelta(hours=1) > dt:
+                break
+            await connection.execute(sa.text(f'DROP TABLE "{name}"'))
+            await connection.commit()
+            dropped += 1
+        await connection.execute(sa.text(f"DELETE FROM {cls.default_partition} WHERE created_at < :dt"), {"dt": dt})
+        await connection.commit()
+
+        logger.info("Cleanup %s dropped %s partitions in %.2fs", cls.__tablename__, dropped, time.monotonic() - started)
+        return dropped
+
+
+class ClickCounter(EmptyBaseModel, metaclass=AbstractModelMeta):
+    """
+    Абстрактная таблица счётчиков переходов: сколько раз перешли по ссылке url_id
+    за интервал (час, минуту), который начинается в bucket_column (UTC).
+    Счётчики заполняются вместе с UrlStats в UrlStats.bulk_create и хранятся retention,
+    так что статистика читается из них, сколько бы переходов ни было.
+    """
+
+    __abstract__ = True
+    retention = timedelta()
+
+    def __str__(self):
+        return f"<{type(self).__name__}({self.url_id=}, {self.bucket_column()})>"
+
+    @classmethod
+    @abc.abstractmethod
+    def bucket_column(cls) -> sa.Column:
+        ...
+
+    @staticmethod
+    @abc.abstractmethod
+    def truncate(dt: datetime) -> datetime:
+        """Начало интервала, в который попадает dt."""
+
+    @classmethod
+    async def increment(cls, session: AsyncSession, counts: Mapping[Tuple[str, datetime], int]) -> None:
+        """
+        Увеличивает счётчики на counts, где ключ это пара (url_id, начало интервала).
+        """
+        if not counts:
+            return
+
+        bucket = cls.bucket_column()
+        # Одинаковый порядок строк, чтобы параллельные upsert-ы не взаимоблокировались.
+        values = sa.values(
+            sa.column("url_id", sa.String(SHORT_CODE_LEN)),
+            sa.column("bucket", sa.DateTime(timezone=True)),
+            sa.column("clicks", sa.BigInteger),
+            name="counts",
+        ).data([(url_id, dt, clicks) for (url_id, dt), clicks in sorted(counts.items())])
+        query = pg_insert(cls).from_select(
+            ["url_id", bucket.name, "clicks"],
+            sa.select(values.c.url_id, values.c.bucket, values.c.clicks).join(
+                Url, operators.eq(Url.id, values.c.url_id)
+            ),
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[cls.url_id, bucket],
+            set_={"clicks": cls.clicks + query.excluded.clicks},
+        )
+        await session.execute(query)
+
+    @classmethod
+    async def get_series(
+        cls, session: AsyncSession, url_id: str, dt_from: datetime, dt_to: datetime, trunc_to: Optional[str] = None
+    ) -> Dict[datetime, int]:
+        """
+        Возвращает переходы по ссылке url_id по интервалам, начинающимся в [dt_from, dt_to).
+        С trunc_to (например, "day") интервалы укрупняются через date_trunc в UTC.
+        Интервалы без переходов в ответ не попадают.
+        """
+        bucket = cls.bucket_column()
+        if trunc_to is not None:
+            bucket = sa.func.timezone("UTC", sa.func.date_trunc(trunc_to, sa.func.timezone("UTC", bucket)))
+        query = (
+            sa.select(bucket.label("bucket"), sa.func.sum(cls.clicks)).where(
+                operators.eq(cls.url_id, url_id),
+                operators.ge(cls.bucket_column(), dt_from),
+                operators.lt(cls.bucket_column(), dt_to),
+            )
+            # По имени колонки: в выражении есть параметры, и PostgreSQL не узнал бы его в GROUP BY.
+            .group_by(sa.literal_column("bucket"))
+        )
+        result = await session.execute(query)
+        return {dt: int(clicks) for dt, clicks in result.all()}
+
+    @classmethod
+    async def count_many(
+        cls, session: AsyncSession, url_ids: Sequence[str], dt_from: datetime, dt_to: datetime
+    ) -> Dict[str, int]:
+        """
+        Возвращает переходы по ссылкам url_ids за интервалы, начинающиеся в [dt_from, dt_to), одним запросом.
+        Ссылок без переходов в ответе нет.
+        """
+        query = (
+            sa.select(cls.url_id, sa.func.sum(cls.clicks))
+            .where(
+                cls.url_id.in_(url_ids),
+                operators.ge(cls.bucket_column(), dt_from),
+                operators.lt(cls.bucket_column(), dt_to),
+            )
+            .group_by(cls.url_id)
+        )
+        result = await session.execute(query)
+        return {url_id: int(clicks) for url_id, clicks in result.all()}
+
+    @classmethod
+    async def delete_by_url_id(cls, session: AsyncSession, url_id: str) -> None:
+        """
+        Удаляет счётчики ссылки url_id.
+        """
+        query = sa.delete(cls).where(cls.url_id == url_id)
+        await session.execute(query)
+
+    @classmethod
+    async def clean_old(cls) -> int:
+        """
+        Удаляет счётчики за интервалы старше retention.
+        """
+        bucket = cls.bucket_column()
+        dt = cls.truncate(utcnow() - cls.retention)
+
+        async def delete_batch(session: AsyncSession, limit: int) -> int:
+            batch = sa.select(cls.url_id, bucket).where(operators.lt(bucket, dt)).order_by(bucket).limit(limit)
+            query = sa.delete(cls).where(sa.tuple_(cls.url_id, bucket).in_(batch))
+            result = await session.execute(query.execution_options(synchronize_session=False))
+            return result.rowcount
+
+        return await delete_in_batches(cls.__tablename__, delete_batch)
+
+
+class UrlStatsHourly(ClickCounter):
+    """
+    Количество переходов по ссылке url_id за час, начинающийся в hour (UTC).
+    """
+
+    __tablename__ = "url_stats_hourly"
+    retention = timedelta(hours=settings.STATS_HOURLY_RETENTION)
+
+    url_id = sa.Column(sa.String(SHORT_CODE_LEN), sa.ForeignKey("urls.id"), primary_key=True)
+    hour = sa.Column(sa.DateTime(timezone=True), primary_key=True, index=True)
+    clicks = sa.Column(sa.BigInteger, nullable=False, default=0)
+
+    @classmethod
+    def bucket_column(cls) -> sa.Column:
+        return cls.hour
+
+    @staticmethod
+    def truncate(dt: datetime) -> datetime:
+        return truncate_hour(dt)
+
+    @classmethod
+    async def backfill(cls, session: AsyncSession) -> None:
+        """
+        Пересчитывает счётчики по всем сырым переходам из UrlStats.
+        Существующие счётчики перезаписываются, поэтому запускать лучше до того,
+        как переходы начнут писаться новым кодом.
+        """
+        hour = sa.func.timezone("UTC", sa.func.date_trunc("hour", sa.func.timezone("UTC", UrlStats.created_at)))
+        clicks = sa.select(UrlStats.url_id, hour.label("hour")).subquery()
+        query = pg_insert(cls).from_select(
+            ["url_id", "hour", "clicks"],
+            sa.select(clicks.c.url_id, clicks.c.hour, sa.func.count()).group_by(clicks.c.url_id, clicks.c.hour),
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[cls.url_id, cls.hour],
+            set_={"clicks": query.excluded.clicks},
+        )
+        await session.execute(query)
+
+
+class UrlStatsMinutely(ClickCounter):
+    """
+    Количество переходов по ссылке url_id за минуту, начинающуюся в minute (UTC).
+    """
+
+    __tablename__ = "url_stats_minutely"
+    retention = timedelta(hours=settings.STATS_MINUTELY_RETENTION)
+
+    url_id = sa.Column(sa.String(SHORT_CODE_LEN), sa.ForeignKey("urls.id"), primary_key=True)
+    minute = sa.Column(sa.DateTime(timezone=True), primary_key=True, index=True)
+    clicks = sa.Column(sa.BigInteger, nullable=False, default=0)
+
+    @classmethod
+    def bucket_column(cls) -> sa.Column:
+        return cls.minute
+
+    @staticmethod
+    def truncate(dt: datetime) -> datetime:
+        return truncate_minute(dt)
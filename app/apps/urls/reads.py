@@ -0,0 +1,75 @@
+"""
+Чтение ссылок и статистики с реплик БД (см. app.db.ReplicaSet). Чтобы сразу после
+изменения ссылки запрос к ней не получил с отстающей реплики старые данные (и не
+положил их в кеши), коды изменённых ссылок DB_READ_YOUR_WRITES_WINDOW секунд
+помнятся в памяти процесса и в Redis для остальных, а чтения по ним идут в основную БД.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Collection, Optional, TypeVar
+
+from aioredis import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cache import LocalCache
+from app.config import settings
+from app.db import replicas
+from app.deps import redis_batch
+
+
+logger = logging.getLogger(__name__)
+TResult = TypeVar("TResult")
+
+recent_writes: LocalCache[bool] = LocalCache(
+    max_size=settings.LOCAL_CACHE_SIZE, ttl=settings.DB_READ_YOUR_WRITES_WINDOW
+)
+
+
+async def mark_written(short_codes: Collection[str]) -> None:
+    """
+    Запоминает, что ссылки short_codes только что изменились. Вызывать после коммита,
+    но до ответа клиенту, иначе его следующий запрос может успеть уйти на реплику.
+    """
+    if not replicas.engines:
+        return
+    for short_code in short_codes:
+        recent_writes.set(short_code, True)
+    try:
+        await asyncio.gather(
+            *(
+                redis_batch.set(
+                    settings.REDIS_WRITTEN_KEY.format(short_code), 1, ex=settings.DB_READ_YOUR_WRITES_WINDOW
+                )
+                for short_code in short_codes
+            )
+        )
+    except RedisError:
+        # Этот процесс прочитает их с основной БД, а остальные - как повезёт с отставанием реплик.
+        logger.exception("Error while marking written urls in Redis")
+
+
+async def written_recently(short_code: str) -> bool:
+    """
+    Менялась ли ссылка short_code за последние DB_READ_YOUR_WRITES_WINDOW секунд.
+    Если Redis не ответил, считается, что менялась: лишнее чтение с основной БД безопаснее старых данных.
+    """
+    if recent_writes.get(short_code):
+        return True
+    try:
+        return bool(await redis_batch.execute_command("EXISTS", settings.REDIS_WRITTEN_KEY.format(short_code)))
+    except RedisError:
+        return True
+
+
+async def read(
+    query: Callable[[AsyncSession], Awaitable[TResult]],
+    fallback: Callable[[], Awaitable[TResult]],
+    short_code: Optional[str] = None,
+) -> TResult:
+    """
+    Выполняет query на реплике, а если годных реплик нет, они не ответили или
+    ссылку short_code недавно меняли, вызывает fallback, который читает то же самое с основной БД.
+    """
+    if not replicas.engines or (short_code is not None and await written_recently(short_code)):
+        return await fallback()
+    return await replicas.read(query, fallback)
@@ -0,0 +1,55 @@
+"""
+Готовые ответы редиректа. Для каждой ссылки в url_cache заранее собрано сообщение
+начала ответа ASGI с байтами заголовков (Location, Cache-Control), так что на
+попадание в кеш урл не экранируется заново и не создаются ни RedirectResponse,
+ни список заголовков.
+"""
+from typing import Any, Dict, List, Tuple
+from urllib.parse import quote
+
+from starlette.responses import Response
+
+from app.config import settings
+
+
+# Те же символы, что не экранирует RedirectResponse
+LOCATION_SAFE = ":/%#?=@[]!$&'()*+,;"
+# Браузеры и CDN отдают закешированный редирект сами, и такие переходы не попадают в статистику.
+cache_headers: List[Tuple[bytes, bytes]] = (
+    [(b"cache-control", f"public, max-age={settings.REDIRECT_MAX_AGE}".encode())] if settings.REDIRECT_MAX_AGE else []
+)
+BODY_MESSAGE: Dict[str, Any] = {"type": "http.response.body", "body": b""}
+
+
+class Redirect:
+    """
+    Длинный урл ссылки и готовое сообщение http.response.start редиректа на него.
+    Сообщение отправляется как есть, поэтому менять его (и его заголовки) нельзя.
+    """
+
+    __slots__ = ("url", "start_message")
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        headers = [(b"location", quote(url, safe=LOCATION_SAFE).encode("latin-1")), (b"content-length", b"0")]
+        self.start_message: Dict[str, Any] = {
+            "type": "http.response.start",
+            "status": settings.REDIRECT_STATUS_CODE,
+            "headers": headers + cache_headers,
+        }
+
+    def __repr__(self) -> str:
+        return f"Redirect({self.url!r})"
+
+
+class CachedRedirectResponse(Response):
+    """
+    Response из готового Redirect для обработчиков FastAPI. Заголовки копируются,
+    потому что через response.headers их может поменять кто угодно.
+    """
+
+    def __init__(self, redirect: Redirect) -> None:  # pylint: disable=super-init-not-called
+        self.status_code = redirect.start_message["status"]
+        self.raw_headers = list(redirect.start_message["headers"])
+        self.body = b""
+        self.background = None
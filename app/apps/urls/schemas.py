@@ -1,6 +1,11 @@
 import datetime
+from enum import Enum
+from typing import Dict, List, Optional
 
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel, conlist, HttpUrl, validator
+
+from app.config import settings
+from app.utils import utcnow
 
 
 class BaseSchema(BaseModel):
@@ -14,11 +19,102 @@ class BaseSchema(BaseModel):
 
 class UrlCreate(BaseSchema):
     url: HttpUrl
+    # Когда ссылка перестанет работать (без часового пояса - в UTC). По умолчанию через SHORT_URL_TTL после создания,
+    # а при обновлении срок без этого поля не меняется.
+    expires_at: Optional[datetime.datetime] = None
+
+    @validator("expires_at")
+    def check_expires_at(  # pylint: disable=no-self-argument
+        cls, value: Optional[datetime.datetime]
+    ) -> Optional[datetime.datetime]:
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        if value <= utcnow():
+            raise ValueError("expires_at должен быть в будущем")
+        return value
 
 
 class Url(BaseSchema):
     url_short: str
 
 
+class UrlBulkCreate(BaseSchema):
+    urls: conlist(UrlCreate, min_items=1, max_items=settings.BULK_MAX_ITEMS)  # type: ignore
+
+
+class UrlBulkItem(BaseSchema):
+    url_short: Optional[str] = None
+    error: Optional[str] = None  # Почему ссылку не удалось создать, если url_short пуст
+
+
+class UrlBulkResponse(BaseSchema):
+    urls: List[UrlBulkItem]
+
+
+class ExportTable(str, Enum):
+    urls = "urls"
+    clicks = "clicks"
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+ImportFormat = ExportFormat  # Импорт понимает те же форматы, что и выгрузка
+
+
+class UrlImportError(BaseSchema):
+    line: int  # Номер строки в файле, начиная с 1
+    code: Optional[str] = None
+    error: str
+    existing_url: Optional[str] = None  # Чем уже занят код, если это конфликт
+
+
+class UrlImportResult(BaseSchema):
+    total: int  # Сколько строк с данными прочитано
+    inserted: int
+    unchanged: int  # Такие ссылки уже были
+    conflicts: int
+    invalid: int
+
+
 class StatsResponse(BaseModel):
     redirects_in_24_hours: int
+    unique_visitors_in_24_hours: Optional[int] = None  # Оценка по HyperLogLog, None - Redis недоступен
+
+
+class StatsGranularity(str, Enum):
+    minute = "minute"
+    hour = "hour"
+    day = "day"
+
+
+class StatsPoint(BaseSchema):
+    time: datetime.datetime  # Начало интервала
+    clicks: int
+
+
+class StatsSeries(BaseSchema):
+    code: str
+    granularity: StatsGranularity
+    start: datetime.datetime
+    end: datetime.datetime
+    total: int
+    points: List[StatsPoint]
+
+
+class StatsBatchRequest(BaseSchema):
+    codes: conlist(str, min_items=1, max_items=settings.STATS_BATCH_MAX_CODES)  # type: ignore
+    granularity: StatsGranularity = StatsGranularity.hour
+    start: Optional[datetime.datetime] = None
+    end: Optional[datetime.datetime] = None
+
+
+class StatsBatchResponse(BaseSchema):
+    granularity: StatsGranularity
+    start: datetime.datetime
+    end: datetime.datetime
+    counts: Dict[str, int]
@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Dict, Optional, Sequence, Tuple, Type
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.apps.urls import models, reads, schemas
+from app.apps.urls.cache import stats_cache
+from app.config import settings
+from app.exceptions import InvalidStatsWindowError
+from app.utils import utcnow
+
+
+Granularity = schemas.StatsGranularity
+
+steps = {
+    Granularity.minute: timedelta(minutes=1),
+    Granularity.hour: timedelta(hours=1),
+    Granularity.day: timedelta(days=1),
+}
+# Окно по умолчанию, если start не передан.
+default_windows = {
+    Granularity.minute: timedelta(hours=1),
+    Granularity.hour: timedelta(hours=24),
+    Granularity.day: timedelta(days=30),
+}
+# Из каких счётчиков читать и до чего их укрупнять. Дни собираются из почасовых счётчиков.
+counters: Dict[str, Tuple[Type[models.ClickCounter], Optional[str]]] = {
+    Granularity.minute: (models.UrlStatsMinutely, None),
+    Granularity.hour: (models.UrlStatsHourly, None),
+    Granularity.day: (models.UrlStatsHourly, "day"),
+}
+
+
+def as_utc(dt: datetime) -> datetime:
+    """
+    dt в UTC. dt без часового пояса считается временем в UTC.
+    """
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+
+def truncate(dt: datetime, granularity: Granularity) -> datetime:
+    """
+    Начало интервала granularity в UTC, в который попадает dt (см. as_utc).
+    """
+    dt = as_utc(dt)
+    if granularity == Granularity.minute:
+        return dt.replace(second=0, microsecond=0)
+    if granularity == Granularity.hour:
+        return dt.replace(minute=0, second=0, microsecond=0)
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def stats_window(
+    granularity: Granularity, start: Optional[datetime], end: Optional[datetime]
+) -> Tuple[datetime, datetime]:
+    """
+    Выравнивает окно [start, end) по границам интервалов: start - вниз, end - вверх,
+    так что неполные крайние интервалы считаются целиком. Без end окно заканчивается
+    текущим интервалом, без start - длится default_windows. Выровненные границы
+    не меняются в течение интервала, поэтому ответы для них можно кешировать.
+    """
+    step = steps[granularity]
+    # Сравнивать с выровненными границами можно только время с часовым поясом
+    start = as_utc(start) if start is not None else None
+    end = as_utc(end) if end is not None else None
+    aligned_end = truncate(end or utcnow(), granularity)
+    if end is None or aligned_end != end:
+        aligned_end += step
+    aligned_start = truncate(start, granularity) if start is not None else aligned_end - default_windows[granularity]
+
+    if aligned_start >= aligned_end:
+        raise InvalidStatsWindowError("start должен быть раньше end")
+    if (aligned_end - aligned_start) / step > settings.STATS_MAX_POINTS:
+        raise InvalidStatsWindowError(f"В окне больше {settings.STATS_MAX_POINTS} интервалов {granularity.value}")
+    return aligned_start, aligned_end
+
+
+async def get_series(
+    session: AsyncSession, code: str, granularity: Granularity, start: datetime, end: datetime
+) -> schemas.StatsSeries:
+    """
+    Переходы по ссылке code по интервалам granularity в выровненном окне [start, end),
+    включая интервалы без переходов. Данные старше срока хранения счётчиков
+    (STATS_MINUTELY_RETENTION, STATS_HOURLY_RETENTION) отдаются нулями.
+    """
+    model, trunc_to = counters[granularity]
+    clicks = await model.get_series(session, code, start, end, trunc_to)
+
+    points = []
+    dt = start
+    while dt < end:
+        points.append(schemas.StatsPoint(time=dt, clicks=clicks.get(dt, 0)))
+        dt += steps[granularity]
+    return schemas.StatsSeries(
+        code=code, granularity=granularity, start=start, end=end, total=sum(clicks.values()), points=points
+    )
+
+
+async def count_clicks(
+    session: AsyncSession, codes: Sequence[str], granularity: Granularity, start: datetime, end: datetime
+) -> Dict[str, int]:
+    """
+    Переходы по каждой из ссылок codes в выровненном окне [start, end). Количества
+    берутся из stats_cache, а из БД (с реплики, если есть) одним запросом читаются только недостающие.
+    """
+    model, _ = counters[granularity]
+    cache_keys = {code: f"count:{code}:{granularity.value}:{start.isoformat()}:{end.isoformat()}" for code in codes}
+    counts: Dict[str, int] = {}
+    for code, key in cache_keys.items():
+        count = stats_cache.get(key)
+        if count is not None:
+            counts[code] = count
+
+    missing = [code for code in cache_keys if code not in counts]
+    if missing:
+        found = await reads.read(
+            partial(model.count_many, url_ids=missing, dt_from=start, dt_to=end),
+            partial(model.count_many, session, missing, start, end),
+        )
+        for code in missing:
+            counts[code] = found.get(code, 0)
+            stats_cache.set(cache_keys[code], counts[code])
+    return {code: counts[code] for code in cache_keys}
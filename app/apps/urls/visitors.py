@@ -0,0 +1,61 @@
+"""
+Приблизительный подсчёт уникальных посетителей ссылок через HyperLogLog в Redis.
+На каждую ссылку и час заводится свой HyperLogLog (REDIS_VISITORS_KEY): он занимает
+не больше 12КБ, сколько бы посетителей ни было, а при небольшом их числе Redis
+хранит его в разреженном виде и того меньше. Ошибка оценки - около 0.81%.
+"""
+import hashlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from starlette.types import Scope
+
+from app.config import settings
+from app.deps import redis, redis_breaker
+from app.utils import truncate_hour, utcnow
+
+
+def visitor_id(scope: Scope) -> str:
+    """
+    Посетитель - это пара IP-адрес и User-Agent. В Redis уходит только короткий хеш от неё.
+    Берётся прямо из ASGI scope, чтобы не создавать ради этого Request.
+    """
+    client = scope.get("client")
+    user_agent = next((value for name, value in scope["headers"] if name == b"user-agent"), b"")
+    visitor = (client[0] if client else "").encode() + b"\n" + user_agent
+    return hashlib.blake2b(visitor, digest_size=8).hexdigest()
+
+
+async def add_visitors(visits: Iterable[Tuple[str, datetime, Optional[str]]]) -> None:
+    """
+    Добавляет посетителей visits (код, время перехода, посетитель) в часовые HyperLogLog
+    одним пайплайном: по одному PFADD и EXPIRE на каждую пару (код, час).
+    """
+    visitors: Dict[str, Set[str]] = defaultdict(set)
+    for short_code, dt, visitor in visits:
+        if visitor is not None:
+            visitors[settings.REDIS_VISITORS_KEY.format(short_code, dt)].add(visitor)
+    if not visitors:
+        return
+
+    async def write() -> None:
+        async with redis.pipeline(transaction=False) as pipe:
+            for key, values in visitors.items():
+                pipe.pfadd(key, *values)
+                pipe.expire(key, settings.REDIS_VISITORS_TTL)
+            await pipe.execute()
+
+    await redis_breaker.call(write)
+
+
+async def count_visitors(short_code: str, dt_to: Optional[datetime] = None) -> int:
+    """
+    Оценка числа уникальных посетителей ссылки за 24 часа до dt_to. PFCOUNT по нескольким
+    ключам считает их объединение, так что посетитель, заходивший в разные часы, учитывается
+    один раз. Берутся ровно 24 часа, включая неполный текущий, так что окно не длиннее 24 часов
+    (начало самого старого часа может не попасть) и оценка не больше числа переходов за 24 часа.
+    """
+    hour = truncate_hour(dt_to or utcnow())
+    keys = [settings.REDIS_VISITORS_KEY.format(short_code, hour - timedelta(hours=i)) for i in range(24)]
+    return await redis_breaker.call(redis.pfcount, *keys)
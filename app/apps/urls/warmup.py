@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import time
+from typing import Sequence
+
+import sqlalchemy as sa
+from aioredis import RedisError
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.apps.urls import models
+from app.config import settings
+from app.db import maintenance_engine
+from app.deps import redis, redis_breaker
+from app.utils import ttl_until, utcnow
+
+
+logger = logging.getLogger(__name__)
+
+
+async def write_batch(rows: Sequence[sa.engine.Row], nx: bool = True) -> None:
+    """
+    Пишет пачку ссылок (id, url, expires_at) в Redis одним пайплайном, каждую не дольше
+    её срока. По умолчанию (nx) уже лежащие в Redis значения не трогаем: они не старше
+    тех, что мы прочитали из БД.
+    """
+    async with redis.pipeline(transaction=False) as pipe:
+        for row in rows:
+            ttl = ttl_until(row.expires_at, settings.REDIS_URL_TTL)
+            if ttl:
+                pipe.set(settings.REDIS_URL_KEY.format(row.id), row.url, px=ttl, nx=nx)
+        await pipe.execute()
+
+
+async def warm_up(connection: AsyncConnection, source: str, limit: int) -> int:
+    """
+    Загружает в Redis до limit ссылок из source (см. Url.stream_for_warmup) со скоростью
+    не больше WARMUP_RATE ссылок в секунду и возвращает их количество. Прогресс пишется в лог.
+    """
+    started = time.monotonic()
+    warmed = 0
+    async for rows in models.Url.stream_for_warmup(connection, source, limit, settings.WARMUP_BATCH_SIZE):
+        await redis_breaker.call(write_batch, rows)
+        warmed += len(rows)
+
+        elapsed = time.monotonic() - started
+        logger.info("Cache warm-up: %s of at most %s urls in %.2fs", warmed, limit, elapsed)
+        pause = warmed / settings.WARMUP_RATE - elapsed
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+    logger.info("Cache warm-up finished: %s urls from %s in %.2fs", warmed, source, time.monotonic() - started)
+    return warmed
+
+
+async def warm_up_if_flushed() -> None:
+    """
+    Прогревает Redis, если в нём нет метки REDIS_WARMUP_MARKER_KEY: значит, он
+    перезапустился без данных, его очистили или он ещё ни разу не прогревался.
+    Метка ставится через SET NX, так что из нескольких процессов прогревает один.
+    """
+    if not await redis_breaker.call(redis.set, settings.REDIS_WARMUP_MARKER_KEY, utcnow().isoformat(), nx=True):
+        return
+
+    try:
+        async with maintenance_engine.connect() as connection:
+            await warm_up(connection, settings.WARMUP_SOURCE, settings.WARMUP_LIMIT)
+    except Exception:
+        # Уберём метку, чтобы при следующей проверке прогрев начался заново
+        try:
+            await redis.delete(settings.REDIS_WARMUP_MARKER_KEY)
+        except RedisError:
+            logger.exception("Error while deleting warm-up marker from Redis")
+        raise
@@ -0,0 +1,97 @@
+import asyncio
+import time
+from collections import OrderedDict
+from functools import partial
+from typing import Awaitable, Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+
+TValue = TypeVar("TValue")
+
+
+class LocalCache(Generic[TValue]):
+    """
+    LRU-кеш в памяти процесса с ограничением по размеру и времени жизни записей.
+    Не потокобезопасен, но в рамках одного event loop это и не нужно.
+
+    Чтобы не положить в кеш значение, прочитанное до инвалидации, перед чтением
+    из внешнего хранилища стоит запомнить generation и передать его в set():
+    если за это время случилась инвалидация, значение просто не сохранится.
+    """
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # Вытеснены из-за переполнения
+        self.generation = 0  # Увеличивается при каждой инвалидации
+
+        self._data: "OrderedDict[str, Tuple[float, TValue]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[TValue]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: TValue, generation: Optional[int] = None, ttl: Optional[float] = None) -> None:
+        """
+        Кладёт value на ttl секунд, но не дольше, чем на ttl кеша.
+        """
+        if generation is not None and generation != self.generation:
+            return
+
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else min(ttl, self.ttl)), value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: str) -> None:
+        self.generation += 1
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._data.clear()
+
+
+class SingleFlight(Generic[TValue]):
+    """
+    Объединяет одновременные вызовы с одинаковым ключом: пока первый вызов
+    не завершился, остальные не запускают свою функцию, а ждут его результат
+    (или исключение). Если ждавший запрос отменят, общий вызов продолжится для остальных.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, "asyncio.Future[TValue]"] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, function: Callable[[], Awaitable[TValue]]) -> TValue:
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(function())
+            self._calls[key] = call
+            call.add_done_callback(partial(self._forget, key))
+        return await asyncio.shield(call)
+
+    def _forget(self, key: str, call: "asyncio.Future[TValue]") -> None:
+        self._calls.pop(key, None)
+        if not call.cancelled():
+            call.exception()  # Иначе asyncio напишет в лог, если результат никто не дождался
@@ -0,0 +1,133 @@
+"""
+Служебные команды проекта.
+Запуск: python -m app.cli <команда> [аргументы]
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from typing import AsyncIterator, ContextManager, TextIO
+
+from app.apps.urls import models, schemas
+from app.apps.urls.export import export_query, export_rows
+from app.apps.urls.imports import import_urls
+from app.apps.urls.warmup import warm_up
+from app.config import settings
+from app.db import async_session, engine
+from app.logging import configure_logging
+
+
+logger = logging.getLogger(__name__)
+
+
+async def backfill_stats(args: argparse.Namespace) -> None:  # pylint: disable=unused-argument
+    """
+    Пересчитывает почасовые счётчики переходов по сырой статистике.
+    """
+    started = time.monotonic()
+    async with async_session() as session:
+        await models.UrlStatsHourly.backfill(session)
+        await session.commit()
+    logger.info("Hourly stats backfilled in %.2fs", time.monotonic() - started)
+
+
+async def backfill_url_hashes(args: argparse.Namespace) -> None:  # pylint: disable=unused-argument
+    """
+    Заполняет хеши урлов у ссылок, созданных до их появления, чтобы режим dedup находил и их.
+    """
+    started = time.monotonic()
+    async with async_session() as session:
+        updated = await models.Url.backfill_url_hashes(session, settings.CLEANUP_BATCH_SIZE)
+    logger.info("Url hashes of %s urls backfilled in %.2fs", updated, time.monotonic() - started)
+
+
+async def warm_cache(args: argparse.Namespace) -> None:
+    """
+    Загружает ссылки из БД в Redis, не дожидаясь, пока их запросят.
+    """
+    async with engine.connect() as connection:
+        await warm_up(connection, args.source, args.limit)
+
+
+async def export(args: argparse.Namespace) -> None:
+    """
+    Выгружает ссылки или переходы в файл или stdout, см. export_table.
+    """
+    started = time.monotonic()
+    query = export_query(args.table, args.created_from, args.created_to, args.after)
+    output_file: ContextManager[TextIO] = nullcontext(sys.stdout)
+    if args.output:
+        output_file = open(args.output, "w", encoding="utf-8", newline="")  # pylint: disable=consider-using-with
+    with output_file as output:
+        async with engine.connect() as connection:
+            async for chunk in export_rows(connection, query, args.format):
+                output.write(chunk)
+    logger.info("Exported %s in %.2fs", args.table.value, time.monotonic() - started)
+
+
+async def read_file_lines(path: str) -> AsyncIterator[bytes]:
+    with open(path, "rb") as file:
+        for line in file:
+            yield line
+
+
+async def import_file(args: argparse.Namespace) -> None:
+    """
+    Импортирует ссылки с заданными кодами из файла, см. import_urls_file.
+    Невалидные строки и конфликты пишутся в NDJSON-отчёт, итог - в лог.
+    """
+    report_file: ContextManager[TextIO] = nullcontext(sys.stdout)
+    if args.report:
+        report_file = open(args.report, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+    with report_file as report:
+        async with async_session() as session:
+            async for item in import_urls(session, read_file_lines(args.file), args.format, args.warm):
+                if isinstance(item, schemas.UrlImportError):
+                    report.write(item.json() + "\n")
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    backfill_parser = subparsers.add_parser("backfill-stats", help="пересчитать почасовые счётчики переходов")
+    backfill_parser.set_defaults(handler=backfill_stats)
+
+    hashes_parser = subparsers.add_parser("backfill-url-hashes", help="заполнить хеши урлов у старых ссылок")
+    hashes_parser.set_defaults(handler=backfill_url_hashes)
+
+    warm_parser = subparsers.add_parser("warm-cache", help="загрузить популярные или новые ссылки в Redis")
+    warm_parser.add_argument("--source", choices=["clicks", "recent"], default=settings.WARMUP_SOURCE)
+    warm_parser.add_argument("--limit", type=int, default=settings.WARMUP_LIMIT)
+    warm_parser.set_defaults(handler=warm_cache)
+
+    export_parser = subparsers.add_parser("export", help="выгрузить ссылки или переходы в NDJSON или CSV")
+    export_parser.add_argument("table", type=schemas.ExportTable, choices=list(schemas.ExportTable))
+    export_parser.add_argument(
+        "--format", type=schemas.ExportFormat, choices=list(schemas.ExportFormat), default=schemas.ExportFormat.ndjson
+    )
+    export_parser.add_argument("--created-from", type=datetime.fromisoformat)
+    export_parser.add_argument("--created-to", type=datetime.fromisoformat)
+    export_parser.add_argument("--after", help="курсор последней полученной строки, чтобы продолжить выгрузку")
+    export_parser.add_argument("-o", "--output", help="файл, по умолчанию stdout")
+    export_parser.set_defaults(handler=export)
+
+    import_parser = subparsers.add_parser("import", help="импортировать ссылки с заданными кодами из CSV или NDJSON")
+    import_parser.add_argument("file")
+    import_parser.add_argument(
+        "--format", type=schemas.ImportFormat, choices=list(schemas.ImportFormat), default=schemas.ImportFormat.ndjson
+    )
+    import_parser.add_argument("--warm", action="store_true", help="сразу записать добавленные ссылки в Redis")
+    import_parser.add_argument("--report", help="файл для невалидных строк и конфликтов, по умолчанию stdout")
+    import_parser.set_defaults(handler=import_file)
+
+    return parser
+
+
+def main() -> None:
+    configure_logging()
+    args = make_parser().parse_args()
+    asyncio.run(args.handler(args))
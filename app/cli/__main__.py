@@ -0,0 +1,4 @@
+from app.cli import main
+
+
+main()
@@ -1,3 +1,5 @@
+from typing import Any, Dict, List
+
 import pydantic
 from sqlalchemy.engine.url import URL
 
@@ -12,10 +14,82 @@ class Settings(pydantic.BaseSettings):
     SHORT_URL_TTL: int = 30 * 24 * 60 * 60  # Время, которое короткая ссылка живёт в проекте (в БД)
     # В ТЗ этого не указано, однако в существующих сервисах ссылки живут не бесконечно долго.
 
+    # Выдача кодов для новых коротких ссылок
+    SHORT_CODE_ALLOCATOR: str = "sequence"  # "sequence" - перемешанная последовательность из БД, "random" - случайные
+    # Ключ перемешивания последовательности, по нему можно восстановить все коды. Для "sequence" обязателен,
+    # только в DEBUG без него коды выдаются случайно.
+    SHORT_CODE_SECRET: str = ""
+    SHORT_CODE_BLOCK_SIZE: int = 1000  # Сколько номеров последовательности резервировать за раз
+    SHORT_CODE_ATTEMPTS: int = 10  # Сколько раз пробовать новый код, если выданный уже занят
+
+    # Повторное создание той же ссылки
+    CREATE_DEDUP: bool = False  # Возвращать уже существующий код для того же урла, если в запросе не указано иное
+    IDEMPOTENCY_TTL: int = 24 * 60 * 60  # Сколько секунд помнить результат запроса с Idempotency-Key
+    IDEMPOTENCY_LOCK_TTL: int = 30  # Сколько секунд запрос с Idempotency-Key может выполняться, прежде чем его повторят
+
+    # Редирект
+    REDIRECT_STATUS_CODE: int = 307  # 301 или 308 - постоянный редирект, 302 или 307 - временный
+    REDIRECT_MAX_AGE: int = 0  # Сколько секунд браузеры и CDN могут кешировать редирект, 0 - без Cache-Control
+
+    # Массовое создание ссылок
+    BULK_MAX_ITEMS: int = 10_000  # Сколько ссылок можно передать в одном JSON-запросе
+    BULK_CHUNK_SIZE: int = 1000  # Сколько ссылок вставлять в БД одним INSERT-ом
+
     # Redis
     REDIS_URI: str = "redis://redis/1"
+    REDIS_MAX_CONNECTIONS: int = 50  # Размер пула соединений каждого клиента Redis в процессе
+    REDIS_POOL_TIMEOUT: int = 1  # Сколько секунд ждать свободного соединения из пула
+    REDIS_SOCKET_TIMEOUT: float = 0.5  # Сколько секунд ждать ответа Redis
+    REDIS_CONNECT_TIMEOUT: float = 1.0  # Сколько секунд ждать подключения к Redis
+    REDIS_BREAKER_WINDOW: int = 20  # По скольким последним обращениям к Redis судить о его здоровье
+    REDIS_BREAKER_FAILURE_RATE: float = 0.5  # При какой доле ошибок и медленных ответов перестать ходить в Redis
+    REDIS_BREAKER_SLOW_CALL: float = 0.1  # Ответ дольше стольких секунд считается медленным
+    REDIS_BREAKER_OPEN_TIME: float = 5.0  # Сколько секунд не ходить в Redis, прежде чем попробовать снова
     REDIS_URL_KEY: str = "url_{}"  # Ключ, по которому короткая ссылка живёт в Redis
     REDIS_URL_TTL: int = 24 * 60 * 60  # Время, которое короткая ссылка живёт в Redis
+    REDIS_INVALIDATION_CHANNEL: str = "url_invalidation"  # Канал, через который процессы сбрасывают свои кеши
+    # Как часто (в секундах) слушатель инвалидаций проверяет PING-ом соединение, на котором нет сообщений
+    REDIS_PUBSUB_HEALTH_CHECK_INTERVAL: float = 5.0
+    REDIS_LOOKUP_LOCK_KEY: str = "url_lookup_{}"  # Блокировка, пока один из процессов ищет ссылку в БД
+    REDIS_LOOKUP_LOCK_TTL: int = 200  # Сколько миллисекунд держать блокировку поиска, 0 - не блокировать
+    REDIS_LOOKUP_POLL_INTERVAL: float = 0.01  # Как часто (в секундах) проверять, не нашёл ли ссылку другой процесс
+    REDIS_MISSING_URL_TTL: int = 60  # Сколько секунд помнить в Redis, что ссылки с таким кодом нет
+    REDIS_URL_HASH_KEY: str = "url_hash_{}"  # Обратное соответствие "хеш урла -> код" для создания без дублей
+    REDIS_IDEMPOTENCY_KEY: str = "idempotency_{}"  # Результат запроса создания с заголовком Idempotency-Key
+    REDIS_VISITORS_KEY: str = "visitors_{}_{:%Y%m%d%H}"  # HyperLogLog посетителей ссылки за час
+    REDIS_VISITORS_TTL: int = 25 * 60 * 60  # Сколько секунд хранить часовые HyperLogLog посетителей
+    REDIS_WRITTEN_KEY: str = "written_{}"  # Отметка, что ссылку недавно меняли и читать её нужно с основной БД
+
+    # Кеш ссылок в памяти процесса
+    LOCAL_CACHE_SIZE: int = 10_000  # Сколько ссылок держать в памяти
+    LOCAL_CACHE_TTL: int = 60  # Сколько секунд ссылка живёт в памяти, если не пришла инвалидация
+    LOCAL_MISSING_CACHE_SIZE: int = 10_000  # Сколько несуществующих кодов держать в памяти
+    LOCAL_MISSING_CACHE_TTL: int = 10  # Сколько секунд помнить в памяти, что ссылки с таким кодом нет
+
+    # Прогрев Redis
+    WARMUP_SOURCE: str = "clicks"  # Что прогревать: clicks - популярные за сутки ссылки, recent - последние созданные
+    WARMUP_LIMIT: int = 100_000  # Сколько ссылок прогревать
+    WARMUP_BATCH_SIZE: int = 1000  # Сколько ссылок писать в Redis одним пайплайном
+    WARMUP_RATE: int = 20_000  # Не больше стольких ссылок в секунду, чтобы не мешать живым запросам
+    WARMUP_CHECK_INTERVAL: int = 60  # Как часто (в секундах) проверять, не потерял ли Redis данные, 0 - не прогревать
+    REDIS_WARMUP_MARKER_KEY: str = "warmup_marker"  # Метка в Redis: пока она есть, прогревать не нужно
+
+    # Выгрузка
+    EXPORT_BATCH_SIZE: int = 1000  # Сколько строк читать из курсора и отправлять клиенту за раз
+
+    # Импорт
+    IMPORT_BATCH_SIZE: int = 20_000  # Сколько ссылок загружать одним COPY и переносить в urls одной транзакцией
+
+    # Фоновые задачи
+    REDIS_WRITE_QUEUE_SIZE: int = 10_000  # Сколько записей в Redis может ждать выполнения
+    REDIS_WRITE_CONCURRENCY: int = 8  # Сколько записей в Redis выполняется одновременно
+    REDIS_WRITE_OVERFLOW: str = "coalesce"  # Что делать при переполнении очереди: drop, coalesce или block
+    SHUTDOWN_TIMEOUT: float = 5.0  # Сколько секунд при остановке ждать выполнения фоновых задач
+
+    # Буфер переходов по ссылкам
+    CLICK_BUFFER_SIZE: int = 100_000  # Максимум переходов в памяти, всё что сверху - отбрасывается
+    CLICK_BATCH_SIZE: int = 1000  # Размер пачки, которой переходы пишутся в БД
+    CLICK_FLUSH_INTERVAL: float = 1.0  # Как часто (в секундах) сбрасывать буфер, даже если пачка не набралась
 
     # PostgreSQL
     DB_DRIVER: str = "postgresql+asyncpg"
@@ -29,10 +103,82 @@ class Settings(pydantic.BaseSettings):
     DB_MAX_OVERFLOW: int = 0
     DB_ECHO: bool = False
 
+    # Реплики БД только для чтения
+    # DSN реплик (в переменной окружения - JSON-список), пусто - всё читается с основной
+    DB_REPLICA_DSNS: List[str] = []
+    DB_REPLICA_CHECK_INTERVAL: float = 1.0  # Как часто (в секундах) проверять здоровье и отставание реплик
+    DB_REPLICA_CHECK_TIMEOUT: float = 1.0  # Сколько секунд ждать ответа реплики на проверку
+    DB_REPLICA_READ_TIMEOUT: float = 0.5  # Сколько секунд ждать чтения с реплики, прежде чем читать с основной БД
+    DB_REPLICA_MAX_LAG: float = 5.0  # С каким отставанием (в секундах) реплика ещё годится для чтения
+    # Сколько секунд после изменения ссылки читать её только с основной БД. Должно быть больше DB_REPLICA_MAX_LAG.
+    DB_READ_YOUR_WRITES_WINDOW: int = 10
+
+    # Запуск нескольких процессов
+    WEB_CONCURRENCY: int = 1  # Сколько процессов-воркеров на одном экземпляре (эту же переменную читает uvicorn)
+    APP_INSTANCES: int = 1  # Сколько экземпляров (хостов, контейнеров) приложения работает с одними БД и Redis
+    # Сколько соединений с БД могут открыть все воркеры всех экземпляров вместе, 0 - DB_POOL_SIZE на процесс.
+    # Из доли воркера DB_MAINTENANCE_POOL_SIZE соединений уходит на отдельный пул периодических заданий, остальное - запросам.
+    DB_CONNECTION_BUDGET: int = 0
+    # Пул выборов лидера и периодических заданий: одно соединение держит блокировку лидера, одно - текущее задание
+    DB_MAINTENANCE_POOL_SIZE: int = 2
+    REDIS_CONNECTION_BUDGET: int = 0  # То же для Redis, 0 - REDIS_MAX_CONNECTIONS на каждый клиент процесса
+    # Как часто (в секундах) лидер проверяет соединение с БД, а остальные - не пора ли им
+    LEADER_CHECK_INTERVAL: float = 5.0
+
+    # Чистка старых данных
+    CLEANUP_BATCH_SIZE: int = 5000  # Сколько строк удалять за одну транзакцию
+    CLEANUP_PAUSE: float = 0.1  # Пауза (в секундах) между пачками
+    STATS_PARTITIONS_AHEAD: int = 48  # На сколько часов вперёд создавать партиции url_stats
+    STATS_HOURLY_RETENTION: int = 30 * 24  # Сколько часов хранить почасовые счётчики переходов
+    STATS_MINUTELY_RETENTION: int = 24  # Сколько часов хранить поминутные счётчики переходов
+
+    # Статистика
+    STATS_MAX_POINTS: int = 1500  # Максимум точек в одном временном ряде
+    STATS_BATCH_MAX_CODES: int = 1000  # Сколько ссылок можно передать в одном запросе статистики
+    STATS_CACHE_SIZE: int = 10_000  # Сколько ответов статистики держать в памяти процесса
+    STATS_CACHE_TTL: int = 10  # Сколько секунд ответ статистики можно отдавать из кеша (и в Cache-Control)
+
     @property
     def DB_DSN(self) -> URL:
         return URL.create(self.DB_DRIVER, self.DB_USER, self.DB_PASSWORD, self.DB_HOST, self.DB_PORT, self.DB_DATABASE)
 
+    @pydantic.validator("REDIRECT_STATUS_CODE")
+    def check_redirect_status_code(cls, value: int) -> int:  # pylint: disable=no-self-argument
+        if value not in (301, 302, 307, 308):
+            raise ValueError("REDIRECT_STATUS_CODE должен быть одним из 301, 302, 307, 308")
+        return value
+
+    @pydantic.validator("SHORT_CODE_SECRET", always=True)
+    def check_short_code_secret(cls, value: str, values: Dict[str, Any]) -> str:  # pylint: disable=no-self-argument
+        if not value and values.get("SHORT_CODE_ALLOCATOR") == "sequence" and not values.get("DEBUG"):
+            raise ValueError("Для SHORT_CODE_ALLOCATOR=sequence нужно задать SHORT_CODE_SECRET")
+        return value
+
+    def worker_share(self, budget: int) -> int:
+        """
+        Доля budget на один воркер: бюджет делится поровну между WEB_CONCURRENCY воркерами всех APP_INSTANCES.
+        """
+        return max(1, budget // (self.WEB_CONCURRENCY * self.APP_INSTANCES))
+
+    @property
+    def DB_WORKER_POOL_SIZE(self) -> int:
+        if not self.DB_CONNECTION_BUDGET:
+            return self.DB_POOL_SIZE
+        return max(1, self.worker_share(self.DB_CONNECTION_BUDGET) - self.DB_MAINTENANCE_POOL_SIZE)
+
+    @property
+    def DB_WORKER_MAX_OVERFLOW(self) -> int:
+        # Соединения сверх пула вышли бы за бюджет
+        return 0 if self.DB_CONNECTION_BUDGET else self.DB_MAX_OVERFLOW
+
+    @property
+    def REDIS_WORKER_MAX_CONNECTIONS(self) -> int:
+        # В процессе два клиента Redis (с декодированием ответов и без), доля воркера делится между ними.
+        # Ещё одно соединение занимает подписка на инвалидации (см. make_pubsub_redis).
+        if not self.REDIS_CONNECTION_BUDGET:
+            return self.REDIS_MAX_CONNECTIONS
+        return max(1, (self.worker_share(self.REDIS_CONNECTION_BUDGET) - 1) // 2)
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
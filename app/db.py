@@ -1,27 +1,198 @@
-from typing import Any, Optional, Type, TypeVar
+import abc
+import asyncio
+import logging
+import time
+import zlib
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, AsyncIterator, Awaitable, Callable, Coroutine, List, Optional, Sequence, Type, TypeVar
 
 import sqlalchemy as sa
 from sqlalchemy import MetaData
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import declarative_base, DeclarativeMeta, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
+from app import metrics
 from app.config import settings
 
 
+logger = logging.getLogger(__name__)
+TResult = TypeVar("TResult")
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Пул соединений, который записывает в метрики, сколько пришлось ждать свободного соединения.
+    """
+
+    def _do_get(self):
+        with metrics.db_pool_wait.time():
+            return super()._do_get()
+
+
 engine = create_async_engine(
     settings.DB_DSN,
     echo=settings.DB_ECHO,
-    pool_size=settings.DB_POOL_SIZE,
-    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_size=settings.DB_WORKER_POOL_SIZE,
+    max_overflow=settings.DB_WORKER_MAX_OVERFLOW,
+    poolclass=TimedQueuePool,
     future=True,
 )
+pool = engine.sync_engine.pool
+metrics.db_pool_connections.labels("checked_out").set_function(pool.checkedout)
+metrics.db_pool_connections.labels("idle").set_function(pool.checkedin)
+# До заполнения основного пула overflow() отрицательный
+metrics.db_pool_connections.labels("overflow").set_function(lambda: max(pool.overflow(), 0))
 async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession, future=True, autoflush=False)
+# Периодические задания лидера берут соединения из своего маленького пула, чтобы не отнимать их у запросов
+maintenance_engine = create_async_engine(
+    settings.DB_DSN,
+    echo=settings.DB_ECHO,
+    pool_size=settings.DB_MAINTENANCE_POOL_SIZE,
+    max_overflow=0,
+    future=True,
+)
+
+# Отставание реплики в секундах. Если всё полученное уже применено, реплика не отстаёт, даже когда
+# в основную БД давно ничего не писали. Не реплика (например, повышенная до основной) не отстаёт никогда.
+replica_lag_query = sa.text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class ReplicaSet:
+    """
+    Реплики БД только для чтения. Годными для чтения считаются реплики, которые
+    ответили на последнюю проверку (см. monitor) и отстают от основной БД не больше
+    DB_REPLICA_MAX_LAG. До первой проверки годных нет, и всё читается с основной БД.
+    Пулы реплик того же размера, что и у основной БД: бюджет соединений задаётся на сервер.
+    """
+
+    def __init__(self, dsns: Sequence[str]) -> None:
+        self.engines = [
+            create_async_engine(
+                dsn,
+                echo=settings.DB_ECHO,
+                pool_size=settings.DB_WORKER_POOL_SIZE,
+                max_overflow=settings.DB_WORKER_MAX_OVERFLOW,
+                future=True,
+            )
+            for dsn in dsns
+        ]
+        self.healthy: List[AsyncEngine] = []
+        self._next = 0
+        for replica in self.engines:
+            metrics.db_replica_healthy.labels(self.name(replica)).set_function(partial(self.is_healthy, replica))
+        self._replica_reads = metrics.db_reads.labels("replica")
+        self._primary_reads = metrics.db_reads.labels("primary")
+        self._failovers = metrics.db_reads.labels("failover")
+
+    @staticmethod
+    def name(replica: AsyncEngine) -> str:
+        return f"{replica.url.host}:{replica.url.port or 5432}"
+
+    def is_healthy(self, replica: AsyncEngine) -> bool:
+        return replica in self.healthy
+
+    def pick(self) -> Optional[AsyncEngine]:
+        """
+        Следующая по кругу годная реплика или None, если годных нет.
+        """
+        if not self.healthy:
+            return None
+        self._next = (self._next + 1) % len(self.healthy)
+        return self.healthy[self._next]
+
+    def mark_unhealthy(self, replica: AsyncEngine) -> None:
+        """
+        Не читать с replica до следующей успешной проверки.
+        """
+        if replica in self.healthy:
+            self.healthy.remove(replica)
+            logger.warning("Replica %s is unavailable, reading from the primary", self.name(replica))
+
+    async def lag(self, replica: AsyncEngine) -> Optional[float]:
+        """
+        Отставание replica в секундах или None, если она не ответила за DB_REPLICA_CHECK_TIMEOUT.
+        """
+        try:
+            async with replica.connect() as connection:
+                return await asyncio.wait_for(connection.scalar(replica_lag_query), settings.DB_REPLICA_CHECK_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, sa.exc.SQLAlchemyError):
+            logger.warning("Health check of replica %s failed", self.name(replica), exc_info=True)
+            return None
+
+    async def check(self) -> None:
+        lags = await asyncio.gather(*(self.lag(replica) for replica in self.engines))
+        self.healthy = [
+            replica
+            for replica, lag in zip(self.engines, lags)
+            if lag is not None and lag <= settings.DB_REPLICA_MAX_LAG
+        ]
+
+    async def monitor(self) -> None:
+        """
+        Раз в DB_REPLICA_CHECK_INTERVAL проверяет все реплики.
+        """
+        while True:
+            await self.check()
+            await asyncio.sleep(settings.DB_REPLICA_CHECK_INTERVAL)
+
+    def session(self) -> Optional[AsyncSession]:
+        """
+        Новая сессия на годной реплике или None, если годных нет. Закрывает её вызывающий.
+        """
+        replica = self.pick()
+        if replica is None:
+            self._primary_reads.inc()
+            return None
+        self._replica_reads.inc()
+        return AsyncSession(bind=replica, expire_on_commit=False, future=True, autoflush=False)
+
+    async def read(
+        self, query: Callable[[AsyncSession], Awaitable[TResult]], fallback: Callable[[], Awaitable[TResult]]
+    ) -> TResult:
+        """
+        Выполняет query на годной реплике. Если годных нет или реплика не ответила
+        за DB_REPLICA_READ_TIMEOUT, вызывает fallback, который выполняет то же самое на основной БД.
+        """
+        replica = self.pick()
+        if replica is not None:
+            try:
+                result = await asyncio.wait_for(self._read(replica, query), settings.DB_REPLICA_READ_TIMEOUT)
+            except (OSError, asyncio.TimeoutError, sa.exc.DBAPIError):
+                # Заодно это зависшая реплика или отставшая, которая отменила запрос из-за конфликта с восстановлением
+                logger.exception("Error while reading from replica %s", self.name(replica))
+                self.mark_unhealthy(replica)
+                self._failovers.inc()
+            else:
+                self._replica_reads.inc()
+                return result
+        self._primary_reads.inc()
+        return await fallback()
+
+    @staticmethod
+    async def _read(replica: AsyncEngine, query: Callable[[AsyncSession], Awaitable[TResult]]) -> TResult:
+        async with AsyncSession(bind=replica, expire_on_commit=False, future=True, autoflush=False) as session:
+            return await query(session)
+
+
+replicas = ReplicaSet(settings.DB_REPLICA_DSNS)
 
 TBase = TypeVar("TBase", bound="EmptyBaseModel")
 metadata = MetaData()
 Base = declarative_base(metadata=metadata)
 
 
+class AbstractModelMeta(DeclarativeMeta, abc.ABCMeta):
+    """
+    Метакласс абстрактных моделей с abc.abstractmethod: модель, в которой их не
+    переопределили, нельзя создать, как и любой наследник abc.ABC.
+    """
+
+
 class EmptyBaseModel(Base):  # type: ignore
     """
     Абстрактная базовая модель для наследования SQLAlchemy моделей.
@@ -49,3 +220,111 @@ class EmptyBaseModel(Base):  # type: ignore
         """
         query = sa.delete(cls).where(cls.id == object_id)
         await session.execute(query)
+
+
+def advisory_lock_key(name: str) -> sa.sql.expression.BindParameter:
+    """
+    Ключ advisory-блокировки name.
+    """
+    return sa.literal(zlib.crc32(name.encode()), sa.BigInteger)
+
+
+@asynccontextmanager
+async def advisory_lock(name: str) -> AsyncIterator[Optional[AsyncConnection]]:
+    """
+    Берёт advisory-блокировку name на отдельном соединении и отдаёт это соединение,
+    либо None, если блокировку уже держит кто-то другой (например, другой экземпляр
+    приложения). Блокировка живёт дольше транзакций, так что внутри можно коммитить.
+    Соединение берётся из пула периодических заданий maintenance_engine.
+    """
+    async with maintenance_engine.connect() as connection:
+        lock_key = advisory_lock_key(name)
+        if not await connection.scalar(sa.select(sa.func.pg_try_advisory_lock(lock_key))):
+            yield None
+            return
+        await connection.commit()
+
+        try:
+            yield connection
+        finally:
+            await connection.rollback()  # Если внутри была ошибка, транзакция не даст снять блокировку
+            await connection.scalar(sa.select(sa.func.pg_advisory_unlock(lock_key)))
+            await connection.commit()
+
+
+class LeaderElection:
+    """
+    Выбирает среди всех процессов всех экземпляров приложения одного лидера - того,
+    кто держит advisory-блокировку name, - и только в нём выполняет jobs (обычно
+    бесконечные периодические задания). Остальные раз в check_interval пробуют
+    блокировку занять. Блокировка живёт, пока живо соединение лидера, так что если
+    лидер упал или потерял связь с БД, PostgreSQL снимет её сам и лидером станет
+    кто-то другой. Лидер в свою очередь раз в check_interval проверяет соединение
+    и, если оно оборвалось, останавливает задания, чтобы они не выполнялись в двух местах.
+    """
+
+    def __init__(
+        self, name: str, jobs: Sequence[Callable[[], Coroutine[Any, Any, Any]]], check_interval: float
+    ) -> None:
+        self.name = name
+        self.jobs = jobs
+        self.check_interval = check_interval
+        self.is_leader = False
+        metrics.leader.labels(name).set_function(lambda: int(self.is_leader))
+
+    async def run(self) -> None:
+        while True:
+            try:
+                async with advisory_lock(self.name) as connection:
+                    if connection is not None:
+                        await self._lead(connection)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Leader election %s failed", self.name)
+            await asyncio.sleep(self.check_interval)
+
+    async def _lead(self, connection: AsyncConnection) -> None:
+        logger.info("This process is now the leader of %s", self.name)
+        self.is_leader = True
+        tasks = [asyncio.create_task(job()) for job in self.jobs]
+        try:
+            while True:
+                await asyncio.sleep(self.check_interval)
+                await connection.scalar(sa.select(1))
+                await connection.commit()
+        finally:
+            self.is_leader = False
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info("This process is no longer the leader of %s", self.name)
+
+
+async def delete_in_batches(name: str, delete_batch: Callable[[AsyncSession, int], Awaitable[int]]) -> int:
+    """
+    Вызывает delete_batch(session, CLEANUP_BATCH_SIZE) до тех пор, пока тот удаляет полные пачки,
+    и возвращает количество удалённых строк. Каждая пачка удаляется в своей транзакции на своём
+    соединении из maintenance_engine, а между пачками делается пауза CLEANUP_PAUSE, во время
+    которой соединение возвращается в пул, чтобы не держать ни блокировки, ни соединение.
+    Пачку задачи name удаляет только один экземпляр приложения: транзакция берёт advisory-блокировку,
+    и если её держит другой экземпляр, запуск пропускается.
+    """
+    started = time.monotonic()
+    deleted = 0
+    lock_key = advisory_lock_key(name)
+
+    while True:
+        async with AsyncSession(
+            bind=maintenance_engine, expire_on_commit=False, future=True, autoflush=False
+        ) as session:
+            if not await session.scalar(sa.select(sa.func.pg_try_advisory_xact_lock(lock_key))):
+                logger.info("Cleanup %s is already running in another instance, skipping", name)
+                break
+            batch_deleted = await delete_batch(session, settings.CLEANUP_BATCH_SIZE)
+            await session.commit()
+        deleted += batch_deleted
+        if batch_deleted < settings.CLEANUP_BATCH_SIZE:
+            break
+        await asyncio.sleep(settings.CLEANUP_PAUSE)
+
+    logger.info("Cleanup %s deleted %s rows in %.2fs", name, deleted, time.monotonic() - started)
+    return deleted
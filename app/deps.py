@@ -1,8 +1,10 @@
-import aioredis
+from typing import AsyncContextManager, Callable
+
 from aioredis import Redis
+from sqlalchemy.ext.asyncio import AsyncConnection
 
-from app.config import settings
-from app.db import async_session
+from app.db import async_session, engine
+from app.redis_client import AutoPipeline, make_circuit_breaker, make_pubsub_redis, make_redis
 
 
 async def get_db():
@@ -13,4 +15,21 @@ async def get_db():
         await db.close()
 
 
-redis: Redis = aioredis.from_url(settings.REDIS_URI, encoding="utf-8", decode_responses=True)
+async def get_db_connect() -> Callable[[], AsyncContextManager[AsyncConnection]]:
+    """
+    В отличие от get_db ничего не создаёт заранее, а отдаёт функцию, которая берёт
+    соединение из пула. Для путей, которым БД нужна не всегда (например, редирект
+    при промахе кешей), так не приходится на каждый запрос создавать и закрывать сессию.
+    """
+    return engine.connect
+
+
+redis: Redis = make_redis()
+# Общий для всех клиентов: пока Redis болеет, обращения к нему сразу получают CircuitOpenError.
+redis_breaker = make_circuit_breaker()
+redis_batch = AutoPipeline(redis, redis_breaker)
+# Без декодирования ответов, для поиска ссылки при редиректе.
+redis_raw: Redis = make_redis(decode_responses=False)
+redis_raw_batch = AutoPipeline(redis_raw, redis_breaker)
+# Для подписки на инвалидации кешей: одно соединение на процесс, без таймаута чтения.
+redis_pubsub: Redis = make_pubsub_redis()
@@ -18,6 +18,26 @@ class ResourceNotFoundError(Exception):
     """HTTP 404"""
 
 
+class ShortCodeAllocationError(Exception):
+    """HTTP 503"""
+
+
+class InvalidCursorError(Exception):
+    """HTTP 422"""
+
+
+class InvalidStatsWindowError(Exception):
+    """HTTP 422"""
+
+
+class IdempotencyKeyInProgressError(Exception):
+    """HTTP 409"""
+
+
+class IdempotencyKeyReusedError(Exception):
+    """HTTP 422"""
+
+
 class ErrorResponse(BaseModel):
     """
     Стандартный формат ответа в случае возникновения ошибки.
@@ -65,6 +85,11 @@ def setup_exceptions(application: FastAPI) -> None:
         (StarletteHTTPException, default_error_handler_creator(status.HTTP_422_UNPROCESSABLE_ENTITY)),
         (RedisError, default_error_handler_creator(status.HTTP_502_BAD_GATEWAY)),
         (ResourceNotFoundError, default_error_handler_creator(status.HTTP_404_NOT_FOUND)),
+        (ShortCodeAllocationError, default_error_handler_creator(status.HTTP_503_SERVICE_UNAVAILABLE)),
+        (InvalidCursorError, default_error_handler_creator(status.HTTP_422_UNPROCESSABLE_ENTITY)),
+        (InvalidStatsWindowError, default_error_handler_creator(status.HTTP_422_UNPROCESSABLE_ENTITY)),
+        (IdempotencyKeyInProgressError, default_error_handler_creator(status.HTTP_409_CONFLICT)),
+        (IdempotencyKeyReusedError, default_error_handler_creator(status.HTTP_422_UNPROCESSABLE_ENTITY)),
     ]
 
     for err, handler in exc_pairs:
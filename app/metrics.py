@@ -0,0 +1,242 @@
+"""
+Метрики в текстовом формате Prometheus. Своя реализация вместо prometheus_client,
+потому что там каждое изменение значения берёт threading.Lock, а у нас всё
+выполняется в одном event loop и блокировки не нужны.
+
+Чтобы не создавать словари и кортежи меток на каждый запрос, значения с метками
+получают через labels() один раз (обычно при импорте модуля), а на горячем пути
+вызывают только inc()/observe().
+"""
+import abc
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Generic, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+TValue = TypeVar("TValue", "Value", "HistogramValue")
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Value:
+    """
+    Значение счётчика или gauge. Если задана function, значение вычисляется ею в момент сбора метрик.
+    """
+
+    __slots__ = ("value", "function")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class HistogramValue:
+    """
+    Гистограмма: счётчики по корзинам (не накопительные, складываются при выводе), сумма и количество.
+    """
+
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Последняя корзина - +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def time(self) -> "Timer":
+        return Timer(self)
+
+
+class Timer:
+    """
+    Контекстный менеджер, который записывает в гистограмму время выполнения блока в секундах.
+    """
+
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: HistogramValue) -> None:
+        self.histogram = histogram
+        self.started = 0.0
+
+    def __enter__(self) -> None:
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+registry: List["Metric"] = []
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(abc.ABC, Generic[TValue]):
+    """
+    Метрика с именем name и значениями для каждого набора меток labelnames.
+    """
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], TValue] = {}
+        registry.append(self)
+
+    @abc.abstractmethod
+    def _new_value(self) -> TValue:
+        ...
+
+    def labels(self, *labelvalues: str) -> TValue:
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labelvalues}")
+        value = self._values.get(labelvalues)
+        if value is None:
+            value = self._values[labelvalues] = self._new_value()
+        return value
+
+    @abc.abstractmethod
+    def samples(self, labelvalues: Tuple[str, ...], value: TValue) -> Iterator[str]:
+        ...
+
+    def collect(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type}"
+        for labelvalues, value in list(self._values.items()):
+            yield from self.samples(labelvalues, value)
+
+
+class Counter(Metric[Value]):
+    type = "counter"
+
+    def _new_value(self) -> Value:
+        return Value()
+
+    def samples(self, labelvalues: Tuple[str, ...], value: Value) -> Iterator[str]:
+        yield f"{self.name}{format_labels(self.labelnames, labelvalues)} {value.get()}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+
+class Histogram(Metric[HistogramValue]):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_value(self) -> HistogramValue:
+        return HistogramValue(self.buckets)
+
+    def samples(self, labelvalues: Tuple[str, ...], value: HistogramValue) -> Iterator[str]:
+        total = 0
+        for bound, count in zip((*self.buckets, "+Inf"), value.counts):
+            total += count
+            le = f'le="{bound}"'
+            yield f"{self.name}_bucket{format_labels(self.labelnames, labelvalues, le)} {total}"
+        yield f"{self.name}_sum{format_labels(self.labelnames, labelvalues)} {value.sum}"
+        yield f"{self.name}_count{format_labels(self.labelnames, labelvalues)} {total}"
+
+
+def render() -> str:
+    """
+    Все зарегистрированные метрики в текстовом формате Prometheus.
+    """
+    return "\n".join(line for metric in registry for line in metric.collect()) + "\n"
+
+
+# Метрики приложения. Значения собираются в тех модулях, где происходят события.
+request_duration = Histogram("short_request_duration_seconds", "Время обработки HTTP-запроса", ["route"])
+redirect_lookups = Counter(
+    "short_redirect_lookups_total", "Поиск ссылки при редиректе по источнику и результату", ["source", "result"]
+)
+db_pool_connections = Gauge("short_db_pool_connections", "Соединения в пуле БД по состоянию", ["state"])
+db_pool_wait = Histogram("short_db_pool_wait_seconds", "Ожидание соединения из пула БД").labels()
+db_replica_healthy = Gauge("short_db_replica_healthy", "1, если реплика годится для чтения", ["replica"])
+db_reads = Counter("short_db_reads_total", "Чтения, которые можно делать с реплик, по тому, куда они ушли", ["target"])
+click_buffer_clicks = Gauge(
+    "short_click_buffer_clicks", "Переходы в буфере (pending) и всего записанные и отброшенные", ["state"]
+)
+redis_circuit_state = Gauge(
+    "short_redis_circuit_state", "Состояние цепи Redis: 0 - замкнута, 1 - разомкнута, 2 - пробное обращение"
+)
+redis_circuit_trips = Counter("short_redis_circuit_trips_total", "Сколько раз цепь Redis размыкалась")
+job_queue_size = Gauge("short_job_queue_size", "Фоновые задачи, ожидающие в очереди", ["queue"])
+job_queue_in_progress = Gauge("short_job_queue_in_progress", "Фоновые задачи, которые выполняются сейчас", ["queue"])
+job_queue_jobs = Counter("short_job_queue_jobs_total", "Фоновые задачи по результату", ["queue", "result"])
+local_cache_requests = Counter(
+    "short_local_cache_requests_total", "Обращения к кешам в памяти процесса по результату", ["cache", "result"]
+)
+local_cache_evictions = Counter(
+    "short_local_cache_evictions_total", "Записи, вытесненные из кешей в памяти процесса из-за переполнения", ["cache"]
+)
+local_cache_size = Gauge("short_local_cache_size", "Записи в кешах в памяти процесса", ["cache"])
+code_allocation_retries = Counter(
+    "short_code_allocation_retries_total", "Повторные попытки вставить ссылку из-за занятого кода"
+).labels()
+periodic_job_duration = Histogram(
+    "short_periodic_job_duration_seconds",
+    "Время выполнения периодических заданий",
+    ["job"],
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0),
+)
+periodic_job_failures = Counter("short_periodic_job_failures_total", "Упавшие запуски периодических заданий", ["job"])
+leader = Gauge("short_leader", "1, если этот процесс - лидер и выполняет периодические задания", ["election"])
+
+
+class MetricsMiddleware:
+    """
+    Записывает время обработки запросов в request_duration с меткой route - именем
+    функции-обработчика, которое роутер кладёт в scope. Значение гистограммы для
+    каждого обработчика запоминается, так что на запрос ничего не создаётся.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._routes: Dict[Any, HistogramValue] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            endpoint = scope.get("endpoint")
+            histogram = self._routes.get(endpoint)
+            if histogram is None:
+                route = getattr(endpoint, "__name__", "unmatched")
+                histogram = self._routes[endpoint] = request_duration.labels(route)
+            histogram.observe(time.perf_counter() - started)
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, List, Optional, Set, Tuple, TypeVar
+
+import aioredis
+from aioredis import Redis, RedisError
+
+from app import metrics
+from app.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def make_redis(decode_responses: bool = True) -> Redis:
+    """
+    Клиент Redis с ограниченным пулом соединений: когда все заняты, команда ждёт
+    освободившееся соединение не дольше REDIS_POOL_TIMEOUT, а не открывает новое.
+    С decode_responses=False ответы приходят байтами без декодирования.
+    """
+    pool = aioredis.BlockingConnectionPool.from_url(
+        settings.REDIS_URI,
+        max_connections=settings.REDIS_WORKER_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+        encoding="utf-8",
+        decode_responses=decode_responses,
+    )
+    return Redis(connection_pool=pool)
+
+
+def make_pubsub_redis() -> Redis:
+    """
+    Клиент Redis для подписок. В отличие от make_redis, без socket_timeout: в тихом канале
+    сообщений может не быть сколько угодно, и это не ошибка. Разорванное соединение
+    обнаруживается PING-ом раз в REDIS_PUBSUB_HEALTH_CHECK_INTERVAL и TCP keepalive.
+    """
+    return aioredis.from_url(
+        settings.REDIS_URI,
+        socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=settings.REDIS_PUBSUB_HEALTH_CHECK_INTERVAL,
+        encoding="utf-8",
+        decode_responses=True,
+    )
+
+
+TResult = TypeVar("TResult")
+Command = Tuple[Tuple[Any, ...], "asyncio.Future[Any]"]
+
+CIRCUIT_CLOSED = 0
+CIRCUIT_OPEN = 1
+CIRCUIT_HALF_OPEN = 2
+
+
+class CircuitOpenError(RedisError):
+    """
+    Redis сейчас считается недоступным, и запрос в него даже не отправлялся.
+    """
+
+
+class CircuitBreaker:
+    """
+    Следит за последними window обращениями к Redis. Если среди них доля ошибок
+    и ответов дольше slow_call секунд достигла failure_rate, цепь размыкается:
+    open_time секунд обращения сразу получают CircuitOpenError, не дожидаясь таймаутов.
+    Потом пропускается одно пробное обращение: если оно успешно, цепь снова замыкается.
+    """
+
+    def __init__(self, window: int, failure_rate: float, slow_call: float, open_time: float) -> None:
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.open_time = open_time
+
+        self.state = CIRCUIT_CLOSED
+        self._results: Deque[bool] = deque(maxlen=window)  # True - неудачное обращение
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trips = metrics.redis_circuit_trips.labels()
+        metrics.redis_circuit_state.labels().set_function(lambda: self.state)
+
+    def allow(self) -> bool:
+        """
+        Можно ли сейчас обращаться к Redis. В полуоткрытом состоянии разрешает только одно пробное обращение.
+        """
+        if self.state == CIRCUIT_CLOSED:
+            return True
+        now = time.monotonic()
+        if now - self._opened_at < self.open_time:
+            return False
+        # Если результат пробы так и не пришёл (например, её отменили), через open_time пропустим следующую.
+        self.state = CIRCUIT_HALF_OPEN
+        self._opened_at = now
+        return True
+
+    def record(self, duration: float, failed: bool) -> None:
+        failed = failed or duration > self.slow_call
+        if self.state == CIRCUIT_OPEN:
+            return  # Обращения, начатые до размыкания
+        if self.state == CIRCUIT_HALF_OPEN:
+            if failed:
+                self._open()
+            else:
+                self.state = CIRCUIT_CLOSED
+                logger.warning("Redis circuit closed")
+            return
+
+        if len(self._results) == self._results.maxlen:
+            self._failures -= self._results[0]
+        self._results.append(failed)
+        self._failures += failed
+        if self.state == CIRCUIT_CLOSED and len(self._results) == self._results.maxlen:
+            if self._failures >= self.failure_rate * len(self._results):
+                self._open()
+
+    def _open(self) -> None:
+        self.state = CIRCUIT_OPEN
+        self._opened_at = time.monotonic()
+        self._results.clear()
+        self._failures = 0
+        self._trips.inc()
+        logger.warning("Redis circuit opened for %ss", self.open_time)
+
+    async def call(self, function: Callable[..., Awaitable[TResult]], *args: Any, **kwargs: Any) -> TResult:
+        """
+        Вызывает function, если цепь замкнута, и учитывает результат.
+        """
+        if not self.allow():
+            raise CircuitOpenError("Redis circuit is open")
+        started = time.perf_counter()
+        try:
+            result = await function(*args, **kwargs)
+        except RedisError as e:
+            self.record(time.perf_counter() - started, failed=is_outage(e))
+            raise
+        self.record(time.perf_counter() - started, failed=False)
+        return result
+
+
+def is_outage(error: BaseException) -> bool:
+    """
+    Говорит ли ошибка о проблемах с самим Redis, а не с конкретной командой (например, неверный тип ключа).
+    """
+    return isinstance(error, (aioredis.ConnectionError, aioredis.TimeoutError, OSError))
+
+
+def make_circuit_breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        window=settings.REDIS_BREAKER_WINDOW,
+        failure_rate=settings.REDIS_BREAKER_FAILURE_RATE,
+        slow_call=settings.REDIS_BREAKER_SLOW_CALL,
+        open_time=settings.REDIS_BREAKER_OPEN_TIME,
+    )
+
+
+class AutoPipeline:
+    """
+    Команды, отправленные через этот объект в одном такте event loop, уходят в Redis
+    одним пайплайном (без транзакции), а каждый вызывающий получает свой ответ или
+    свою ошибку. Так всплеск одновременных запросов превращается в несколько
+    round trip вместо сотен. Одиночная команда отправляется без пайплайна.
+    Если передан breaker, пайплайн - одно обращение для него, а при разомкнутой
+    цепи команды сразу завершаются с CircuitOpenError.
+    """
+
+    def __init__(self, client: Redis, breaker: Optional[CircuitBreaker] = None) -> None:
+        self.client = client
+        self.breaker = breaker
+        self.batches = 0
+        self.commands = 0
+        self._pending: List[Command] = []
+        self._sending: Set[asyncio.Task] = set()
+
+    def execute_command(self, *args: Any) -> "asyncio.Future[Any]":
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not self._pending and self.breaker is not None and not self.breaker.allow():
+            future.set_exception(CircuitOpenError("Redis circuit is open"))
+            return future
+        if not self._pending:
+            loop.call_soon(self._flush)
+        self._pending.append((args, future))
+        return future
+
+    def get(self, key: str) -> "asyncio.Future[Any]":
+        return self.execute_command("GET", key)
+
+    def set(
+        self, key: str, value: Any, ex: Optional[int] = None, px: Optional[int] = None, nx: bool = False
+    ) -> "asyncio.Future[Any]":
+        args: List[Any] = ["SET", key, value]
+        if ex is not None:
+            args += ["EX", ex]
+        if px is not None:
+            args += ["PX", px]
+        if nx:
+            args.append("NX")
+        return self.execute_command(*args)
+
+    def delete(self, *keys: str) -> "asyncio.Future[Any]":
+        return self.execute_command("DEL", *keys)
+
+    def _flush(self) -> None:
+        commands, self._pending = self._pending, []
+        task = asyncio.create_task(self._send(commands))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, commands: List[Command]) -> None:
+        self.batches += 1
+        self.commands += len(commands)
+        started = time.perf_counter()
+        try:
+            if len(commands) == 1:
+                results = [await self.client.execute_command(*commands[0][0])]
+            else:
+                async with self.client.pipeline(transaction=False) as pipe:
+                    for args, _ in commands:
+                        pipe.execute_command(*args)
+                    results = await pipe.execute(raise_on_error=False)
+        except asyncio.CancelledError:
+            for _, future in commands:
+                future.cancel()
+            raise
+        except Exception as e:  # pylint: disable=broad-except
+            results = [e] * len(commands)
+
+        if self.breaker is not None:
+            failed = any(isinstance(result, Exception) and is_outage(result) for result in results)
+            self.breaker.record(time.perf_counter() - started, failed)
+
+        for (_, future), result in zip(commands, results):
+            if future.done():  # Вызывающий уже отменил ожидание
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,18 @@
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+class NDJSONResponse(StreamingResponse):
+    """
+    Потоковый ответ в формате NDJSON (один JSON-объект на строку).
+    В отличие от StreamingResponse не слушает разрыв соединения: тогда listen_for_disconnect
+    съедал бы сообщения receive, а генератор ответа может в это время дочитывать тело запроса.
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+
+        if self.background is not None:
+            await self.background()
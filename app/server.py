@@ -1,18 +1,35 @@
 import asyncio
+import logging
+import os
+from functools import partial
+from typing import Any, Callable, Coroutine, List
 
 from fastapi import FastAPI
 
 from app.api.base import router as base_router
 from app.apps.urls import models
-from app.apps.urls.api.urls import router as urls_router
+from app.apps.urls.api.export import router as export_router
+from app.apps.urls.api.imports import router as import_router
+from app.apps.urls.api.urls import RedirectFastPath, router as urls_router
+from app.apps.urls.cache import listen_invalidations, redis_writes
+from app.apps.urls.clicks import click_buffer
+from app.apps.urls.warmup import warm_up_if_flushed
 from app.config import settings
+from app.db import LeaderElection, replicas
 from app.exceptions import setup_exceptions
 from app.logging import configure_logging
+from app.metrics import MetricsMiddleware
+from app.tasks import stop_job_queues
 from app.utils import do_stuff_periodically
 
 
+logger = logging.getLogger(__name__)
+
+
 def setup_routers(application: FastAPI) -> None:
     application.include_router(urls_router, prefix="/urls", tags=["urls"])
+    application.include_router(export_router, prefix="/export", tags=["export"])
+    application.include_router(import_router, prefix="/import", tags=["import"])
     application.include_router(base_router, tags=["probe"])
 
 
@@ -26,18 +43,77 @@ def get_app(app_name: str) -> FastAPI:
     configure_logging()
     setup_exceptions(application)
     setup_routers(application)
+    # Внутри MetricsMiddleware, чтобы готовые редиректы тоже попадали в метрики
+    application.add_middleware(RedirectFastPath, prefix="/urls")
+    application.add_middleware(MetricsMiddleware)
     return application
 
 
 app = get_app(app_name=settings.SERVICE_NAME)
+background_tasks: List[asyncio.Task] = []  # Задачи, которые живут всё время работы приложения
 
 
 @app.on_event("startup")
 async def on_startup() -> None:
     """Выполняется при старте приложения."""
+    click_buffer.start()
+    redis_writes.start()
+    background_tasks.append(asyncio.create_task(listen_invalidations()))
+    if replicas.engines:
+        # Здоровье реплик каждый процесс проверяет сам: так он раньше всех замечает, что реплика не отвечает.
+        background_tasks.append(asyncio.create_task(replicas.monitor()))
+    # Периодические задания выполняет только один процесс на все воркеры и экземпляры приложения.
+    leader = LeaderElection("periodic_jobs", periodic_jobs(), settings.LEADER_CHECK_INTERVAL)
+    background_tasks.append(asyncio.create_task(leader.run()))
+    logger.info(
+        "Worker %s started: DB pool %s+%s, Redis pools %s",
+        os.getpid(),
+        settings.DB_WORKER_POOL_SIZE,
+        settings.DB_WORKER_MAX_OVERFLOW,
+        settings.REDIS_WORKER_MAX_CONNECTIONS,
+    )
+
+
+def periodic_jobs() -> List[Callable[[], Coroutine[Any, Any, Any]]]:
+    """
+    Задания, которые выполняет лидер. Они ждут общий lock и выполняются по очереди,
+    так что маленького пула maintenance_engine им хватает.
+    """
+    lock = asyncio.Lock()
+    # Партиции для статистики нужны всегда, иначе переходам будет некуда записываться. Старые партиции
+    # удаляются в том же задании, после создания новых, а в DEBUG - не удаляются, как и всё остальное.
+    jobs: List[Callable[[], Coroutine[Any, Any, Any]]] = [
+        partial(
+            do_stuff_periodically,
+            1 * 60 * 60,
+            models.UrlStats.maintain_partitions,
+            drop_old=not settings.DEBUG,
+            lock=lock,
+        )
+    ]
+    if settings.WARMUP_CHECK_INTERVAL:
+        # Прогреем Redis сразу при старте, если он пустой, и потом после каждой потери его данных.
+        jobs.append(partial(do_stuff_periodically, settings.WARMUP_CHECK_INTERVAL, warm_up_if_flushed, lock=lock))
+
     if not settings.DEBUG:
         # Запустим чистку таблиц от старых данных.
-        # Для URL это данные старше, чем SHORT_URL_TTL, а для статистики - старше 24 часов, которые мы отдаём.
-        # Если instance приложения будет не один, то лучше перенести такие задачи в cron / celerybeat и т.п.
-        asyncio.create_task(do_stuff_periodically(1 * 60 * 60, models.Url.clean_old))
-        asyncio.create_task(do_stuff_periodically(1 * 60 * 60, models.UrlStats.clean_old))
+        # Для URL это данные старше, чем SHORT_URL_TTL, для сырой статистики - старше 24 часов, которые мы отдаём,
+        # а для счётчиков переходов - старше их срока хранения (STATS_HOURLY_RETENTION, STATS_MINUTELY_RETENTION).
+        # Удаление идёт пачками и дополнительно защищено своей блокировкой в БД на случай двух лидеров разных версий.
+        jobs.append(partial(do_stuff_periodically, 1 * 60 * 60, models.Url.clean_old, lock=lock))
+        jobs.append(partial(do_stuff_periodically, 1 * 60 * 60, models.UrlStatsHourly.clean_old, lock=lock))
+        jobs.append(partial(do_stuff_periodically, 10 * 60, models.UrlStatsMinutely.clean_old, lock=lock))
+    return jobs
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    """Выполняется при остановке приложения."""
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+
+    # Доделаем фоновые задачи и допишем в БД переходы, которые ещё не успели сброситься из буфера.
+    await stop_job_queues(settings.SHUTDOWN_TIMEOUT)
+    await click_buffer.stop(settings.SHUTDOWN_TIMEOUT)
@@ -0,0 +1,153 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, List, Optional
+
+from app import metrics
+
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_DROP = "drop"  # Новая задача отбрасывается
+OVERFLOW_COALESCE = "coalesce"  # Задача с тем же ключом заменяет ожидающую, при переполнении - отбрасывается
+OVERFLOW_BLOCK = "block"  # submit ждёт, пока в очереди освободится место
+
+Job = Callable[[], Awaitable[Any]]
+
+
+class JobQueue:
+    """
+    Очередь фоновых задач одного типа, которые запрос не ждёт (например, записи в Redis).
+    Размер очереди ограничен max_size, задачи выполняют concurrency воркеров,
+    а что делать при переполнении, определяет overflow. Воркеры запускаются при
+    первой задаче или в start(), а stop() дожидается выполнения очереди, но не дольше
+    заданного времени.
+    """
+
+    def __init__(self, name: str, max_size: int, concurrency: int, overflow: str = OVERFLOW_DROP) -> None:
+        if overflow not in (OVERFLOW_DROP, OVERFLOW_COALESCE, OVERFLOW_BLOCK):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.name = name
+        self.max_size = max_size
+        self.concurrency = concurrency
+        self.overflow = overflow
+
+        self._jobs: "OrderedDict[Hashable, Job]" = OrderedDict()
+        self._anonymous_keys = itertools.count()
+        self._workers: List[asyncio.Task] = []
+        self._stopping = False
+        # Создаются в start(): в Python 3.9 они привязываются к event loop при создании.
+        self._has_jobs: Optional[asyncio.Event] = None
+        self._has_space: Optional[asyncio.Event] = None
+
+        self.in_progress = 0
+        metrics.job_queue_size.labels(name).set_function(self.__len__)
+        metrics.job_queue_in_progress.labels(name).set_function(lambda: self.in_progress)
+        self._done = metrics.job_queue_jobs.labels(name, "done")
+        self._failed = metrics.job_queue_jobs.labels(name, "failed")
+        self._dropped = metrics.job_queue_jobs.labels(name, "dropped")
+        self._coalesced = metrics.job_queue_jobs.labels(name, "coalesced")
+        job_queues.append(self)
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._stopping = False
+        self._has_jobs = asyncio.Event()
+        self._has_space = asyncio.Event()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def submit(self, job: Job, key: Optional[Hashable] = None) -> bool:
+        """
+        Ставит job в очередь и возвращает False, если задачу пришлось отбросить.
+        key учитывается только при политике coalesce: задача с уже ожидающим ключом
+        заменяет ожидающую. При остальных политиках задачи с одним ключом ставятся
+        в очередь друг за другом. Ждёт только при политике block и полной очереди.
+        """
+        if self._stopping:
+            self._dropped.inc()
+            return False
+        self.start()
+
+        if key is None or self.overflow != OVERFLOW_COALESCE:
+            key = next(self._anonymous_keys)
+        elif key in self._jobs:
+            self._jobs[key] = job
+            self._coalesced.inc()
+            return True
+
+        while len(self._jobs) >= self.max_size:
+            if self.overflow != OVERFLOW_BLOCK or self._has_space is None or self._stopping:
+                self._dropped.inc()
+                return False
+            self._has_space.clear()
+            await self._has_space.wait()
+
+        self._jobs[key] = job
+        if self._has_jobs is not None:
+            self._has_jobs.set()
+        return True
+
+    async def _work(self) -> None:
+        assert self._has_jobs is not None and self._has_space is not None
+        while True:
+            if not self._jobs:
+                if self._stopping:
+                    return
+                self._has_jobs.clear()
+                await self._has_jobs.wait()
+                continue
+
+            _, job = self._jobs.popitem(last=False)
+            self._has_space.set()
+            self.in_progress += 1
+            try:
+                await job()
+            except Exception:  # pylint: disable=broad-except
+                self._failed.inc()
+                logger.exception("Background job in queue %s failed", self.name)
+            else:
+                self._done.inc()
+            finally:
+                self.in_progress -= 1
+
+    async def stop(self, timeout: float) -> None:
+        """
+        Перестаёт принимать задачи и ждёт, пока воркеры выполнят оставшиеся, но не дольше timeout секунд.
+        То, что не успело выполниться, отменяется.
+        """
+        self._stopping = True
+        if not self._workers:
+            return
+        assert self._has_jobs is not None
+        self._has_jobs.set()
+
+        _, pending = await asyncio.wait(self._workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._has_space is not None:
+            self._has_space.set()  # Разбудим тех, кто ждёт места в очереди, чтобы они увидели остановку
+
+        if self._jobs or pending:
+            logger.warning("Queue %s stopped with %s unfinished jobs", self.name, len(self._jobs) + len(pending))
+            self._dropped.inc(len(self._jobs))
+            self._jobs.clear()
+
+
+job_queues: List[JobQueue] = []
+
+
+async def stop_job_queues(timeout: float) -> None:
+    """
+    Останавливает все очереди задач, давая им вместе не больше timeout секунд на выполнение оставшегося.
+    """
+    started = time.monotonic()
+    await asyncio.gather(*(queue.stop(timeout) for queue in job_queues))
+    logger.info("Background job queues stopped in %.2fs", time.monotonic() - started)
@@ -1,18 +1,80 @@
 import asyncio
 import datetime
+import hashlib
+import logging
+from urllib.parse import urlsplit, urlunsplit
 
+from app import metrics
 
-async def do_stuff_periodically(interval, periodic_function, *args, **kwargs):
+
+logger = logging.getLogger(__name__)
+
+
+async def do_stuff_periodically(interval, periodic_function, *args, lock=None, **kwargs):
     """
     Раз в interval запускает задание periodic_function с аргументами args, kwargs.
+    Если передан lock (asyncio.Lock), задание сначала ждёт его: задания с общим lock
+    выполняются по очереди, а не все разом.
     """
+    name = periodic_function.__qualname__
+    duration = metrics.periodic_job_duration.labels(name)
+    failures = metrics.periodic_job_failures.labels(name)
+
+    async def timed_run():
+        with duration.time():
+            return await periodic_function(*args, **kwargs)
+
+    async def run():
+        if lock is None:
+            return await timed_run()
+        async with lock:
+            return await timed_run()
+
     while True:
-        await asyncio.gather(
-            asyncio.sleep(interval),
-            periodic_function(*args, **kwargs),
-        )
+        results = await asyncio.gather(asyncio.sleep(interval), run(), return_exceptions=True)
+        if isinstance(results[1], Exception):
+            # Одна неудачная попытка не должна останавливать задание навсегда
+            failures.inc()
+            logger.error("Periodic task %s failed", name, exc_info=results[1])
 
 
 def utcnow() -> datetime.datetime:
     """Возвращает текущие дату и время в UTC с указанием часового пояса."""
     return datetime.datetime.now(datetime.timezone.utc)
+
+
+def ttl_until(expires_at: datetime.datetime, max_ttl: int) -> int:
+    """Сколько миллисекунд осталось до expires_at, но не больше max_ttl секунд. 0 - уже истёк."""
+    remaining = int((expires_at - utcnow()).total_seconds() * 1000)
+    return max(0, min(remaining, max_ttl * 1000))
+
+
+def truncate_hour(dt: datetime.datetime) -> datetime.datetime:
+    """Отбрасывает у dt минуты, секунды и микросекунды."""
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def truncate_minute(dt: datetime.datetime) -> datetime.datetime:
+    """Отбрасывает у dt секунды и микросекунды."""
+    return dt.replace(second=0, microsecond=0)
+
+
+def normalize_url(url: str) -> str:
+    """
+    Приводит урл к одному виду, не меняя того, куда он ведёт: схема и хост в нижнем
+    регистре, без порта по умолчанию, пустой путь заменяется на "/".
+    Запрос и фрагмент не трогаются: для сайта они могут быть значимы.
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    userinfo, at, host = parts.netloc.rpartition("@")
+    host = host.lower()
+    default_port = {"http": ":80", "https": ":443"}.get(scheme)
+    if default_port and host.endswith(default_port):
+        host = host[: -len(default_port)]
+    return urlunsplit((scheme, userinfo + at + host, parts.path or "/", parts.query, parts.fragment))
+
+
+def hash_url(url: str) -> str:
+    """Хеш нормализованного урла в hex, 32 символа."""
+    return hashlib.blake2b(normalize_url(url).encode(), digest_size=16).hexdigest()
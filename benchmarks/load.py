@@ -0,0 +1,205 @@
+"""
+Нагрузочный прогон всех пяти ручек /urls: создание, редирект, статистика, обновление и удаление.
+Популярность кодов при редиректах и статистике распределена по закону Ципфа, часть
+редиректов идёт на несуществующие коды. Для каждой ручки считаются p50/p95/p99
+задержки и запросы в секунду, а также доли попаданий в кеши. Результат пишется
+в JSON, который можно передать в --compare при следующем прогоне.
+
+По умолчанию запросы отправляются прямо в ASGI-приложение в этом процессе (нужны
+Redis и PostgreSQL из настроек, например из docker-compose). С --base-url запросы
+идут по HTTP в уже запущенный сервис, тогда счётчики кешей процесса недоступны.
+
+Запуск: python -m benchmarks.load [--links 1000] [--requests 20000] [--concurrency 50] [--compare old.json]
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from datetime import datetime
+from itertools import accumulate
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from httpx import AsyncClient
+
+from app.apps.urls.cache import missing_urls, url_cache
+from app.deps import redis
+from app.server import app
+
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+class EndpointStats:
+    """
+    Задержки и ошибки запросов к одной ручке.
+    """
+
+    def __init__(self) -> None:
+        self.timings: List[float] = []
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def report(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"requests": len(self.timings), "errors": self.errors}
+        if len(self.timings) < 2:
+            return result
+
+        percentiles = statistics.quantiles(self.timings, n=100)
+        result.update(
+            rps=round(len(self.timings) / self.elapsed, 1),
+            mean_ms=round(statistics.mean(self.timings), 3),
+            p50_ms=round(percentiles[49], 3),
+            p95_ms=round(percentiles[94], 3),
+            p99_ms=round(percentiles[98], 3),
+        )
+        return result
+
+
+def zipf_codes(codes: List[str], exponent: float, count: int) -> List[str]:
+    """
+    Выбирает count кодов так, что i-й по популярности встречается пропорционально 1 / i^exponent.
+    """
+    cum_weights = list(accumulate(1 / rank**exponent for rank in range(1, len(codes) + 1)))
+    return random.choices(codes, cum_weights=cum_weights, k=count)
+
+
+async def run(
+    stats: EndpointStats, jobs: Iterable[Any], concurrency: int, call: Callable[[Any], Awaitable[bool]]
+) -> None:
+    """
+    Выполняет call для каждого элемента jobs в concurrency параллельных воркеров.
+    """
+    jobs = iter(jobs)
+
+    async def worker() -> None:
+        for job in jobs:
+            started = time.perf_counter()
+            if not await call(job):
+                stats.errors += 1
+            stats.timings.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    stats.elapsed = time.perf_counter() - started
+
+
+async def redis_hits() -> Optional[Dict[str, int]]:
+    try:
+        info = await redis.info("stats")
+    except Exception:  # pylint: disable=broad-except
+        return None
+    return {"hits": info["keyspace_hits"], "misses": info["keyspace_misses"]}
+
+
+def ratio(hits: int, misses: int) -> Optional[float]:
+    return round(hits / (hits + misses), 4) if hits + misses else None
+
+
+async def benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    stats = {name: EndpointStats() for name in ("create", "redirect", "stats", "update", "delete")}
+    codes: List[str] = []
+
+    async with AsyncClient(app=None if args.base_url else app, base_url=args.base_url or "http://bench") as client:
+
+        async def create(i: int) -> bool:
+            response = await client.post("/urls", json={"url": f"https://example.com/{i}"})
+            if response.status_code != 200:
+                return False
+            codes.append(response.json()["url_short"].rsplit("/", 1)[-1])
+            return True
+
+        async def redirect(short_code: str) -> bool:
+            response = await client.get(f"/urls/{short_code}")
+            return response.status_code in (307, 404)
+
+        async def get_stats(short_code: str) -> bool:
+            response = await client.get(f"/urls/{short_code}/stats")
+            return response.status_code == 200
+
+        async def update(short_code: str) -> bool:
+            response = await client.put(f"/urls/{short_code}", json={"url": f"https://example.org/{short_code}"})
+            return response.status_code == 200
+
+        async def delete(short_code: str) -> bool:
+            response = await client.delete(f"/urls/{short_code}")
+            return response.status_code == 204
+
+        await run(stats["create"], range(args.links), args.concurrency, create)
+        random.shuffle(codes)  # Популярность не должна зависеть от порядка создания
+
+        url_cache.hits = url_cache.misses = missing_urls.hits = missing_urls.misses = 0
+        redis_before = await redis_hits()
+
+        redirects = zipf_codes(codes, args.zipf, args.requests)
+        for i in random.sample(range(len(redirects)), int(len(redirects) * args.missing)):
+            redirects[i] = f"-{random.randrange(args.links)}"  # Таких кодов не бывает: в алфавите нет "-"
+        await run(stats["redirect"], redirects, args.concurrency, redirect)
+
+        redis_after = await redis_hits()
+        await run(stats["stats"], zipf_codes(codes, args.zipf, args.requests // 10), args.concurrency, get_stats)
+        await run(stats["update"], random.sample(codes, len(codes) // 10), args.concurrency, update)
+        await run(stats["delete"], codes, args.concurrency, delete)
+
+    caches: Dict[str, Any] = {}
+    if not args.base_url:
+        caches["local"] = ratio(url_cache.hits, url_cache.misses)
+        caches["local_missing"] = ratio(missing_urls.hits, missing_urls.misses)
+    if redis_before and redis_after:
+        caches["redis"] = ratio(
+            redis_after["hits"] - redis_before["hits"], redis_after["misses"] - redis_before["misses"]
+        )
+
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {name: value for name, value in vars(args).items() if name not in ("output", "compare")},
+        "endpoints": {name: endpoint.report() for name, endpoint in stats.items()},
+        "cache_hit_ratio": caches,
+    }
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> None:
+    print(f"{'':>10} {'old p50':>9} {'new p50':>9} {'old p99':>9} {'new p99':>9} {'old rps':>9} {'new rps':>9}")
+    for name, result in new["endpoints"].items():
+        previous = old["endpoints"].get(name, {})
+        values = [previous.get("p50_ms"), result.get("p50_ms"), previous.get("p99_ms"), result.get("p99_ms")]
+        values += [previous.get("rps"), result.get("rps")]
+        print(f"{name:>10} " + " ".join(f"{str(value):>9}" for value in values))
+
+
+async def main(args: argparse.Namespace) -> None:
+    if not args.base_url:
+        await app.router.startup()
+    try:
+        result = await benchmark(args)
+    finally:
+        if not args.base_url:
+            await app.router.shutdown()
+
+    output = args.output or RESULTS_DIR / f"load-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+
+    print(json.dumps(result["endpoints"], indent=2))
+    print("cache hit ratio:", result["cache_hit_ratio"])
+    print("saved to", output)
+    if args.compare:
+        compare(json.loads(args.compare.read_text()), result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", help="URL запущенного сервиса, по умолчанию приложение вызывается в процессе")
+    parser.add_argument("--links", type=int, default=1000, help="Сколько ссылок создать")
+    parser.add_argument("--requests", type=int, default=20_000, help="Сколько сделать редиректов")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--zipf", type=float, default=1.1, help="Показатель распределения Ципфа")
+    parser.add_argument("--missing", type=float, default=0.05, help="Доля редиректов на несуществующие коды")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", type=Path, help="Куда записать JSON с результатом")
+    parser.add_argument("--compare", type=Path, help="JSON прошлого прогона для сравнения")
+    arguments = parser.parse_args()
+    random.seed(arguments.seed)
+    asyncio.run(main(arguments))
@@ -0,0 +1,111 @@
+"""
+Накладные расходы редиректа при попадании в кеш процесса: старые обработчики
+(с сессией из get_db и без зависимостей), которые на каждый запрос собирают
+RedirectResponse, против готового ответа из RedirectFastPath.
+Запросы отправляются прямо в ASGI-приложение, поэтому Redis и PostgreSQL не нужны.
+
+Запуск: python -m benchmarks.redirect_overhead [-n 20000]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Any, Dict, List
+
+from fastapi import Depends, FastAPI
+from fastapi.responses import RedirectResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.types import ASGIApp, Message
+
+from app.apps.urls.api.urls import RedirectFastPath, router as urls_router
+from app.apps.urls.cache import url_cache
+from app.apps.urls.clicks import click_buffer
+from app.apps.urls.redirects import Redirect
+from app.deps import get_db
+from app.exceptions import ResourceNotFoundError
+
+
+SHORT_CODE = "BeNcH1"
+
+bench_app = FastAPI()
+bench_app.include_router(urls_router, prefix="/urls")
+fast_app = RedirectFastPath(bench_app, prefix="/urls")
+
+
+@bench_app.get("/session/{short_code}")
+async def redirect_with_session(short_code: str, session: AsyncSession = Depends(get_db)) -> Any:
+    """Редирект с сессией в зависимостях, как было раньше."""
+    redirect = url_cache.get(short_code)
+    if not redirect:
+        raise ResourceNotFoundError(short_code)
+
+    click_buffer.add(short_code)
+    return RedirectResponse(redirect.url)
+
+
+@bench_app.get("/response/{short_code}")
+async def redirect_with_response(short_code: str) -> Any:
+    """Редирект без зависимостей, но с новым RedirectResponse на каждый запрос."""
+    redirect = url_cache.get(short_code)
+    if not redirect:
+        raise ResourceNotFoundError(short_code)
+
+    click_buffer.add(short_code)
+    return RedirectResponse(redirect.url)
+
+
+async def request(app: ASGIApp, path: str) -> None:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("127.0.0.1", 10000),
+        "server": ("bench", 80),
+    }
+
+    async def receive() -> Message:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: Message) -> None:
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure(path: str, requests: int) -> List[float]:
+    timings: List[float] = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        await request(fast_app, path)
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    click_buffer._clicks.clear()  # pylint: disable=protected-access
+    return timings
+
+
+async def main(requests: int, rounds: int = 5) -> None:
+    url_cache.set(SHORT_CODE, Redirect("http://example.com/"))
+    paths = {"session": f"/session/{SHORT_CODE}", "response": f"/response/{SHORT_CODE}", "fast": f"/urls/{SHORT_CODE}"}
+    timings: Dict[str, List[float]] = {name: [] for name in paths}
+
+    # Прогреваем и чередуем варианты, чтобы на результат не влиял порядок запуска.
+    for path in paths.values():
+        await measure(path, 1000)
+    for _ in range(rounds):
+        for name, path in paths.items():
+            timings[name].extend(await measure(path, requests // rounds))
+
+    for name, values in timings.items():
+        print(f"{name:>8}: mean {statistics.mean(values):.1f}us, median {statistics.median(values):.1f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--requests", type=int, default=20_000)
+    asyncio.run(main(parser.parse_args().requests))
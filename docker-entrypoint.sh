@@ -8,6 +8,13 @@ case "$1" in
         alembic upgrade head
         uvicorn app.server:app --host 0.0.0.0 --port $PORT --reload
         ;;
+    start-prod)
+        # По воркеру на ядро, если WEB_CONCURRENCY не задан. Воркеры читают его же, чтобы поделить пулы соединений.
+        export WEB_CONCURRENCY=${WEB_CONCURRENCY:-$(nproc)}
+        alembic upgrade head
+        exec uvicorn app.server:app --host 0.0.0.0 --port $PORT --workers $WEB_CONCURRENCY \
+            --loop uvloop --http httptools --proxy-headers --no-access-log
+        ;;
     tests)
         isort -c --diff --settings-file .isort.cfg .
         black --config pyproject.toml --check .
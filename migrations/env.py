@@ -28,6 +28,13 @@ from app.apps.urls import models as urls_models
 config.set_main_option('sqlalchemy.url', str(settings.DB_DSN)+"?async_fallback=true")
 target_metadata = metadata
 
+
+def include_name(name, type_, parent_names):
+    """Partitions of url_stats are not part of the metadata: hourly ones are created at runtime"""
+    if type_ == "table" and (name.startswith("url_stats_p") or name == urls_models.UrlStats.default_partition):
+        return False
+    return True
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -50,6 +57,7 @@ def run_migrations_offline():
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_name=include_name,
         literal_binds=True,
         dialect_opts={'paramstyle': 'named'},
     )
@@ -73,7 +81,7 @@ def run_migrations_online():
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, include_name=include_name
         )
 
         with context.begin_transaction():
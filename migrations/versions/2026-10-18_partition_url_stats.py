@@ -0,0 +1,73 @@
+"""partition url_stats
+
+Revision ID: 4f6b2d9a0e71
+Revises: c2a87f5d1e36
+Create Date: 2026-10-18 19:40:13.208551
+
+"""
+from datetime import datetime, timedelta, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f6b2d9a0e71'
+down_revision = 'c2a87f5d1e36'
+branch_labels = None
+depends_on = None
+
+# Статистика старше 24 часов не нужна, так что переносим чуть больше, и сразу создаём партиции на 48 часов вперёд.
+HOURS_BEFORE = 48
+HOURS_AFTER = 48
+
+
+def upgrade():
+    op.execute('ALTER TABLE url_stats RENAME TO url_stats_old')
+    op.execute('ALTER TABLE url_stats_old RENAME CONSTRAINT url_stats_pkey TO url_stats_old_pkey')
+    op.drop_index('ix_url_stats_url_id_created_at', table_name='url_stats_old')
+
+    op.create_table('url_stats',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('url_stats_id_seq')"), nullable=False),
+    sa.Column('url_id', sa.String(length=6), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['url_id'], ['urls.id'], ),
+    sa.PrimaryKeyConstraint('id', 'created_at'),
+    postgresql_partition_by='RANGE (created_at)'
+    )
+    op.create_index('ix_url_stats_url_id_created_at', 'url_stats', ['url_id', 'created_at'], unique=False)
+
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    start = now - timedelta(hours=HOURS_BEFORE)
+    for i in range(HOURS_BEFORE + HOURS_AFTER + 1):
+        hour = start + timedelta(hours=i)
+        op.execute(
+            f'CREATE TABLE "{hour.strftime("url_stats_p%Y%m%d%H")}" PARTITION OF url_stats '
+            f"FOR VALUES FROM ('{hour.isoformat()}') TO ('{(hour + timedelta(hours=1)).isoformat()}')"
+        )
+
+    op.execute(
+        "INSERT INTO url_stats (id, url_id, created_at) SELECT id, url_id, created_at FROM url_stats_old "
+        f"WHERE created_at >= '{start.isoformat()}' AND created_at < '{(now + timedelta(hours=HOURS_AFTER + 1)).isoformat()}'"
+    )
+    op.execute('ALTER SEQUENCE url_stats_id_seq OWNED BY url_stats.id')
+    op.drop_table('url_stats_old')
+
+
+def downgrade():
+    op.execute('ALTER TABLE url_stats RENAME TO url_stats_partitioned')
+    op.execute('ALTER TABLE url_stats_partitioned RENAME CONSTRAINT url_stats_pkey TO url_stats_partitioned_pkey')
+    op.drop_index('ix_url_stats_url_id_created_at', table_name='url_stats_partitioned')
+
+    op.create_table('url_stats',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('url_stats_id_seq')"), nullable=False),
+    sa.Column('url_id', sa.String(length=6), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['url_id'], ['urls.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_url_stats_url_id_created_at', 'url_stats', ['url_id', 'created_at'], unique=False)
+
+    op.execute('INSERT INTO url_stats (id, url_id, created_at) SELECT id, url_id, created_at FROM url_stats_partitioned')
+    op.execute('ALTER SEQUENCE url_stats_id_seq OWNED BY url_stats.id')
+    op.drop_table('url_stats_partitioned')
@@ -0,0 +1,24 @@
+"""short_code_seq
+
+Revision ID: 9e3f4a61c8d2
+Revises: 5b1d0e7c2a94
+Create Date: 2026-10-18 14:27:05.112734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e3f4a61c8d2'
+down_revision = '5b1d0e7c2a94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(sa.schema.CreateSequence(sa.Sequence('short_code_seq')))
+
+
+def downgrade():
+    op.execute(sa.schema.DropSequence(sa.Sequence('short_code_seq')))
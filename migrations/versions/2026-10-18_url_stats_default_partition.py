@@ -0,0 +1,25 @@
+"""url_stats default partition
+
+Revision ID: 3b7e91c05d24
+Revises: 619d8eb40e13
+Create Date: 2026-10-18 21:05:42.716093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7e91c05d24'
+down_revision = '619d8eb40e13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Переходы вне часовых партиций попадают сюда, а не роняют INSERT всей пачки
+    op.execute('CREATE TABLE url_stats_default PARTITION OF url_stats DEFAULT')
+
+
+def downgrade():
+    op.drop_table('url_stats_default')
@@ -1,4 +1,5 @@
 import asyncio
+from contextlib import asynccontextmanager
 
 import pytest
 from httpx import AsyncClient
@@ -8,7 +9,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app.db import engine
-from app.deps import get_db
+from app.deps import get_db, get_db_connect
 from app.server import app
 
 
@@ -29,7 +30,15 @@ async def client(db: AsyncSession):
     def _get_db():
         return db
 
+    @asynccontextmanager
+    async def _connect():
+        yield await db.connection()
+
+    async def _get_db_connect():
+        return _connect
+
     app.dependency_overrides[get_db] = _get_db
+    app.dependency_overrides[get_db_connect] = _get_db_connect
     async with AsyncClient(app=app, base_url="http://test") as client:
         yield client
 
@@ -0,0 +1,53 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from app.cache import LocalCache, SingleFlight
+
+
+def test_local_cache_evicts_least_recently_used():
+    cache: LocalCache[str] = LocalCache(max_size=2, ttl=60)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert (cache.hits, cache.misses, cache.evictions) == (3, 1, 1)
+
+
+def test_local_cache_expires_entries():
+    cache: LocalCache[str] = LocalCache(max_size=2, ttl=60)
+    cache.set("a", "1")
+
+    with mock.patch("app.cache.time.monotonic", return_value=10**9):
+        assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_local_cache_skips_values_read_before_invalidation():
+    cache: LocalCache[str] = LocalCache(max_size=2, ttl=60)
+    generation = cache.generation
+    cache.invalidate("a")
+
+    cache.set("a", "old", generation)
+    assert cache.get("a") is None
+
+
+@pytest.mark.asyncio
+async def test_single_flight_coalesces_concurrent_calls():
+    flight: SingleFlight[int] = SingleFlight()
+    calls = 0
+
+    async def load() -> int:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    assert await asyncio.gather(*(flight.do("a", load) for _ in range(10))) == [1] * 10
+    assert await flight.do("a", load) == 2  # Завершённые вызовы не переиспользуются
+    assert len(flight) == 0
@@ -0,0 +1,38 @@
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+
+from app import metrics
+from app.apps.urls.api.urls import local_hits
+from app.apps.urls.cache import url_cache
+from app.apps.urls.redirects import Redirect
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_duration_seconds", "Тестовая гистограмма", ["route"], buckets=(0.1, 1.0))
+    metrics.registry.remove(histogram)
+    value = histogram.labels("a")
+    for seconds in (0.05, 0.1, 0.5, 5.0):
+        value.observe(seconds)
+
+    assert list(histogram.collect())[2:] == [
+        'test_duration_seconds_bucket{route="a",le="0.1"} 2',
+        'test_duration_seconds_bucket{route="a",le="1.0"} 3',
+        'test_duration_seconds_bucket{route="a",le="+Inf"} 4',
+        'test_duration_seconds_sum{route="a"} 5.65',
+        'test_duration_seconds_count{route="a"} 4',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(client: AsyncClient):
+    url_cache.set("MeTrIc", Redirect("http://example.com/metrics"))
+    hits_before = local_hits.get()
+    await client.get("/urls/MeTrIc")
+
+    response = await client.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK
+    assert local_hits.get() == hits_before + 1
+    assert 'short_request_duration_seconds_count{route="redirect_to_long_url"}' in response.text
+    assert 'short_db_pool_connections{state="checked_out"}' in response.text
+    assert f'short_local_cache_requests_total{{cache="url",result="hit"}} {url_cache.hits}' in response.text
@@ -0,0 +1,65 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from aioredis import ConnectionError as RedisConnectionError, ResponseError
+
+from app.deps import redis
+from app.redis_client import (
+    AutoPipeline,
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+
+
+@pytest.mark.asyncio
+async def test_auto_pipeline_batches_same_tick_commands():
+    batch = AutoPipeline(redis)
+    await batch.set("auto_pipeline_a", "1", ex=60)
+
+    results = await asyncio.gather(
+        batch.get("auto_pipeline_a"), batch.get("auto_pipeline_b"), batch.execute_command("INCR", "auto_pipeline_a")
+    )
+    assert results == ["1", None, 2]
+    assert (batch.batches, batch.commands) == (2, 4)
+
+    await batch.set("auto_pipeline_a", "not a number")
+    with pytest.raises(ResponseError):
+        await asyncio.gather(batch.get("auto_pipeline_a"), batch.execute_command("INCR", "auto_pipeline_a"))
+    await batch.delete("auto_pipeline_a")
+
+
+def test_circuit_breaker_opens_and_recovers():
+    breaker = CircuitBreaker(window=4, failure_rate=0.5, slow_call=0.1, open_time=5)
+    for failed in (False, True, False):
+        breaker.record(0.001, failed)
+    assert breaker.state == CIRCUIT_CLOSED
+
+    breaker.record(0.5, failed=False)  # Медленный ответ тоже считается неудачей
+    assert breaker.state == CIRCUIT_OPEN
+    assert not breaker.allow()
+
+    with mock.patch("app.redis_client.time.monotonic", return_value=10**9):
+        assert breaker.allow()
+        assert breaker.state == CIRCUIT_HALF_OPEN
+        assert not breaker.allow()  # Пробное обращение только одно
+    breaker.record(0.001, failed=False)
+    assert breaker.state == CIRCUIT_CLOSED
+
+
+@pytest.mark.asyncio
+async def test_auto_pipeline_fails_fast_when_circuit_is_open():
+    breaker = CircuitBreaker(window=1, failure_rate=1, slow_call=1, open_time=60)
+    batch = AutoPipeline(redis, breaker)
+    with mock.patch.object(redis, "execute_command", side_effect=RedisConnectionError):
+        with pytest.raises(RedisConnectionError):
+            await batch.get("circuit")
+    assert breaker.state == CIRCUIT_OPEN
+
+    with mock.patch.object(redis, "execute_command") as execute_command:
+        with pytest.raises(CircuitOpenError):
+            await batch.get("circuit")
+    execute_command.assert_not_called()
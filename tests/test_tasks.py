@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from app.tasks import job_queues, JobQueue, OVERFLOW_BLOCK, OVERFLOW_COALESCE, OVERFLOW_DROP
+
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_queue(max_size: int, overflow: str) -> JobQueue:
+    queue = JobQueue("test", max_size=max_size, concurrency=1, overflow=overflow)
+    job_queues.remove(queue)
+    return queue
+
+
+async def test_job_queue_drops_when_full():
+    queue = make_queue(max_size=1, overflow=OVERFLOW_DROP)
+    done = []
+
+    async def job(i: int) -> None:
+        done.append(i)
+
+    # Воркер ещё не успел забрать первую задачу, так что вторая не помещается
+    assert await queue.submit(lambda: job(1))
+    assert not await queue.submit(lambda: job(2))
+    await queue.stop(timeout=1)
+    assert done == [1]
+
+
+async def test_job_queue_coalesces_same_key():
+    queue = make_queue(max_size=10, overflow=OVERFLOW_COALESCE)
+    done = []
+
+    async def job(i: int) -> None:
+        done.append(i)
+
+    for i in range(3):
+        await queue.submit(lambda i=i: job(i), key="a")
+    await queue.submit(lambda: job(10), key="b")
+    await queue.stop(timeout=1)
+    assert done == [2, 10]
+
+
+async def test_job_queue_drop_does_not_coalesce_same_key():
+    queue = make_queue(max_size=2, overflow=OVERFLOW_DROP)
+    done = []
+
+    async def job(i: int) -> None:
+        done.append(i)
+
+    assert await queue.submit(lambda: job(1), key="a")
+    assert await queue.submit(lambda: job(2), key="a")
+    assert not await queue.submit(lambda: job(3), key="a")
+    await queue.stop(timeout=1)
+    assert done == [1, 2]
+
+
+async def test_job_queue_block_does_not_coalesce_same_key():
+    queue = make_queue(max_size=1, overflow=OVERFLOW_BLOCK)
+    done = []
+
+    async def job(i: int) -> None:
+        await asyncio.sleep(0.01)
+        done.append(i)
+
+    for i in range(3):
+        assert await queue.submit(lambda i=i: job(i), key="a")
+    await queue.stop(timeout=1)
+    assert done == [0, 1, 2]
+
+
+async def test_job_queue_blocks_and_drains_on_stop():
+    queue = make_queue(max_size=1, overflow=OVERFLOW_BLOCK)
+    done = []
+
+    async def job(i: int) -> None:
+        await asyncio.sleep(0.01)
+        done.append(i)
+
+    for i in range(3):
+        assert await queue.submit(lambda i=i: job(i))
+    await queue.stop(timeout=1)
+    assert done == [0, 1, 2]
+    assert not await queue.submit(lambda: job(3))
+
+
+async def test_job_queue_stop_deadline_cancels_jobs():
+    queue = make_queue(max_size=10, overflow=OVERFLOW_DROP)
+
+    async def job() -> None:
+        await asyncio.sleep(10)
+
+    await queue.submit(job)
+    await queue.submit(job)
+    await asyncio.wait_for(queue.stop(timeout=0.05), 1)
+    assert len(queue) == 0
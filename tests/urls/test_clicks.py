@@ -0,0 +1,150 @@
+import asyncio
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+import sqlalchemy as sa
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.apps.urls import models
+from app.apps.urls.cache import stats_cache
+from app.apps.urls.clicks import click_buffer, ClickBuffer
+from app.apps.urls.visitors import count_visitors
+from app.config import settings
+from app.db import advisory_lock, engine
+from app.deps import redis
+from app.utils import truncate_hour, utcnow
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_redirect_adds_click_to_buffer(client: AsyncClient, url: models.Url):
+    clicks_before = len(click_buffer)
+    await client.get(f"/urls/{url.id}")
+    assert len(click_buffer) == clicks_before + 1
+
+
+async def test_stats_counts_unique_visitors(client: AsyncClient, url: models.Url):
+    await click_buffer.flush()  # Переходы из других тестов
+    hour = truncate_hour(utcnow())
+    await redis.delete(*(settings.REDIS_VISITORS_KEY.format(url.id, hour - timedelta(hours=i)) for i in range(25)))
+    for user_agent in ("first", "second", "first"):
+        await client.get(f"/urls/{url.id}", headers={"User-Agent": user_agent})
+    await click_buffer.flush()
+    stats_cache.clear()
+
+    response = await client.get(f"/urls/{url.id}/stats")
+    assert response.json()["unique_visitors_in_24_hours"] == 2
+
+
+async def test_count_visitors_covers_24_hours():
+    hour = truncate_hour(utcnow())
+    keys = [settings.REDIS_VISITORS_KEY.format("ViSiT1", hour - timedelta(hours=i)) for i in range(25)]
+    await redis.delete(*keys)
+    await redis.pfadd(keys[23], "in_window")
+    await redis.pfadd(keys[24], "too_old")
+
+    assert await count_visitors("ViSiT1", hour) == 1
+    await redis.delete(*keys)
+
+
+async def test_click_buffer_drops_when_full():
+    buffer = ClickBuffer(max_size=2, batch_size=10, flush_interval=1)
+    for _ in range(5):
+        buffer.add("QwErTy")
+
+    assert len(buffer) == 2
+    assert buffer.dropped == 3
+
+
+async def test_click_buffer_stop_deadline_finishes_started_batch():
+    buffer = ClickBuffer(max_size=10, batch_size=1, flush_interval=1)
+    for _ in range(3):
+        buffer.add("QwErTy")
+
+    async def slow_bulk_create(session, clicks):
+        await asyncio.sleep(0.1)
+
+    with mock.patch.object(models.UrlStats, "bulk_create", slow_bulk_create):
+        await buffer.stop(timeout=0.05)
+
+    assert (buffer.flushed, buffer.dropped, len(buffer)) == (1, 2, 0)
+
+
+async def test_bulk_create_skips_deleted_urls(db: AsyncSession, url: models.Url):
+    now = utcnow()
+    await models.UrlStats.bulk_create(db, [(url.id, now), ("nOnE00", now), (url.id, now)])
+
+    total = await models.UrlStats.count_hours_stats(db, url.id, now - timedelta(hours=1), now)
+    assert total == 2
+
+
+async def test_count_hours_stats_uses_hourly_buckets(db: AsyncSession, url: models.Url):
+    dt_to = truncate_hour(utcnow()) - timedelta(minutes=20)
+    dt_from = dt_to - timedelta(hours=24)
+    clicks = [
+        dt_from - timedelta(minutes=1),  # До интервала
+        dt_from,  # Граница не включается
+        dt_from + timedelta(minutes=1),  # Неполный первый час
+        dt_from + timedelta(hours=5),  # Полные часы
+        dt_from + timedelta(hours=12),
+        dt_to,  # Неполный последний час
+        dt_to + timedelta(minutes=1),  # После интервала
+    ]
+    await models.UrlStats.bulk_create(db, [(url.id, dt) for dt in clicks])
+
+    assert await models.UrlStats.count_hours_stats(db, url.id, dt_from, dt_to) == 4
+    assert await models.UrlStats.count_hours_stats(db, url.id, dt_to - timedelta(minutes=5), dt_to) == 1
+
+
+async def test_hourly_stats_backfill(db: AsyncSession, url: models.Url, url_stats: models.UrlStats):
+    await models.UrlStatsHourly.backfill(db)
+
+    bucket = await db.get(models.UrlStatsHourly, (url.id, truncate_hour(url_stats.created_at)))
+    assert bucket.clicks == 1
+
+
+async def test_create_partitions_covers_next_hours():
+    await models.UrlStats.create_partitions()
+
+    async with engine.connect() as connection:
+        partitions = await models.UrlStats.get_partitions(connection)
+    hour = truncate_hour(utcnow())
+    assert all(hour + timedelta(hours=i) in partitions for i in range(settings.STATS_PARTITIONS_AHEAD + 1))
+
+
+async def test_clicks_outside_partitions_go_to_default_partition(db: AsyncSession, url: models.Url):
+    now = utcnow()
+    await models.UrlStats.bulk_create(db, [(url.id, now + timedelta(days=30)), (url.id, now - timedelta(days=30))])
+
+    query = sa.text(f"SELECT count(*) FROM {models.UrlStats.default_partition} WHERE url_id = :url_id")
+    assert await db.scalar(query, {"url_id": url.id}) == 2
+
+
+async def test_create_partition_moves_clicks_from_default_partition():
+    hour = truncate_hour(utcnow() + timedelta(days=30))
+    partition = hour.strftime(models.UrlStats.partition_name_format)
+    async with engine.begin() as connection:
+        await connection.execute(sa.insert(models.Url).values(id="DeFlt1", url="http://example.com/"))
+        await connection.execute(sa.insert(models.UrlStats).values(url_id="DeFlt1", created_at=hour))
+    try:
+        async with engine.connect() as connection:
+            await models.UrlStats._create_partition(connection, hour)  # pylint: disable=protected-access
+            await connection.commit()
+
+            assert await connection.scalar(sa.text(f'SELECT count(*) FROM "{partition}"')) == 1
+            query = sa.text(f"SELECT count(*) FROM {models.UrlStats.default_partition} WHERE url_id = 'DeFlt1'")
+            assert await connection.scalar(query) == 0
+    finally:
+        async with engine.begin() as connection:
+            await connection.execute(sa.text(f'DROP TABLE IF EXISTS "{partition}"'))
+            await connection.execute(sa.delete(models.UrlStats).where(models.UrlStats.url_id == "DeFlt1"))
+            await connection.execute(sa.delete(models.Url).where(models.Url.id == "DeFlt1"))
+
+
+async def test_partition_maintenance_skips_when_locked(caplog):
+    async with advisory_lock(f"{models.UrlStats.__tablename__}_partitions"):
+        assert await models.UrlStats.maintain_partitions() == (0, 0)
+    assert "already running elsewhere, skipping" in caplog.text
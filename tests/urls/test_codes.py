@@ -0,0 +1,38 @@
+import pytest
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.apps.urls import models
+from app.apps.urls.codes import FeistelPermutation, letters, SequenceCodeAllocator
+from app.config import Settings
+
+
+def test_feistel_permutation_is_bijection():
+    permutation = FeistelPermutation(59**2, "secret")
+    assert sorted(permutation(i) for i in range(59**2)) == list(range(59**2))
+
+
+def test_feistel_permutation_depends_on_secret():
+    first, second = FeistelPermutation(10**6, "first"), FeistelPermutation(10**6, "second")
+    assert [first(i) for i in range(10)] != [second(i) for i in range(10)]
+
+
+@pytest.mark.asyncio
+async def test_sequence_allocator_codes_are_unique(db: AsyncSession):
+    allocator = SequenceCodeAllocator(letters, models.SHORT_CODE_LEN, "secret", block_size=3)
+    codes = [await allocator.allocate(db) for _ in range(10)]
+
+    assert len(set(codes)) == len(codes)
+    assert all(len(code) == models.SHORT_CODE_LEN and set(code) <= set(letters) for code in codes)
+
+
+@pytest.mark.asyncio
+async def test_insert_if_absent(db: AsyncSession, url: models.Url):
+    assert not await models.Url.insert_if_absent(db, id=url.id, url="http://example.com/other")
+    assert await models.Url.insert_if_absent(db, id="NeW000", url="http://example.com/other")
+
+
+def test_sequence_allocator_requires_secret():
+    with pytest.raises(ValidationError):
+        Settings(DEBUG=False, SHORT_CODE_ALLOCATOR="sequence", SHORT_CODE_SECRET="")
+    assert Settings(DEBUG=False, SHORT_CODE_ALLOCATOR="random", SHORT_CODE_SECRET="").SHORT_CODE_SECRET == ""
@@ -0,0 +1,74 @@
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+
+from app.config import settings
+from app.deps import redis
+from app.utils import hash_url, normalize_url, utcnow
+
+
+def test_normalize_url():
+    assert normalize_url("HTTPS://User@Example.COM:443?q=A#F") == "https://User@example.com/?q=A#F"
+    assert normalize_url("http://example.com:8080/Path") == "http://example.com:8080/Path"
+
+
+@pytest.mark.asyncio
+async def test_create_url_dedup_returns_existing_code(client: AsyncClient):
+    path = uuid.uuid4().hex  # Обратное соответствие в Redis переживает откат БД после теста
+    response = await client.post("/urls", json={"url": f"http://example.com/{path}"})
+    url_short = response.json()["url_short"]
+
+    response = await client.post("/urls", params={"dedup": "true"}, json={"url": f"HTTP://Example.com:80/{path}"})
+    assert response.json()["url_short"] == url_short
+    assert await redis.get(settings.REDIS_URL_HASH_KEY.format(hash_url(f"http://example.com/{path}")))
+
+    response = await client.post("/urls", json={"url": f"http://example.com/{path}"})
+    assert response.json()["url_short"] != url_short
+
+
+@pytest.mark.asyncio
+async def test_create_url_dedup_ignores_links_with_own_expiry(client: AsyncClient):
+    path = uuid.uuid4().hex
+    expires_at = (utcnow() + timedelta(minutes=5)).isoformat()
+    short_lived = await client.post(
+        "/urls", params={"dedup": "true"}, json={"url": f"http://example.com/{path}", "expires_at": expires_at}
+    )
+    assert not await redis.get(settings.REDIS_URL_HASH_KEY.format(hash_url(f"http://example.com/{path}")))
+
+    first = await client.post("/urls", params={"dedup": "true"}, json={"url": f"http://example.com/{path}"})
+    assert first.json()["url_short"] != short_lived.json()["url_short"]
+
+    second = await client.post("/urls", params={"dedup": "true"}, json={"url": f"http://example.com/{path}"})
+    assert second.json()["url_short"] == first.json()["url_short"]
+
+    response = await client.post(
+        "/urls", params={"dedup": "true"}, json={"url": f"http://example.com/{path}", "expires_at": expires_at}
+    )
+    assert response.json()["url_short"] not in (first.json()["url_short"], short_lived.json()["url_short"])
+
+
+@pytest.mark.asyncio
+async def test_create_url_dedup_survives_ttl_change(client: AsyncClient):
+    path = uuid.uuid4().hex
+    response = await client.post("/urls", json={"url": f"http://example.com/{path}"})
+    url_short = response.json()["url_short"]
+
+    # Ссылка со сроком по умолчанию остаётся такой и после смены SHORT_URL_TTL
+    with mock.patch.object(settings, "SHORT_URL_TTL", settings.SHORT_URL_TTL * 2):
+        response = await client.post("/urls", params={"dedup": "true"}, json={"url": f"http://example.com/{path}"})
+    assert response.json()["url_short"] == url_short
+
+
+@pytest.mark.asyncio
+async def test_create_url_with_idempotency_key(client: AsyncClient):
+    headers = {"Idempotency-Key": uuid.uuid4().hex}
+    first = await client.post("/urls", headers=headers, json={"url": "http://example.com/"})
+    second = await client.post("/urls", headers=headers, json={"url": "http://example.com/"})
+    assert second.json()["url_short"] == first.json()["url_short"]
+
+    response = await client.post("/urls", headers=headers, json={"url": "http://example.org/"})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
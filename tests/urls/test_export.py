@@ -0,0 +1,46 @@
+import csv
+import io
+import json
+from datetime import timedelta
+
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.apps.urls import models
+from app.utils import utcnow
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_export_urls_ndjson_resumes_after_cursor(client: AsyncClient, db: AsyncSession):
+    created_at = utcnow() - timedelta(days=365)  # Раньше всех остальных ссылок в БД
+    db.add_all(models.Url(id=f"ExPrT{i}", url=f"http://example.com/{i}", created_at=created_at) for i in range(3))
+    await db.commit()
+    params = {"created_to": (created_at + timedelta(seconds=1)).isoformat()}
+
+    response = await client.get("/export/urls", params=params)
+    assert response.status_code == status.HTTP_200_OK
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == ["ExPrT0", "ExPrT1", "ExPrT2"]
+
+    after = f"{rows[0]['created_at']},{rows[0]['id']}"
+    response = await client.get("/export/urls", params={**params, "after": after})
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == ["ExPrT1", "ExPrT2"]
+
+
+async def test_export_clicks_csv(client: AsyncClient, url_stats: models.UrlStats):
+    response = await client.get(
+        "/export/clicks", params={"format": "csv", "after": url_stats.id - 1, "created_from": url_stats.created_at}
+    )
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == ["id", "url_id", "created_at"]
+    assert rows[1][:2] == [str(url_stats.id), url_stats.url_id]
+
+
+async def test_export_invalid_cursor(client: AsyncClient):
+    response = await client.get("/export/clicks", params={"after": "nope"})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
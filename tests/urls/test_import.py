@@ -0,0 +1,62 @@
+import json
+
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.apps.urls import models
+from app.apps.urls.cache import MISSING_URL, missing_urls
+from app.config import settings
+from app.deps import redis
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_import_urls_csv(client: AsyncClient, db: AsyncSession, url: models.Url):
+    content = "\n".join(
+        [
+            "code,url,created_at",
+            "ImPrt1,http://example.com/1,2022-01-01T00:00:00",
+            "ImPrt2,not a url,",
+            f"{url.id},http://example.com/other,",
+            f"{url.id},{url.url},",
+            "ImPrt1,http://example.com/2,",
+            "ImPrt3,http://example.com/3,",
+        ]
+    )
+    response = await client.post("/import/urls", params={"format": "csv", "warm": "true"}, content=content)
+    assert response.status_code == status.HTTP_200_OK
+    *errors, result = [json.loads(line) for line in response.text.splitlines()]
+
+    assert result == {"total": 6, "inserted": 2, "unchanged": 1, "conflicts": 2, "invalid": 1}
+    assert [(error["line"], error["code"]) for error in errors] == [(3, "ImPrt2"), (4, url.id), (6, "ImPrt1")]
+    assert errors[1]["existing_url"] == url.url
+
+    imported = await models.Url.get_by_id(db, "ImPrt1")
+    assert imported.url == "http://example.com/1"
+    assert imported.created_at.year == 2022
+    assert await redis.get(settings.REDIS_URL_KEY.format("ImPrt3")) == "http://example.com/3"
+
+
+async def test_import_urls_ndjson_accepts_export_format(client: AsyncClient, db: AsyncSession):
+    content = '{"id": "ImPrt4", "url": "http://example.com/4"}\n[1, 2]\n'
+    response = await client.post("/import/urls", content=content)
+    *errors, result = [json.loads(line) for line in response.text.splitlines()]
+
+    assert result["inserted"] == 1
+    assert errors[0]["line"] == 2
+    assert await models.Url.get_by_id(db, "ImPrt4") is not None
+
+
+async def test_import_urls_clears_missing_marks(client: AsyncClient):
+    await redis.set(settings.REDIS_URL_KEY.format("ImPrt5"), MISSING_URL, ex=settings.REDIS_MISSING_URL_TTL)
+    missing_urls.set("ImPrt5", True)
+
+    await client.post("/import/urls", content='{"code": "ImPrt5", "url": "http://example.com/5"}\n')
+
+    assert not missing_urls.get("ImPrt5")
+    assert await redis.get(settings.REDIS_URL_KEY.format("ImPrt5")) is None
+    response = await client.get("/urls/ImPrt5")
+    assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
@@ -0,0 +1,42 @@
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+
+from app.apps.urls import reads
+from app.apps.urls.cache import url_cache
+from app.config import settings
+from app.db import ReplicaSet
+from app.deps import redis
+
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+async def replica_set(monkeypatch):
+    # "Реплика" - та же БД, но через свой пул: данные теста в незакоммиченной транзакции ей не видны, как отставшей.
+    replica_set = ReplicaSet([settings.DB_DSN.render_as_string(hide_password=False)])
+    await replica_set.check()
+    monkeypatch.setattr(reads, "replicas", replica_set)
+    yield replica_set
+    await replica_set.engines[0].dispose()
+
+
+async def test_redirect_reads_own_writes_from_primary(client: AsyncClient, replica_set: ReplicaSet):
+    response = await client.post("/urls", json={"url": "http://example.com/written"})
+    short_code = response.json()["url_short"].rsplit("/", 1)[1]
+    await redis.delete(settings.REDIS_URL_KEY.format(short_code))
+    url_cache.invalidate(short_code)
+    reads.recent_writes.invalidate(short_code)  # Отметку для других процессов найдёт в Redis
+
+    response = await client.get(f"/urls/{short_code}")
+    assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+    assert response.headers["location"] == "http://example.com/written"
+
+
+async def test_stats_read_from_replica(client: AsyncClient, replica_set: ReplicaSet):
+    await redis.delete(settings.REDIS_WRITTEN_KEY.format("NoWr1t"))
+    # Ссылки нет ни на "реплике", ни в основной БД, но спросили именно реплику
+    response = await client.get("/urls/NoWr1t/stats")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert reads.replicas.healthy == replica_set.engines
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import status
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.apps.urls import models, stats
+from app.apps.urls.cache import stats_cache
+from app.utils import truncate_hour, truncate_minute, utcnow
+
+
+@pytest.fixture(autouse=True)
+def clear_stats_cache():
+    stats_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_stats_series_by_minute(client: AsyncClient, db: AsyncSession, url: models.Url):
+    minute = truncate_minute(utcnow())
+    await models.UrlStats.bulk_create(db, [(url.id, minute), (url.id, minute), (url.id, minute - timedelta(minutes=2))])
+    await db.commit()
+
+    response = await client.get(
+        f"/urls/{url.id}/stats/series",
+        params={"granularity": "minute", "start": (minute - timedelta(minutes=4, seconds=30)).isoformat()},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["cache-control"].startswith("public, max-age=")
+    data = response.json()
+    assert data["total"] == 3
+    assert [point["clicks"] for point in data["points"]] == [0, 0, 0, 1, 0, 2]
+
+
+@pytest.mark.asyncio
+async def test_stats_series_by_day_from_hourly_buckets(client: AsyncClient, db: AsyncSession, url: models.Url):
+    hour = truncate_hour(utcnow())
+    await models.UrlStatsHourly.increment(db, {(url.id, hour): 2, (url.id, hour - timedelta(days=3)): 5})
+    await db.commit()
+
+    response = await client.get(f"/urls/{url.id}/stats/series", params={"granularity": "day"})
+    points = response.json()["points"]
+    assert len(points) == 30
+    assert points[-1]["clicks"] == 2
+    assert points[-4]["clicks"] == 5
+
+
+@pytest.mark.asyncio
+async def test_stats_batch(client: AsyncClient, db: AsyncSession, url: models.Url):
+    await models.UrlStats.bulk_create(db, [(url.id, utcnow())])
+    await db.commit()
+
+    response = await client.post("/urls/stats", json={"codes": [url.id, "nOnE00"]})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["counts"] == {url.id: 1, "nOnE00": 0}
+
+
+@pytest.mark.asyncio
+async def test_stats_series_too_many_points(client: AsyncClient, url: models.Url):
+    response = await client.get(
+        f"/urls/{url.id}/stats/series", params={"granularity": "minute", "start": "2020-01-01T00:00:00"}
+    )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_stats_window_naive_boundaries_are_utc():
+    naive = stats.stats_window(stats.Granularity.hour, datetime(2026, 10, 18, 0, 0), datetime(2026, 10, 18, 10, 0))
+    aware = stats.stats_window(
+        stats.Granularity.hour,
+        datetime(2026, 10, 18, 0, 0, tzinfo=timezone.utc),
+        datetime(2026, 10, 18, 10, 0, tzinfo=timezone.utc),
+    )
+    assert (
+        naive
+        == aware
+        == (
+            datetime(2026, 10, 18, 0, 0, tzinfo=timezone.utc),
+            datetime(2026, 10, 18, 10, 0, tzinfo=timezone.utc),
+        )
+    )
@@ -1,8 +1,20 @@
+import asyncio
+import json
+from datetime import timedelta
+from unittest import mock
+
 import pytest
 from fastapi import status
 from httpx import AsyncClient
 
 from app.apps.urls import models
+from app.apps.urls.api.urls import MISSING_URL, redis_set_many, wait_for_url_lookup
+from app.apps.urls.cache import listen_invalidations, missing_urls, url_cache
+from app.apps.urls.redirects import Redirect
+from app.config import settings
+from app.deps import redis, redis_breaker, redis_raw
+from app.redis_client import CIRCUIT_CLOSED
+from app.utils import utcnow
 from tests.urls.conftest import get_url_data
 
 
@@ -27,3 +39,170 @@ async def test_create_url(client: AsyncClient):
 
     response_json = response.json()
     assert "url_short" in response_json
+
+
+async def test_redirect_from_local_cache(client: AsyncClient):
+    url_cache.set("CaChEd", Redirect("http://example.com/cached"))
+
+    response = await client.get("/urls/CaChEd")
+    assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+    assert response.headers["location"] == "http://example.com/cached"
+
+
+async def test_update_url_invalidates_local_cache(client: AsyncClient, url: models.Url):
+    url_cache.set(url.id, Redirect(url.url))
+
+    response = await client.put(f"/urls/{url.id}", json={"url": "http://example.com/new"})
+    assert response.status_code == status.HTTP_200_OK
+    assert url_cache.get(url.id) is None
+
+
+async def test_create_urls_bulk(client: AsyncClient):
+    long_urls = [f"http://example.com/{i}" for i in range(5)]
+    response = await client.post("/urls/bulk", json={"urls": [{"url": url} for url in long_urls]})
+    assert response.status_code == status.HTTP_200_OK
+
+    results = response.json()["urls"]
+    assert len(results) == len(long_urls)
+    for long_url, result in zip(long_urls, results):
+        response = await client.get(result["url_short"])
+        assert response.headers["location"] == long_url
+
+
+async def test_create_urls_ndjson(client: AsyncClient):
+    content = '{"url": "http://example.com/1"}\n{"url": "not a url"}\n\n{"url": "http://example.com/2"}'
+    response = await client.post("/urls/bulk/ndjson", content=content)
+    assert response.status_code == status.HTTP_200_OK
+
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [result["url_short"] is not None for result in results] == [True, False, True]
+    assert results[1]["error"]
+
+
+async def test_redirect_url_from_db(client: AsyncClient, url: models.Url):
+    url_cache.invalidate(url.id)
+    await redis.delete(settings.REDIS_URL_KEY.format(url.id))
+
+    response = await client.get(f"/urls/{url.id}")
+    assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+    assert response.headers["location"] == url.url
+
+
+async def test_concurrent_redirects_share_db_lookup(client: AsyncClient, url: models.Url):
+    url_cache.invalidate(url.id)
+    await redis.delete(settings.REDIS_URL_KEY.format(url.id), settings.REDIS_LOOKUP_LOCK_KEY.format(url.id))
+
+    with mock.patch.object(models.Url, "get_redirect", wraps=models.Url.get_redirect) as get_redirect:
+        responses = await asyncio.gather(*(client.get(f"/urls/{url.id}") for _ in range(5)))
+
+    assert all(response.headers["location"] == url.url for response in responses)
+    assert get_redirect.call_count == 1
+
+
+async def test_wait_for_url_lookup_of_other_worker():
+    await redis.set(settings.REDIS_LOOKUP_LOCK_KEY.format("LoCkEd"), 1, px=settings.REDIS_LOOKUP_LOCK_TTL)
+    asyncio.get_running_loop().call_later(
+        0.02,
+        asyncio.ensure_future,
+        redis.set(settings.REDIS_URL_KEY.format("LoCkEd"), "http://example.com/locked", ex=60),
+    )
+
+    redirect_url, ttl = await wait_for_url_lookup("LoCkEd")
+    assert redirect_url == "http://example.com/locked"
+    assert 0 < ttl <= 60_000
+    await redis.delete(settings.REDIS_URL_KEY.format("LoCkEd"), settings.REDIS_LOOKUP_LOCK_KEY.format("LoCkEd"))
+
+
+async def test_redirect_nonexistent_url_is_cached(client: AsyncClient):
+    missing_urls.invalidate("NoNe00")
+    await redis.delete(settings.REDIS_URL_KEY.format("NoNe00"))
+
+    with mock.patch.object(models.Url, "get_redirect", wraps=models.Url.get_redirect) as get_redirect:
+        for _ in range(3):
+            response = await client.get("/urls/NoNe00")
+            assert response.status_code == status.HTTP_404_NOT_FOUND
+            missing_urls.invalidate("NoNe00")  # Второй раз отметку должны найти в Redis
+            await asyncio.sleep(0.01)
+
+    assert get_redirect.call_count == 1
+    assert await redis.get(settings.REDIS_URL_KEY.format("NoNe00")) == MISSING_URL
+
+
+async def test_new_url_clears_missing_mark(client: AsyncClient):
+    await redis.set(settings.REDIS_URL_KEY.format("NeW000"), MISSING_URL)
+    missing_urls.set("NeW000", True)
+
+    await redis_set_many({"NeW000": ("http://example.com/new", models.default_expires_at())})
+    assert missing_urls.get("NeW000") is None
+
+    response = await client.get("/urls/NeW000")
+    assert response.headers["location"] == "http://example.com/new"
+    await redis.delete(settings.REDIS_URL_KEY.format("NeW000"))
+
+
+async def test_redirect_bypasses_redis_when_circuit_is_open(client: AsyncClient, url: models.Url):
+    url_cache.invalidate(url.id)
+    redis_breaker._open()  # pylint: disable=protected-access
+    try:
+        with mock.patch.object(redis_raw, "execute_command") as execute_command:
+            response = await client.get(f"/urls/{url.id}")
+    finally:
+        redis_breaker.state = CIRCUIT_CLOSED
+
+    assert response.headers["location"] == url.url
+    execute_command.assert_not_called()
+
+
+async def test_redirect_from_precomputed_response(client: AsyncClient, monkeypatch):
+    monkeypatch.setattr(settings, "REDIRECT_STATUS_CODE", status.HTTP_301_MOVED_PERMANENTLY)
+    url_cache.set("PrEcMp", Redirect("http://example.com/путь?q=a b"))
+    misses = url_cache.misses
+
+    response = await client.get("/urls/PrEcMp")
+    assert response.status_code == status.HTTP_301_MOVED_PERMANENTLY
+    assert response.headers["location"] == "http://example.com/%D0%BF%D1%83%D1%82%D1%8C?q=a%20b"
+    assert response.headers["content-length"] == "0"
+
+    # Ручки под /urls/ с вложенным путём не ищутся в кеше редиректов
+    await client.get("/urls/PrEcMp/stats")
+    assert url_cache.misses == misses
+
+
+async def test_url_stops_resolving_at_expires_at(client: AsyncClient):
+    expires_at = utcnow() + timedelta(seconds=0.5)
+    response = await client.post(
+        "/urls", json={"url": "http://example.com/expiring", "expires_at": expires_at.isoformat()}
+    )
+    short_code = response.json()["url_short"].rsplit("/", 1)[1]
+
+    response = await client.get(f"/urls/{short_code}")
+    assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+
+    # Ни url_cache, ни Redis не держат ссылку дольше её срока, а в БД она ещё есть, но уже не находится
+    await asyncio.sleep(0.6)
+    response = await client.get(f"/urls/{short_code}")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_create_url_with_past_expires_at(client: AsyncClient):
+    expires_at = utcnow() - timedelta(seconds=1)
+    response = await client.post("/urls", json={"url": "http://example.com/", "expires_at": expires_at.isoformat()})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+async def test_invalidation_listener_keeps_cache_on_idle_channel():
+    with mock.patch.object(settings, "REDIS_PUBSUB_HEALTH_CHECK_INTERVAL", 0.05):
+        listener = asyncio.create_task(listen_invalidations())
+        await asyncio.sleep(0.2)  # После подписки кеши очищаются
+        url_cache.set("IdLe00", Redirect("http://example.com/idle"))
+
+        # Дольше таймаута чтения обычных клиентов Redis и паузы перед переподключением
+        await asyncio.sleep(settings.REDIS_SOCKET_TIMEOUT + 1.5)
+        assert url_cache.get("IdLe00") is not None
+
+        await redis.publish(settings.REDIS_INVALIDATION_CHANNEL, "IdLe00")
+        await asyncio.sleep(0.2)
+        assert url_cache.get("IdLe00") is None
+
+    listener.cancel()
+    await asyncio.gather(listener, return_exceptions=True)
@@ -0,0 +1,27 @@
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.apps.urls import models
+from app.apps.urls.warmup import warm_up
+from app.config import settings
+from app.deps import redis
+from app.utils import utcnow
+
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.mark.parametrize("source", ["clicks", "recent"])
+async def test_warm_up_loads_urls_into_redis(db: AsyncSession, url: models.Url, source: str):
+    await models.UrlStats.bulk_create(db, [(url.id, utcnow())])
+    await redis.delete(settings.REDIS_URL_KEY.format(url.id))
+
+    assert await warm_up(await db.connection(), source, limit=1000) >= 1
+    assert await redis.get(settings.REDIS_URL_KEY.format(url.id)) == url.url
+
+
+async def test_warm_up_keeps_newer_redis_values(db: AsyncSession, url: models.Url):
+    await redis.set(settings.REDIS_URL_KEY.format(url.id), "http://example.com/newer")
+
+    await warm_up(await db.connection(), "recent", limit=1000)
+    assert await redis.get(settings.REDIS_URL_KEY.format(url.id)) == "http://example.com/newer"